@@ -0,0 +1,3 @@
+"""
+Fixed-seed benchmarks of the simulator; run with `python -m benchmarks.run`.
+"""
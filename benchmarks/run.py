@@ -0,0 +1,353 @@
+"""
+Benchmark suite covering the simulator's scaling dimensions.
+
+Scenarios are full headless simulations that sweep one parameter at a time (node count, transaction
+modeling, transactions per node per iteration, connections per node and malicious node ratio) around a
+fixed base configuration. Micro-benchmarks time the hot paths (`send_to`, `broadcast`, `consume`, `get_peer`, address
+table inserts and `FullTxModel.update_mempool`) in isolation.
+
+Every benchmark runs in its own process with fixed seeds, so that peak RSS is measured per benchmark and
+global state such as `NodeStorage` does not leak between them. Results are written as JSON:
+
+    python -m benchmarks.run -o bench.json
+    python -m benchmarks.run --only nodes --iters 1000
+"""
+
+import argparse
+import copy
+import json
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+BASE_CONFIG = {
+    'sim_name': 'bench',
+    'results_directory': None,  # temporary directory of the worker
+    'log_level': 'CRITICAL',
+    'sim_reps': 1,
+    'sim_iters': 2000,
+    'iter_seconds': 0.1,
+    'block_int_iters': 500,
+    'block_reward': 100,
+    'dynamic_difficulty': False,
+    'max_block_size': 100000,
+    'tx_modeling': 'Simple',
+    'tx_per_node_per_iter': 1,
+    'connections_per_node': 5,
+    'topology': 'random_k_out',
+    'nodes_in_each_region': 12,
+    'malicious_nodes_ratio': 0,
+    'add_malicious_nodes': False,
+    'nodes': [
+        {'count': 189, 'region': 'CH', 'region_mine_power': 70.74, 'mining_strategy': 'Honest', 'node_mode': 'Miner'},
+        {'count': 1892, 'region': 'US', 'region_mine_power': 7.87, 'mining_strategy': 'Honest', 'node_mode': 'Miner'},
+        {'count': 251, 'region': 'RU', 'region_mine_power': 7.50, 'mining_strategy': 'Honest', 'node_mode': 'Miner'},
+        {'count': 5, 'region': 'KZ', 'region_mine_power': 6.71, 'mining_strategy': 'Honest', 'node_mode': 'Miner'},
+        {'count': 19, 'region': 'ML', 'region_mine_power': 4.71, 'mining_strategy': 'Honest', 'node_mode': 'Miner'},
+        {'count': 316, 'region': 'CN', 'region_mine_power': 0.89, 'mining_strategy': 'Honest', 'node_mode': 'Miner'},
+        {'count': 1769, 'region': 'GE', 'region_mine_power': 0.61, 'mining_strategy': 'Honest', 'node_mode': 'Miner'},
+        {'count': 32, 'region': 'NR', 'region_mine_power': 0.52, 'mining_strategy': 'Honest', 'node_mode': 'Miner'},
+    ],
+}
+"""Configuration every scenario starts from; independent of `config.yaml` so results stay comparable."""
+
+SCENARIOS = {
+    'nodes_32': {'nodes_in_each_region': 4},
+    'nodes_96': {'nodes_in_each_region': 12},
+    'nodes_320': {'nodes_in_each_region': 40},
+    'tx_none': {'tx_modeling': 'None'},
+    'tx_simple': {'tx_modeling': 'Simple'},
+    'tx_full': {'tx_modeling': 'Full'},
+    'tx_rate_0': {'tx_modeling': 'Full', 'nodes_in_each_region': 4, 'tx_per_node_per_iter': 0},
+    'tx_rate_1': {'tx_modeling': 'Full', 'nodes_in_each_region': 4, 'tx_per_node_per_iter': 1},
+    'tx_rate_4': {'tx_modeling': 'Full', 'nodes_in_each_region': 4, 'tx_per_node_per_iter': 4},
+    'connections_2': {'connections_per_node': 2},
+    'connections_8': {'connections_per_node': 8},
+    'malicious_0.1': {'add_malicious_nodes': True, 'malicious_nodes_ratio': 0.1},
+    'malicious_0.3': {'add_malicious_nodes': True, 'malicious_nodes_ratio': 0.3},
+}
+"""Overrides of `BASE_CONFIG` for every scenario."""
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the current process in MB."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def run_scenario(name: str, seed: int, iters: int = None) -> dict:
+    """
+    Run one scenario headless and return its throughput.
+    * name (str): Key of `SCENARIOS`.
+    * seed (int): Master seed of the run, see `sim.rng`.
+    * iters (int): Overrides the number of simulation steps.
+    """
+    from zelig import Simulation
+
+    config = copy.deepcopy(BASE_CONFIG)
+    config.update(SCENARIOS[name])
+    config['sim_name'] = name
+    config['seed'] = seed
+    if iters is not None:
+        config['sim_iters'] = iters
+    with tempfile.TemporaryDirectory() as results_dir:
+        config['results_directory'] = results_dir
+        summary = Simulation(config=config).run(headless=True)[0]
+    return {
+        'nodes': summary['nodes'],
+        'iters': summary['iters'],
+        'wall_seconds': summary['wall_seconds'],
+        'ticks_per_sec': summary['iters'] / summary['wall_seconds'],
+        'messages': summary['messages'],
+        'messages_per_sec': summary['messages'] / summary['wall_seconds'],
+        'blocks': summary['blocks'],
+    }
+
+
+def _network(n: int, tx_model, connections: int = 5):
+    """Returns a simulation with `n` connected honest miners that are ready to step."""
+    from zelig import Simulation
+    from bitcoin.models import Miner
+    from bitcoin.mining_strategies import HonestMining
+    from sim import rng, topology
+    from sim.util import Region
+
+    sim = Simulation()
+    sim.set_log_level('CRITICAL')
+    sim.tx_modeling = tx_model
+    regions = list(Region)
+    for i in range(n):
+        miner = Miner(f'BENCH_{i}', 1, regions[i % len(regions)], sim.iter_seconds)
+        miner.mine_strategy = HonestMining()
+        miner.node_storage = sim.node_storage
+        sim.add_node(miner)
+        sim.node_storage.add(miner)
+    edges = topology.random_k_out(n, connections, rng.streams.numpy_stream('topology'))
+    topology.connect_edges(sim.nodes, edges, handshake=False)
+    return sim
+
+
+def _rate(fn, number: int) -> float:
+    start = time.perf_counter()
+    fn(number)
+    return number / (time.perf_counter() - start)
+
+
+def micro_send_to(number: int) -> float:
+    from bitcoin.messages import PingMessage
+    from bitcoin.tx_modelings import NoneTxModel
+
+    a, b = _network(2, NoneTxModel()).nodes
+
+    def bench(k):
+        for i in range(k):
+            a.send_to(b, PingMessage(a.id))
+            if i % 1000 == 0:
+                b.inbox.clear()
+                a.last_reveal_times.clear()
+    return _rate(bench, number)
+
+
+def micro_broadcast(number: int) -> float:
+    from bitcoin.messages import InvMessage
+    from bitcoin.tx_modelings import NoneTxModel
+
+    nodes = _network(9, NoneTxModel()).nodes
+    a = nodes[0]
+    inv = InvMessage(a.id, 'tx', a.id)
+
+    def bench(k):
+        for i in range(k):
+            a.broadcast(inv, nodes[1:])
+            if i % 1000 == 0:
+                for node in nodes:
+                    node.inbox.clear()
+                a.last_reveal_times.clear()
+    return _rate(bench, number)
+
+
+def micro_consume(number: int) -> float:
+    from bitcoin.messages import PingMessage
+    from bitcoin.tx_modelings import NoneTxModel
+
+    a, b = _network(2, NoneTxModel()).nodes
+    b.message_storage.enabled = False
+    ping = PingMessage(a.id)
+
+    def bench(k):
+        for i in range(k):
+            b.consume(ping)
+            if i % 1000 == 0:
+                a.inbox.clear()
+                b.last_reveal_times.clear()
+    return _rate(bench, number)
+
+
+def micro_get_peer(number: int) -> float:
+    from bitcoin.tx_modelings import NoneTxModel
+
+    nodes = _network(1000, NoneTxModel()).nodes
+    node = nodes[0]
+    for other in nodes[1:]:
+        node.new_table.add(other.id, other.id, 0)
+
+    def bench(k):
+        for i in range(k):
+            node.get_peer(i % 8 + 1)
+    return _rate(bench, number)
+
+
+def micro_new_table_add(number: int) -> float:
+    from bitcoin.tables import NewTable
+    from sim.util import SimpleAddress
+
+    src = SimpleAddress.randomaddress()
+    addrs = [SimpleAddress.randomaddress() for _ in range(number)]
+
+    def bench(k):
+        table = NewTable()
+        for i in range(k):
+            table.add(src, addrs[i], i)
+    return _rate(bench, number)
+
+
+def micro_new_table_add_many(number: int) -> float:
+    from bitcoin.tables import NewTable
+    from sim.util import MAX_ADDR_TO_SEND, SimpleAddress
+
+    src = SimpleAddress.randomaddress()
+    addrs = [SimpleAddress.randomaddress() for _ in range(number)]
+
+    def bench(k):
+        table = NewTable()
+        for i in range(0, k, MAX_ADDR_TO_SEND):
+            table.add_many(src, addrs[i:i + MAX_ADDR_TO_SEND], i)
+    return _rate(bench, number)
+
+
+def micro_tried_table_add(number: int) -> float:
+    from bitcoin.tables import TriedTable
+    from sim.util import SimpleAddress
+
+    addrs = [SimpleAddress.randomaddress() for _ in range(number)]
+
+    def bench(k):
+        table = TriedTable()
+        for i in range(k):
+            table.add(addrs[i], i)
+    return _rate(bench, number)
+
+
+def micro_update_mempool(number: int) -> float:
+    import numpy as np
+    from bitcoin.models import BTCBlock
+    from bitcoin.tx_modelings import FullTxModel, TxModel
+    from sim.bitmap import ChunkedBitmap
+
+    tx_model = FullTxModel()
+    node = _network(1, tx_model).nodes[0]
+    txs = [TxModel.generate(tx_model, node) for _ in range(5000)]
+    for tx in txs:
+        tx_model.add(tx)
+    block = BTCBlock(node, None, 1)
+    block.tx_ids = np.array([tx.index for tx in txs[::5]])
+
+    elapsed = 0
+    for _ in range(number):
+        node.mempool = list(txs)
+        node.tx_pool = ChunkedBitmap()
+        for tx in txs:
+            node.tx_pool.add(tx.index)
+            tx_model.txs[tx.index] = tx
+            tx_model.holders[tx.index] = 1
+        start = time.perf_counter()
+        tx_model.update_mempool(node, block)
+        elapsed += time.perf_counter() - start
+    return number / elapsed
+
+
+MICRO_BENCHMARKS = {
+    'send_to': (micro_send_to, 200000),
+    'broadcast_8': (micro_broadcast, 50000),
+    'consume_ping': (micro_consume, 100000),
+    'get_peer': (micro_get_peer, 100000),
+    'new_table_add': (micro_new_table_add, 100000),
+    'new_table_add_many': (micro_new_table_add_many, 100000),
+    'tried_table_add': (micro_tried_table_add, 100000),
+    'full_update_mempool': (micro_update_mempool, 20),
+}
+"""Micro-benchmarks with their number of operations; each returns operations per second."""
+
+
+def run_micro(name: str, seed: int) -> dict:
+    from sim import rng
+
+    fn, number = MICRO_BENCHMARKS[name]
+    rng.seed(seed)
+    return {'ops': number, 'ops_per_sec': fn(number)}
+
+
+def run_in_subprocess(kind: str, name: str, seed: int, iters: int = None) -> dict:
+    command = [sys.executable, '-m', 'benchmarks.run', '--worker', kind, name, '--seed', str(seed)]
+    if iters is not None:
+        command += ['--iters', str(iters)]
+    output = subprocess.run(command, cwd=ROOT, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulator benchmarks.')
+    parser.add_argument('-o', metavar='filename', default='bench.json', help='Output JSON file (default: bench.json)')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of every benchmark (default: 1)')
+    parser.add_argument('--iters', type=int, help='Override the number of simulation steps of the scenarios')
+    parser.add_argument('--only', metavar='substring', default='', help='Only run benchmarks whose name contains it')
+    parser.add_argument('--no-micro', action='store_true', help='Skip the micro-benchmarks')
+    parser.add_argument('--no-scenarios', action='store_true', help='Skip the scenarios')
+    parser.add_argument('--worker', nargs=2, metavar=('kind', 'name'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        kind, name = args.worker
+        result = run_scenario(name, args.seed, args.iters) if kind == 'scenario' else run_micro(name, args.seed)
+        result['peak_rss_mb'] = peak_rss_mb()
+        print(json.dumps(result))
+        return
+
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'seed': args.seed,
+        'scenarios': dict(),
+        'micro': dict(),
+    }
+    jobs = [] if args.no_scenarios else [('scenario', name) for name in SCENARIOS]
+    jobs += [] if args.no_micro else [('micro', name) for name in MICRO_BENCHMARKS]
+    for kind, name in jobs:
+        if args.only not in name:
+            continue
+        result = run_in_subprocess(kind, name, args.seed, args.iters)
+        results['scenarios' if kind == 'scenario' else 'micro'][name] = result
+        rate = f"{result['ticks_per_sec']:.1f} ticks/s" if kind == 'scenario' else f"{result['ops_per_sec']:.0f} ops/s"
+        print(f'{kind:8} {name:20} {rate:>18} {result["peak_rss_mb"]:8.1f} MB', flush=True)
+
+    with open(args.o, 'w+') as f:
+        json.dump(results, f, indent=2)
+    print(f'Saved results to {args.o}')
+
+
+if __name__ == '__main__':
+    main()
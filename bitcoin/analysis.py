@@ -20,9 +20,12 @@ class Analysis:
 
     def get_all_blocks(self) -> Dict[str, Block]:
         """
-        Returns list of all blocks seen by all the nodes.
-        nodes (List[Node]): List of nodes in the simulation.
+        Returns all mined blocks as headers from the bookkeeper's global block record, which is complete
+        even if nodes pruned their blockchains. Bookkeepers without a record fall back to all blocks seen
+        by all the nodes.
         """
+        if getattr(self.bookkeeper, 'blocks', None):
+            return dict(self.bookkeeper.blocks)
         blocks = dict()
         for node in self.nodes:
             for _, block in node.blockchain.items():
@@ -110,3 +113,32 @@ class Analysis:
             total += head.created_at - block.created_at
             head = block
         return total / count
+
+    def summary(self, sim_seconds: float) -> Dict[str, object]:
+        """
+        Returns a compact, JSON serializable dictionary of the main run metrics.
+        * sim_seconds (float): Total real-world seconds simulated.
+        """
+        all_blocks = self.get_all_blocks()
+        main_chain = self.get_longest_chain(all_blocks) if all_blocks else []
+        rewards = dict()
+        for block in main_chain:
+            rewards[block.miner] = rewards.get(block.miner, 0) + block.reward.value
+        space = [samples[-1] for samples in self.bookkeeper.node_space.values() if samples]
+        tx_model = self.nodes[0].tx_model if self.nodes else None
+        min_feerates = [tx_model.get_min_feerate(node) for node in self.nodes] if tx_model else []
+        return {
+            'nodes': len(self.nodes),
+            'sim_seconds': sim_seconds,
+            'blocks': len(all_blocks),
+            'main_chain_length': len(main_chain),
+            'stale_rate': (len(all_blocks) - len(main_chain)) / len(all_blocks) if all_blocks else 0.0,
+            'tps': self.transactions_per_second(main_chain, sim_seconds) if sim_seconds else 0.0,
+            'rewards': rewards,
+            'space_bytes_mean': sum(space) / len(space) if space else None,
+            'space_bytes_max': max(space) if space else None,
+            'compute': sum(sum(samples) for samples in self.bookkeeper.node_compute.values()),
+            'min_feerate_mean': sum(min_feerates) / len(min_feerates) if min_feerates else 0.0,
+            'min_feerate_max': max(min_feerates, default=0.0),
+            'mempool_evictions': tx_model.get_evictions(self.nodes) if tx_model else 0,
+        }
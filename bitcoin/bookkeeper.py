@@ -1,4 +1,5 @@
 import sys
+from array import array
 from typing import List, Dict
 
 sys.path.append('..')
@@ -10,31 +11,74 @@ class Bookkeeper:
     def __init__(self):
         self.num_tx_in_pool: List[int] = []
         self.node_block_rcvs: Dict[str, Dict[str, int]] = dict()
-        self.node_tx_rcvs: Dict[str, Dict[str, int]] = dict()
-        self.node_compute: Dict[str, List[int]] = dict()
-        self.node_space: Dict[str, List[int]] = dict()
+        self.node_tx_rcv_index: Dict[str, array] = dict()
+        """Indices of the transactions received by every node (see `bitcoin.tx_modelings.FullTxModel`), in receipt order."""
+        self.node_tx_rcv_time: Dict[str, array] = dict()
+        """Receipt times matching `node_tx_rcv_index`."""
+        self.node_compute: Dict[str, array] = dict()
+        """Compute used by every node between resource samples, see `sample_resources`."""
+        self.node_space: Dict[str, array] = dict()
+        """Storage used by every node at each resource sample, in bytes."""
+        self.node_min_feerate: Dict[str, array] = dict()
+        """Minimum feerate accepted by every node's mempool at each resource sample."""
+        self.resource_timestamps = array('q')
+        """Simulation steps of the resource samples."""
+        self.blocks: Dict[str, BlockHeader] = dict()
+        """Global record of all mined blocks in creation order, kept as headers independently of the nodes."""
+        self.block_rcv_times: Dict[str, List[int]] = dict()
+        """First receipt time of every recorded block at each node that received it, in receipt order."""
+
+    def reset(self):
+        """
+        Forget all records, e.g. before a new repetition. Nodes have to register again.
+        """
+        self.__init__()
 
     def register_node(self, node: Node):
         """
         Perform initial setup for node.
         """
         node.bookkeeper = self
-        self.node_tx_rcvs[node.id] = dict()
+        self.node_tx_rcv_index[node.id] = array('I')
+        self.node_tx_rcv_time[node.id] = array('i')
         self.node_block_rcvs[node.id] = dict()
-        self.node_compute[node.id] = []
-        self.node_space[node.id] = []
+        self.node_compute[node.id] = array('d')
+        self.node_space[node.id] = array('d')
+        self.node_min_feerate[node.id] = array('d')
 
     def save_block(self, node: Node, block: Item, timestamp: int):
         """
         Save receipt time of the  given block for the given node.
         """
-        self.node_block_rcvs[node.id][block.id] = timestamp
+        rcvs = self.node_block_rcvs[node.id]
+        if block.id not in rcvs:
+            times = self.block_rcv_times.get(block.id, None)
+            if times is not None:
+                times.append(timestamp)
+        rcvs[block.id] = timestamp
+
+    def record_block(self, block: Block):
+        """
+        Add a newly mined block to the global block record. Must be called before any node receives it.
+        """
+        self.blocks[block.id] = BlockHeader(block)
+        self.block_rcv_times[block.id] = []
 
     def save_tx(self, node: Node, tx: Item, timestamp: int):
         """
         Save receipt time of the given transaction for the given node.
         """
-        self.node_tx_rcvs[node.id][tx.id] = timestamp
+        self.node_tx_rcv_index[node.id].append(tx.index)
+        self.node_tx_rcv_time[node.id].append(timestamp)
+
+    def get_node_tx_rcvs(self, node: Node) -> Dict[int, int]:
+        """
+        Get the first receipt time of every transaction received by given node, with transaction indices as keys.
+        """
+        receipts = dict()
+        for index, timestamp in zip(self.node_tx_rcv_index[node.id], self.node_tx_rcv_time[node.id]):
+            receipts.setdefault(index, timestamp)
+        return receipts
 
     def get_node_block_rcv(self, node: Node, block: Item) -> int:
         """
@@ -42,6 +86,20 @@ class Bookkeeper:
         """
         return self.node_block_rcvs[node.id].get(block.id, 2**64)
 
+    def sample_resources(self, nodes: List[Node], timestamp: int):
+        """
+        Record the storage used by every node and the compute it used since the previous sample.
+        Both are running totals kept by the nodes, so a sample costs O(1) per node.
+        * nodes (List[Node]): Nodes to sample.
+        * timestamp (int): Simulation step of the sample.
+        """
+        self.resource_timestamps.append(timestamp)
+        for node in nodes:
+            self.use_space(node, node.space_use())
+            self.use_compute(node, node.compute)
+            node.compute = 0
+            self.node_min_feerate[node.id].append(node.tx_model.get_min_feerate(node))
+
     def use_compute(self, node: Node, amount: int):
         """
         Record computational power usage (simulated)  by node.
@@ -1,6 +1,5 @@
 from sim.base_models import Node, Item, Reward
 from typing import List
-import random
 
 
 class Oracle:
@@ -44,9 +43,9 @@ class PoWOracle(Oracle):
             self.new_total_mine_power += miner.mine_power
 
         if len(blocks) <= 1:
-            return random.random() <= miner.mine_power / (self.block_interval * self.total_power)
+            return miner.rng.random() <= miner.mine_power / (self.block_interval * self.total_power)
         else:
-            return [random.random() <= (miner.mine_power / len(blocks)) / (self.block_interval * self.total_power)
+            return [miner.rng.random() <= (miner.mine_power / len(blocks)) / (self.block_interval * self.total_power)
                     for _ in blocks]
 
     def compute_total_power(self) -> float:
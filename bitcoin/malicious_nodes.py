@@ -1,8 +1,28 @@
+"""
+Nodes that attack the network.
+
+`EclipseAttacker`s try to fill a victim's connections and address tables: once connected to the victim
+they flood it with ADDR messages of decoy addresses that belong to no node. A swarm of attackers is
+driven by one `EclipseController`, which owns a single shared pool of decoys and wakes attackers only
+when they have messages to consume or an attack attempt is due, instead of stepping every attacker on
+every simulation step.
+"""
+
+from typing import Dict, List, Set
+
+import numpy as np
+
 from bitcoin.models import Miner
-from sim.util import MAX_INCOMING_CONNECTIONS, SimpleAddress
-from typing import List
+from sim import rng
+from sim.util import MAX_ADDR_TO_SEND, MAX_INCOMING_CONNECTIONS, SimpleAddress
 from bitcoin.messages import AddressMessage, VersionMessage
-from bitcoin.mining_strategies import NullMining
+
+ATTACK_INTERVAL = 5 * 60
+"""Simulation steps between the attack attempts of an attacker."""
+FIRST_ATTACK = 100
+"""Simulation steps after its creation before an attacker first attempts an attack."""
+DECOY_POOL_SIZE = 10000
+"""Number of decoy addresses shared by the attackers of an `EclipseController`."""
 
 
 class Decoy:
@@ -18,18 +38,20 @@ class EclipseAttacker(Miner):
         self.name = f'MALICIOUSNODE_{region}'
         self.just_once = False
         self.victim_node = None
-        self.next_attempt = self.timestamp + 100
-        self.decoy_nodes: List[NullMining] = [
-            SimpleAddress.randomaddress() for i in range(1000)]
+        self.next_attempt = self.timestamp + FIRST_ATTACK
+        self.controller: EclipseController = None
+        """Controller driving the attacker, see `EclipseController.add`. Attackers without one only consume messages."""
+        self.slot: int = None
+        """Position of the attacker in its controller's `attackers`."""
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop('controller', None)
+        return state
 
     def step(self, seconds):
         self.timestamp += 1
-        try:
-            items = [packet.payload for packet in self.inbox.pop(
-                self.timestamp)]
-        except KeyError:
-            items = []
-        for item in items:
+        for item in self.pop_inbox():
             self.consume(item)
 
         # tx_count = self.tx_per_iter
@@ -38,18 +60,37 @@ class EclipseAttacker(Miner):
 
         # if self.consensus_oracle.can_mine(self):
         #     self.mine_strategy.generate_block(self)
-        if self.victim_node:
-            if self.next_attempt == self.timestamp:
-                ins = self.ins.values()
-                outs = self.outs.values()
-                if self.victim_node not in ins and self.victim_node in outs:
-                    self.send_to(self.victim_node, AddressMessage(
-                        self.id, self.decoy_nodes))
-                elif self.victim_node not in ins and self.victim_node not in outs:
-                    self.send_to(self.victim_node,
-                                 VersionMessage(self.id, self))
-
-                self.next_attempt = self.timestamp + 5 * 60
+
+    def attack(self):
+        """
+        Attempt to eclipse the victim: connect to it, or flood it with decoy addresses once connected.
+        """
+        victim = self.victim_node
+        if victim.id not in self.ins:
+            if victim.id in self.outs:
+                self.send_to(victim, AddressMessage(self.id, self.controller.decoys(self)))
+            else:
+                self.send_to(victim, VersionMessage(self.id, self))
+        self.next_attempt = self.timestamp + ATTACK_INTERVAL
+
+    def network_step(self, seconds):
+        self.step(seconds)
+
+    def network_state(self) -> dict:
+        state = super().network_state()
+        state['next_attempt'] = self.next_attempt
+        return state
+
+    def reset(self):
+        super().reset()
+        if self.controller is not None:
+            self.controller.watch(self)
+
+    def restore_network_state(self, state: dict):
+        super().restore_network_state(state)
+        self.next_attempt = state['next_attempt']
+        if self.controller is not None:
+            self.controller.watch(self)
 
     def consume(self, item):
         if type(item) == VersionMessage:
@@ -73,3 +114,128 @@ class EclipseAttacker(Miner):
         #         self.ins[item.sender_id] = item.sender_node
         #         self.send_to(item.sender_node, VerAckMessage(self.id, self))
         #         logger.debug(f'[{self.timestamp}] {self.name} <{self.id}> SENT VERACK MESSAGE TO {item.sender_id}')
+
+
+class _AttackerInbox(dict):
+    """Inbox of a controlled attacker that tells its controller when a message is scheduled for a new timestamp."""
+    __slots__ = ('controller', 'attacker')
+
+    def __init__(self, controller, attacker: EclipseAttacker):
+        super().__init__()
+        self.controller = controller
+        self.attacker = attacker
+
+    def __setitem__(self, timestamp, packets):
+        super().__setitem__(timestamp, packets)
+        self.controller.wake(self.attacker, timestamp)
+
+
+class EclipseController:
+    """
+    Drives a swarm of `EclipseAttacker`s against one victim.
+
+    The controller takes the place of its attackers in the simulation loop. It keeps timers with the
+    timestamps at which attackers have messages to consume (reported by their inboxes) or an attack
+    attempt due, and only wakes those attackers. All attackers send their ADDR floods from one shared
+    pool of decoy addresses, drawn at once. Every attacker floods the same window of `MAX_ADDR_TO_SEND`
+    decoys each time, like the private decoy list every attacker used to draw; windows start at a hash
+    of the attacker's position, so they differ between attackers.
+    """
+
+    def __init__(self, victim, decoys: int = DECOY_POOL_SIZE, timestamp: int = 0):
+        """
+        Create an EclipseController object.
+        * victim (`sim.base_models.Node`): Node to eclipse.
+        * decoys (int): Size of the shared decoy pool.
+        * timestamp (int): Current timestamp of the simulation.
+        """
+        self.victim = victim
+        self.timestamp = timestamp
+        self.attackers: List[EclipseAttacker] = []
+        self.timers: Dict[int, Set[int]] = dict()
+        """Dictionary with timestamps as keys and the indices (in `attackers`) of the attackers to wake as values."""
+        rand = rng.streams.numpy_stream('decoys')
+        pool = (rand.integers(1, 1 << 16, size=decoys, dtype=np.int64) << 16) | rand.integers(0, 1 << 16, size=decoys, dtype=np.int64)
+        self.pool: np.ndarray = rand.permutation(np.unique(pool)).astype(np.uint32)
+        """Packed decoy addresses, see `sim.util.SimpleAddress.__int__`."""
+        self.addresses: List[SimpleAddress] = None
+
+    def __contains__(self, node) -> bool:
+        return getattr(node, 'controller', None) is self
+
+    def add(self, attacker: EclipseAttacker):
+        """
+        Take over an attacker.
+        * attacker (`EclipseAttacker`): Attacker to drive; its victim becomes the controller's victim.
+        """
+        attacker.controller = self
+        attacker.victim_node = self.victim
+        attacker.slot = len(self.attackers)
+        self.attackers.append(attacker)
+        self.watch(attacker)
+
+    def watch(self, attacker: EclipseAttacker):
+        """
+        (Re)install the attacker's inbox hook and attack timer, e.g. after its state was reset or restored.
+        * attacker (`EclipseAttacker`): Attacker of the controller.
+        """
+        inbox = _AttackerInbox(self, attacker)
+        for timestamp, packets in attacker.inbox.items():
+            inbox[timestamp] = packets
+        attacker.inbox = inbox
+        self.timestamp = max(self.timestamp, attacker.timestamp)
+        self.wake(attacker, attacker.next_attempt)
+
+    def wake(self, attacker: EclipseAttacker, timestamp: int):
+        """
+        Schedule an attacker to be woken at the given timestamp.
+        * attacker (`EclipseAttacker`): Attacker of the controller.
+        * timestamp (int): Timestamp to wake it at.
+        """
+        try:
+            self.timers[timestamp].add(attacker.slot)
+        except KeyError:
+            self.timers[timestamp] = {attacker.slot}
+
+    def step(self, seconds: float):
+        """
+        Perform one simulation step for all attackers: the ones woken at the new timestamp consume their
+        messages and attack if their attempt is due.
+        * seconds (float): How many real-time seconds one simulation step corresponds to.
+        """
+        self.timestamp += 1
+        due = self.timers.pop(self.timestamp, None)
+        if due is None:
+            return
+        for slot in sorted(due):
+            attacker = self.attackers[slot]
+            attacker.timestamp = self.timestamp
+            for item in attacker.pop_inbox():
+                attacker.consume(item)
+            if attacker.next_attempt == self.timestamp:
+                attacker.attack()
+                self.wake(attacker, attacker.next_attempt)
+
+    def network_step(self, seconds: float):
+        self.step(seconds)
+
+    def sync(self):
+        """
+        Set the timestamps of all attackers to the controller's, e.g. before inspecting them.
+        """
+        for attacker in self.attackers:
+            attacker.timestamp = self.timestamp
+
+    def decoys(self, attacker: EclipseAttacker) -> List[SimpleAddress]:
+        """
+        Returns the attacker's window of `MAX_ADDR_TO_SEND` decoy addresses of the shared pool.
+        * attacker (`EclipseAttacker`): Attacker of the controller.
+        """
+        if self.addresses is None:
+            self.addresses = [SimpleAddress.from_int(packed) for packed in self.pool.tolist()]
+        if not self.addresses:
+            return []
+        count = min(MAX_ADDR_TO_SEND, len(self.addresses))
+        start = (attacker.slot * 2654435761 >> 7) % len(self.addresses)  # Knuth's multiplicative hash
+        window = self.addresses[start:start + count]
+        return window + self.addresses[:count - len(window)]
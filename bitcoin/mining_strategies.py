@@ -41,9 +41,11 @@ class NullMining:
 
         The given block is published to the node's peers if `relay` is True.
         """
-        node.blockchain[block.id] = block
+        node.store_block(block)
         node.bookkeeper.save_block(node, block, node.timestamp)
         node.tx_model.update_mempool(node, block)
+        if node.prune_depth:
+            node.prune(block)
         if relay:
             node.publish_item(block, 'block')
 
@@ -65,6 +67,7 @@ class HonestMining(NullMining):
         block = BTCBlock(node, prev.id, prev.height + 1)
         block = node.tx_model.fill_block(node, block)
         block.reward = node.consensus_oracle.get_reward(node)
+        node.bookkeeper.record_block(block)
         self.receive_block(node, block, relay=True)
         logger.success(f'[{node.timestamp}] {node.name} GENERATED BLOCK {block.id} ==> {prev.id}')
         return block
@@ -102,11 +105,14 @@ class SelfishMining(NullMining):
         block.id = '[SELFISH]' + block.id
         block = node.tx_model.fill_block(node, block)
         block.reward = node.consensus_oracle.get_reward(node)
+        node.bookkeeper.record_block(block)
         logger.success(f'[{node.timestamp}] {node.name} GENERATED BLOCK {block.id} ==> {prev.id}')
 
-        node.private_chain[block.id] = block
+        node.store_block(block, node.private_chain)
         node.bookkeeper.save_block(node, block, node.timestamp)
         node.tx_model.update_mempool(node, block)
+        if node.prune_depth:
+            node.prune(block)
 
         delta_prev = self.get_delta_prev(node)
         node.private_branch_len += 1
@@ -132,6 +138,8 @@ class SelfishMining(NullMining):
 
     def publish_private_chain(self, node: Miner):
         for block in node.private_chain.values():
+            if type(block) == str:  # placeholder of a requested block
+                continue
             node.blockchain[block.id] = block
             node.publish_item(block, 'block')
 
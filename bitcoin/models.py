@@ -2,29 +2,37 @@
 Main implementation of the Bitcoin simulator.
 """
 
-from sim.util import MAX_INCOMING_CONNECTIONS, MAX_OUTGOING_CONNECTIONS, SimpleAddress
+from sim.util import GETADDR_MAX_PCT, MAX_ADDR_TO_SEND, MAX_INCOMING_CONNECTIONS, MAX_OUTGOING_CONNECTIONS, SimpleAddress
+import heapq
 import sys
 
-from typing import Dict
+from typing import Dict, Tuple
 
 sys.path.append("..")
 
 from loguru import logger
 
 from sim.base_models import *
+from sim.bitmap import ChunkedBitmap
+from sim.connections import FEELER, OUTBOUND
 from bitcoin.messages import *
 from bitcoin.consensus import *
 from bitcoin.bookkeeper import *
 
 
 class Transaction(Item):
+    SIZE = 400
+    """Size of every transaction in bytes."""
+
     def __init__(self, sender_id: str, created_at: int, size: float, value: float, fee: float):
         super().__init__(sender_id, 0)
         self.fee: Reward = fee
-        self.size = 400  # bytes
+        self.size = Transaction.SIZE
         self.value = 100
         self.created_at = created_at
         self.feerate = self.fee / self.size
+        self.index: int = None
+        """Dense index of the transaction in the global table of `bitcoin.tx_modelings.FullTxModel`."""
 
     def __str__(self) -> str:
         return f'TX (id:{self.id}, value: {self.value}, feerate: {self.feerate})'
@@ -37,10 +45,55 @@ class Transaction(Item):
         return self.feerate >= other.feerate
 
 
+INCREMENTAL_RELAY_FEERATE = 1E-8
+"""Feerate (BTC per byte) added to the feerate of evicted transactions to get the new minimum feerate."""
+
+
+class RollingMinFeerate:
+    """
+    Minimum feerate a full mempool accepts, modeled on Bitcoin Core's rolling minimum fee: every eviction
+    raises it above the feerate of the evicted transaction, and it decays with a half-life of 12 hours,
+    which shrinks to 6 or 3 hours while the mempool is less than half or a quarter full.
+    """
+    HALFLIFE = 12 * 60 * 60
+
+    def __init__(self):
+        self.value = 0.0
+        self.updated = 0.0
+
+    def bump(self, feerate: float, now: float):
+        """
+        Raise the minimum feerate after evicting a transaction.
+        * feerate (float): Feerate of the evicted transaction.
+        * now (float): Current time in simulated seconds.
+        """
+        self.value = max(self.value, feerate + INCREMENTAL_RELAY_FEERATE)
+        self.updated = now
+
+    def get(self, now: float, usage: float, limit: float) -> float:
+        """
+        Returns the current minimum feerate.
+        * now (float): Current time in simulated seconds.
+        * usage (float): Current mempool size in bytes.
+        * limit (float): Maximum mempool size in bytes.
+        """
+        if self.value and now > self.updated:
+            halflife = self.HALFLIFE / (4 if usage < limit / 4 else 2 if usage < limit / 2 else 1)
+            self.value *= 0.5 ** ((now - self.updated) / halflife)
+            self.updated = now
+            if self.value < INCREMENTAL_RELAY_FEERATE / 2:
+                self.value = 0.0
+        return self.value
+
+
+BLOCK_HEADER_SIZE = 80
+"""Size of a block header in bytes."""
+
+
 class BTCBlock(Block):
     def __init__(self, creator, prev_id: str, height: int):
         super().__init__(creator, prev_id, height)
-        self.size = 80  # size of block header in bytes
+        self.size = BLOCK_HEADER_SIZE
 
 
 class Miner(Node):
@@ -60,14 +113,34 @@ class Miner(Node):
         self.mine_power = mine_power
         self.max_block_size = 1
         self.tx_per_iter = 0
+        self.prune_depth = 0
+        """Keep full blocks only within this many blocks of the tip and headers beyond it (0 keeps all blocks)."""
+        self.tip_height = 0
+        self.full_blocks: List[Tuple[int, str]] = []  # heapq of (height, id) of the blocks not pruned yet
+
+        # --- RESOURCE USE (running totals) ---
+        self.chain_bytes = 0
+        """Bytes of the blocks and headers stored by the node."""
+        self.mempool_bytes = 0
+        """Bytes of the transactions in the node's own mempool."""
+        self.compute = 0
+        """Transactions validated since the last resource sample, see `Bookkeeper.sample_resources`."""
 
         # --- MODULES ---
         self.tx_model = None
         self.mine_strategy = None
         self.consensus_oracle: Oracle = None
 
-        self.mempool: List[Transaction] = []  # heapq
-        self.tx_ids: Dict[str, Transaction] = dict()
+        self.mempool: List[Transaction] = []  # heapq, may hold transactions no longer in `tx_pool`
+        self.mempool_low: List[Tuple[float, int]] = []  # heapq of (feerate, tx index) for eviction, lazily deleted too
+        self.tx_pool = ChunkedBitmap()
+        """Indices of the transactions in the node's mempool."""
+        self.tx_seen = ChunkedBitmap()
+        """Indices of the transactions the node has received or requested."""
+        self.max_mempool_bytes = 0
+        """Maximum size of the mempool in bytes (0 for no limit)."""
+        self.min_feerate = RollingMinFeerate()
+        self.evictions = 0
 
         # --- BOOKKEEPING ---
         self.bookkeeper: Bookkeeper = None
@@ -77,6 +150,7 @@ class Miner(Node):
     def __getstate__(self):
         state = super().__getstate__()
         del state['mempool']
+        del state['mempool_low']
         del state['bookkeeper']
         return state
 
@@ -84,41 +158,97 @@ class Miner(Node):
         """Reset state back to simulation start."""
         super().reset()
         self.mempool = []
-        self.tx_ids = dict()
+        self.mempool_low = []
+        self.tx_pool = ChunkedBitmap()
+        self.tx_seen = ChunkedBitmap()
+        self.min_feerate = RollingMinFeerate()
+        self.evictions = 0
+        self.tip_height = 0
+        self.full_blocks = []
+        self.chain_bytes = 0
+        self.mempool_bytes = 0
+        self.compute = 0
         self.bookkeeper.register_node(self)  # to reset stats
 
     def step(self, seconds: float):
-        self.ping_peers()
-        self.remove_stale_nodes()
-        items = super().step(seconds)
+        self.network_step(seconds)
+        self.generate_transactions()
+        self.mine()
+
+    def network_step(self, seconds: float):
+        for addr in self.pop_keepalive_timers():
+            self.keepalive(addr)
+        if self.tried_table.collisions:
+            self.test_tried_collisions()
+        self.drain_inbox(super().step(seconds))
+
+    def space_use(self) -> float:
+        """
+        Returns the bytes of blocks and transactions stored by the node.
+        """
+        return self.chain_bytes + self.tx_model.get_mempool_size(self)
+
+    def store_block(self, block: Block, chain: Dict[str, Block] = None):
+        """
+        Store a full block, accounting for its storage and validation unless it is already stored.
+        * block (`sim.base_models.Block`): Block to store.
+        * chain (Dict[str, Block]): Chain to store it in. Defaults to the node's blockchain.
+        """
+        chain = self.blockchain if chain is None else chain
+        if not isinstance(chain.get(block.id, None), Block):
+            self.chain_bytes += block.size
+            self.compute += block.tx_count
+        chain[block.id] = block
+
+    def drain_inbox(self, items: List[Item]):
         for item in items:
             self.consume(item)
 
+    def generate_transactions(self):
         # TODO
         # tx_count = math.ceil(random.gauss(self.tx_per_iter, self.tx_per_iter / 10))
         tx_count = self.tx_per_iter
-        for c in range(tx_count):
-            self.tx_model.generate(self)
+        self.tx_model.generate_many(self, tx_count)
 
+    def mine(self):
         if self.consensus_oracle.can_mine(self):
             self.mine_strategy.generate_block(self)
 
-        # TODO: performance
-        # space_use = sum([block.size for block in self.blockchain.values() if block != 'placeholder'])
-        # space_use += self.tx_model.get_mempool_size(self)
-        # self.bookkeeper.use_space(self, space_use)
-
-    def ping_peers(self):
-        for addr, node in self.outs.items():
-            timestamp = self.tried_table.data[addr]['object'].timestamp
-            if self.timestamp - timestamp > 20 * 60:
+    def keepalive(self, addr):
+        """
+        Check an outgoing connection whose keepalive timer fired: drop it after `sim.util.STALE_TIMEOUT`
+        seconds of silence, ping it once after `sim.util.PING_INTERVAL` seconds of silence, and schedule the
+        next check. Any message from the peer refreshes its tried table timestamp and so postpones the next
+        check; a peer whose entry was evicted from the tried table counts as silent since the connection was
+        established.
+        * addr (`sim.util.SimpleAddress`): Id of the connected node.
+        """
+        node = self.outs.get(addr, None)
+        if node is None:
+            self.keepalive_due.pop(addr, None)
+            self.connected_at.pop(addr, None)
+            return
+        last_seen = self.last_seen(addr)
+        silence = self.timestamp - last_seen
+        if silence > self.stale_steps:
+            self.outs.pop(addr)
+            self.keepalive_due.pop(addr, None)
+            self.connected_at.pop(addr, None)
+        elif silence > self.ping_steps:
+            self.send_to(node, PingMessage(self.id))
+            self.schedule_keepalive(addr, min(self.timestamp + self.ping_steps, last_seen + self.stale_steps + 1))
+        else:
+            self.schedule_keepalive(addr, last_seen + self.ping_steps + 1)
+
+    def test_tried_collisions(self):
+        """
+        Ping the eviction candidates of pending tried table collisions and settle the ones that are due.
+        """
+        for addr in self.tried_table.untested_collisions():
+            node = self.node_storage.get_node(addr)
+            if node is not None:
                 self.send_to(node, PingMessage(self.id))
-
-    def remove_stale_nodes(self):
-        for node in self.outs.copy():
-            timestamp = self.tried_table.data[node]['object'].timestamp
-            if self.timestamp - timestamp > 40 * 60:
-                self.outs.pop(node)
+        self.tried_table.resolve_collisions(self.timestamp)
 
     def consume(self, item: Item):
         """
@@ -132,7 +262,7 @@ class Miner(Node):
 
         snode = self.node_storage.get_node(item.sender_id)
 
-        if snode and snode.id in self.tried_table.data and type(item) != VersionMessage:
+        if snode and snode.id in self.tried_table and type(item) != VersionMessage:
             self.tried_table.update(snode.id, self.timestamp)
 
         if type(item) == BTCBlock:
@@ -148,19 +278,19 @@ class Miner(Node):
                     self.blockchain[item.item_id] = 'placeholder'  # not none
                     self.send_to(snode, GetDataMessage(item.item_id, item.type, self.id))
             elif item.type == 'tx':
-                if self.tx_ids.get(item.item_id, None) is None:
+                if self.tx_model.request(self, item.item_id):
                     logger.debug(f'[{self.timestamp}] {self.name} <{self.id}> RESPONDED WITH GETDATA')
-                    self.tx_ids[item.item_id] = True
                     self.send_to(snode, GetDataMessage(item.item_id, item.type, self.id))
         elif type(item) == GetDataMessage:
             logger.debug(f'[{self.timestamp}] {self.name} <{self.id}> RECEIVED GETDATA MESSAGE FOR {item.type} {item.item_id}')
             if item.type == 'block':
-                try:
-                    self.send_to(snode, self.blockchain[item.item_id])
-                except KeyError:
-                    pass
+                block = self.blockchain.get(item.item_id, None)
+                if block is not None and not isinstance(block, BlockHeader):  # pruned blocks cannot be served
+                    self.send_to(snode, block)
             elif item.type == 'tx':
-                self.send_to(snode, self.tx_ids[item.item_id])
+                tx = self.tx_model.get_tx(self, item.item_id)
+                if tx is not None:
+                    self.send_to(snode, tx)
         elif type(item) == PingMessage:
             logger.debug(f'[{self.timestamp}] {self.name} <{self.id}> RECEIVED PING MESSAGE FROM {item.sender_id}')
             self.send_to(snode, PongMessage(self.id))
@@ -175,29 +305,64 @@ class Miner(Node):
                 logger.debug(f'[{self.timestamp}] {self.name} <{self.id}> SENT VERACK MESSAGE TO {item.sender_id}')
         elif type(item) == VerAckMessage:
             logger.debug(f'[{self.timestamp}] {self.name} <{self.id}> RECIEVED VERACK MESSAGE FROM {item.sender_id}')
+            kind = self.connections.complete(item.sender_id)
+            if kind == FEELER:  # the address works, close the connection again
+                self.fill_tried_table([item.sender_id])
+                self.tried_table.good(item.sender_id, self.timestamp)
+                snode.ins.pop(self.id, None)
+                return
             # if len(self.outs) < util.MAX_OUTGOING_CONNECTIONS
             self.outs[item.sender_id] = snode
+            self.connected_at[item.sender_id] = self.timestamp
+            self.tried_table.good(item.sender_id, self.timestamp)
+            self.schedule_keepalive(item.sender_id, self.timestamp + self.ping_steps + 1)
+            if kind == OUTBOUND:
+                self.send_to(snode, GetAddrMessage(self.id))
+                self.expect_addrs(item.sender_id)
             # snode.connect(self)
         elif type(item) == AddressMessage:
             logger.debug(f'[{self.timestamp}] {self.name} <{self.id}> RECIEVED ADDRESS MESSAGE FROM {item.sender_id}')
             # if len(item.value) < 10:
             #     for node in random.choices(list(self.outs.values()), k=2):
             #         self.send_to(node, item)
-            self.fill_new_table(item.sender_id, item.value)
+            self.fill_new_table(item.sender_id, self.rate_limit_addrs(item.sender_id, item.value))
         elif type(item) == GetAddrMessage:
             logger.debug(f'[{self.timestamp}] {self.name} <{self.id}> RECIEVED GET ADDRESS MESSAGE FROM {item.sender_id}')
-            addrs = self.tried_table.data.keys()
+            # sampled when the request is handled, so the response does not change in flight
+            count = min(MAX_ADDR_TO_SEND, len(self.tried_table) * GETADDR_MAX_PCT // 100)
+            addrs = self.tried_table.sample(count, self.rng)
             self.send_to(snode, AddressMessage(self.id, addrs))
 
+    def prune(self, block: Block):
+        """
+        Track a newly stored full block and replace the blocks that fell more than `prune_depth` blocks
+        below the tip with their headers. Headers are shared with the bookkeeper's global block record.
+        * block (`sim.base_models.Block`): Block just added to the node's blockchain.
+        """
+        heapq.heappush(self.full_blocks, (block.height, block.id))
+        self.tip_height = max(self.tip_height, block.height)
+        private_chain = getattr(self, 'private_chain', None)
+        while self.full_blocks and self.full_blocks[0][0] <= self.tip_height - self.prune_depth:
+            _, block_id = heapq.heappop(self.full_blocks)
+            full = self.blockchain.get(block_id, None)
+            if full is None and private_chain is not None:
+                full = private_chain.get(block_id, None)
+            if full is None or isinstance(full, (str, BlockHeader)):
+                continue
+            header = self.bookkeeper.blocks.get(block_id, None) or BlockHeader(full)
+            self.chain_bytes -= full.size - BLOCK_HEADER_SIZE
+            if block_id in self.blockchain:
+                self.blockchain[block_id] = header
+            if private_chain is not None and block_id in private_chain:
+                private_chain[block_id] = header
+
     def publish_item(self, item: Item, item_type: str):
         """
         Publishes an item over all of the node's outgoing connections.
         * item (`sim.base_models.Item`): Item to publish.
         * item_type (str): Item's type (e.g. 'block').
         """
-        msg = InvMessage(item.id, item_type, self.id)
-        for node in self.outs.values():
-            self.send_to(node, msg)
+        self.broadcast(InvMessage(item.id, item_type, self.id))
 
     def print_blockchain(self, head: Block = None):
         head = self.mine_strategy.choose_head(self)
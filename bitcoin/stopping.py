@@ -0,0 +1,167 @@
+"""
+Early termination of runs once the tracked metrics are estimated precisely enough.
+
+`sim_iters` only bounds the length of a run. Every `check_every_blocks` mined blocks, `StoppingRule`
+computes confidence intervals of the tracked metrics from the bookkeeper's global block record, and
+the run stops as soon as every interval is narrower than its configured width. A wall-clock budget
+ends the run regardless of convergence. Either way the run is saved like a complete one.
+
+Tracked metrics:
+
+* `stale_rate`: share of settled blocks that are not on the main chain (Wilson score interval);
+* `median_propagation`: median over settled blocks of the iterations a block needs to reach half of the
+  nodes (distribution-free interval from order statistics);
+* `selfish_revenue_share`: share of settled main chain blocks mined by nodes using `SelfishMining`
+  (Wilson score interval); only tracked if there are such nodes.
+
+Blocks fewer than `confirmations` blocks below the tip are not settled and left out. The intervals treat
+blocks as independent samples, which neighbouring forks are not quite, so prefer tight widths.
+"""
+
+import math
+import time
+from statistics import NormalDist
+from typing import Dict, List, Tuple
+
+from bitcoin.bookkeeper import Bookkeeper
+from bitcoin.mining_strategies import SelfishMining
+
+METRICS = ('stale_rate', 'median_propagation', 'selfish_revenue_share')
+
+
+def wilson_interval(successes: int, trials: int, z: float) -> Tuple[float, float]:
+    """
+    Returns the Wilson score interval of a proportion.
+    * successes (int): Number of successes.
+    * trials (int): Number of trials.
+    * z (float): Standard normal quantile of the confidence level.
+    """
+    if trials == 0:
+        return 0.0, 1.0
+    p = successes / trials
+    denominator = 1 + z ** 2 / trials
+    center = (p + z ** 2 / (2 * trials)) / denominator
+    half = z / denominator * math.sqrt(p * (1 - p) / trials + z ** 2 / (4 * trials ** 2))
+    return max(0.0, center - half), min(1.0, center + half)
+
+
+def median_interval(values: List[float], z: float) -> Tuple[float, float]:
+    """
+    Returns a distribution-free confidence interval of the median from the order statistics of a sample,
+    or None if the sample is too small for the confidence level.
+    * values (List[float]): Sorted sample.
+    * z (float): Standard normal quantile of the confidence level.
+    """
+    n = len(values)
+    lower = math.floor(n / 2 - z * math.sqrt(n) / 2)
+    upper = math.ceil(n / 2 + z * math.sqrt(n) / 2)
+    if lower < 1 or upper > n:
+        return None
+    return values[lower - 1], values[upper - 1]
+
+
+class StoppingRule:
+    """Stops a run once the confidence intervals of the tracked metrics are narrow enough."""
+
+    def __init__(self, max_widths: Dict[str, float] = None, check_every_blocks: int = 10, min_blocks: int = 30,
+                 confidence: float = 0.95, confirmations: int = 6, wall_seconds: float = None):
+        """
+        Create a StoppingRule object.
+        * max_widths (Dict[str, float]): Maximum confidence interval width of every tracked metric, with metric
+          names (see `METRICS`) as keys. Without widths, only the wall-clock budget stops the run.
+        * check_every_blocks (int): Evaluate the intervals every this many mined blocks.
+        * min_blocks (int): Never stop on convergence before this many blocks were mined.
+        * confidence (float): Confidence level of the intervals.
+        * confirmations (int): Depth below the tip at which blocks count as settled.
+        * wall_seconds (float): Wall-clock budget of a repetition in seconds (None for no budget).
+        """
+        self.max_widths = dict(max_widths or dict())
+        for name in self.max_widths:
+            if name not in METRICS:
+                raise ValueError(f'Unknown stopping metric {name}, expected one of {", ".join(METRICS)}')
+        self.check_every_blocks = check_every_blocks
+        self.min_blocks = min_blocks
+        self.z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.confirmations = confirmations
+        self.wall_seconds = wall_seconds
+        self.start()
+
+    def start(self):
+        """
+        Reset the rule at the start of a repetition.
+        """
+        self.start_time = time.time()
+        self.next_check = max(self.check_every_blocks, self.min_blocks)
+        self.estimates: Dict[str, Dict[str, float]] = dict()
+        """Latest estimates with metric names as keys and dictionaries of value, low, high, width and samples as values."""
+
+    def check(self, bookkeeper: Bookkeeper, nodes: List) -> str:
+        """
+        Returns the reason to stop the run now, or None to continue; call it after every step.
+        * bookkeeper (`Bookkeeper`): Bookkeeper of the run.
+        * nodes (List[`Node`]): All nodes of the simulation.
+        """
+        if self.wall_seconds is not None and time.time() - self.start_time >= self.wall_seconds:
+            return 'wall_clock'
+        blocks = len(bookkeeper.blocks)
+        if not self.max_widths or blocks < self.next_check:
+            return None
+        self.next_check = blocks + self.check_every_blocks
+        self.estimates = self.estimate(bookkeeper, nodes)
+        selfish = any(isinstance(node.mine_strategy, SelfishMining) for node in nodes)
+        for name, max_width in self.max_widths.items():
+            if name == 'selfish_revenue_share' and not selfish:
+                continue
+            estimate = self.estimates.get(name, None)
+            if estimate is None or estimate['width'] > max_width:
+                return None
+        return 'converged'
+
+    def estimate(self, bookkeeper: Bookkeeper, nodes: List) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the point estimates and confidence intervals of the metrics that can be estimated yet.
+        * bookkeeper (`Bookkeeper`): Bookkeeper of the run.
+        * nodes (List[`Node`]): All nodes of the simulation.
+        """
+        blocks = bookkeeper.blocks
+        if not blocks:
+            return dict()
+        head = max(blocks.values(), key=lambda block: block.height)
+        settled_height = head.height - self.confirmations
+        main_chain = set()
+        block = head
+        while block is not None:
+            main_chain.add(block.id)
+            block = blocks.get(block.prev_id, None)
+        settled = [block for block in blocks.values() if block.height <= settled_height]
+
+        estimates = dict()
+        stale = sum(1 for block in settled if block.id not in main_chain)
+        estimates['stale_rate'] = self.__proportion(stale, len(settled))
+
+        required = math.ceil(len(nodes) / 2)
+        delays = []
+        for block in settled:
+            times = bookkeeper.block_rcv_times[block.id]
+            if len(times) >= required:  # blocks that never reach half of the nodes are left out
+                delays.append(times[required - 1] - block.created_at)
+        delays.sort()
+        interval = median_interval(delays, self.z)
+        if interval is not None:
+            low, high = interval
+            estimates['median_propagation'] = self.__interval(delays[(len(delays) - 1) // 2], low, high, len(delays))
+
+        selfish = {node.name for node in nodes if isinstance(node.mine_strategy, SelfishMining)}
+        if selfish:
+            main_settled = [block for block in settled if block.id in main_chain]
+            selfish_blocks = sum(1 for block in main_settled if block.miner in selfish)
+            estimates['selfish_revenue_share'] = self.__proportion(selfish_blocks, len(main_settled))
+        return estimates
+
+    def __proportion(self, successes: int, trials: int) -> Dict[str, float]:
+        low, high = wilson_interval(successes, trials, self.z)
+        return self.__interval(successes / trials if trials else 0.0, low, high, trials)
+
+    @staticmethod
+    def __interval(value: float, low: float, high: float, samples: int) -> Dict[str, float]:
+        return {'value': value, 'low': low, 'high': high, 'width': high - low, 'samples': samples}
@@ -1,35 +1,83 @@
-import hashlib
+import functools
+import random
+from array import array
 from sim import util
 
+NEVER = -1
+"""Value of `last_try`/`last_success` for addresses that were never tried or never connected."""
+
+
 class BaseTable:
-    def __init__(self, buckets, slots):
+    """
+    Address table made of `buckets` buckets with `slots` slots each.
+
+    Buckets are allocated on first write and store their entries in packed arrays, so an
+    empty table costs a handful of objects regardless of its nominal size.
+
+    When an address maps to an occupied slot it takes any free slot of the same bucket. If the
+    bucket is full, its least recently seen entry is evicted provided it is terrible (see
+    `is_terrible`); otherwise `_on_collision` decides what happens to the new address.
+    """
+
+    # eviction thresholds in seconds, modeled on Bitcoin Core's addrman
+    HORIZON = 30 * 24 * 60 * 60
+    """Entries not seen for this long are terrible."""
+    RETRIES = 3
+    """Entries never connected to after this many attempts are terrible."""
+    MAX_FAILURES = 10
+    """Entries with this many failed attempts in `MIN_FAIL` are terrible."""
+    MIN_FAIL = 7 * 24 * 60 * 60
+    RECENT_TRY = 60
+    """Entries tried this recently are never terrible."""
+    FUTURE = 10 * 60
+    """Entries with timestamps this far in the future are terrible."""
+
+    def __init__(self, buckets, slots, iter_seconds=1):
         self._buckets = buckets
         self._slots = slots
-        self._elems = [Bucket(slots=slots)
-                       for _ in range(buckets)]
+        self._iter_seconds = iter_seconds
+        self._elems: dict = dict()
         self.data = dict()
+        """Index of the table: integer address ids as keys and `bucket * slots + slot` positions as values."""
+        # live index of non-empty buckets, kept in sync by `_place`/`delete`
+        # so that `random_entry` does not have to scan `data`
+        self._filled = []
+        self._filled_pos = dict()
 
     def __len__(self):
-        return sum(map(len, self.elems))
+        return len(self.data)
+
+    def __contains__(self, addr):
+        return int(addr) in self.data
 
     def __getitem__(self, item):
-        return self._elems[item]
+        """
+        Returns the bucket at the given index, or None if nothing was ever written to it.
+        """
+        return self._elems.get(item, None)
 
     def __delitem__(self, key):
-        self._elems[key].clear()
+        bucket = self._elems.get(key, None)
+        if bucket is None:
+            return
+        for addr_id in bucket.addr_ids():
+            self.delete(util.SimpleAddress.from_int(addr_id))
 
     def __eq__(self, other):
         return self.slots == other.slots and \
             self.buckets == other.buckets and \
+            self.data == other.data and \
             self.elems == other.elems
 
     def clear(self):
-        for bucket in self._elems:
-            bucket.clear()
+        self._elems.clear()
+        self.data.clear()
+        self._filled.clear()
+        self._filled_pos.clear()
 
     @property
     def elems(self):
-        return tuple(self._elems)
+        return tuple(self._elems.get(i, None) for i in range(self._buckets))
 
     @property
     def buckets(self):
@@ -39,77 +87,315 @@ class BaseTable:
     def slots(self):
         return self._slots
 
+    @property
+    def filled_buckets(self):
+        return tuple(self._filled)
+
+    def addresses(self):
+        """
+        Returns the list of addresses currently stored in the table.
+        """
+        return [util.SimpleAddress.from_int(addr_id) for addr_id in self.data]
+
     def add(self, ip, timstamp):
         pass
 
+    def sample(self, count: int, rand=random):
+        """
+        Returns a list of at most `count` distinct addresses drawn at random from the table.
+        * count (int): Number of addresses.
+        * rand (`random.Random`): Source of randomness.
+        """
+        count = min(count, len(self.data))
+        if count <= 0:
+            return []
+        return [util.SimpleAddress.from_int(addr_id) for addr_id in rand.sample(list(self.data), count)]
+
+    def get(self, addr: util.SimpleAddress):
+        """
+        Returns a `PeerEntry` snapshot for the given address, or None if it is not in the table.
+        """
+        pos = self.data.get(int(addr), None)
+        if pos is None:
+            return None
+        bucket = self._elems[pos // self._slots]
+        return bucket.entry(pos % self._slots, addr)
+
+    def get_timestamp(self, addr: util.SimpleAddress, default=None):
+        """
+        Returns the last timestamp recorded for the given address, or `default` if it is not in the table.
+        """
+        pos = self.data.get(int(addr), None)
+        if pos is None:
+            return default
+        return self._elems[pos // self._slots].get(pos % self._slots, TIMESTAMP)
+
+    def random_entry(self, rand=random):
+        """
+        Returns a random `PeerEntry` in O(1): a random non-empty bucket is chosen first, then a random occupied slot in it.
+        Returns None if the table is empty.
+        * rand: Source of randomness providing `randrange`.
+        """
+        if not self._filled:
+            return None
+        bucket = self._elems[self._filled[rand.randrange(len(self._filled))]]
+        slot = bucket.random_slot(rand)
+        return bucket.entry(slot, util.SimpleAddress.from_int(bucket[slot]))
+
+    def _ticks(self, seconds):
+        return seconds / self._iter_seconds
+
+    def is_terrible(self, bucket, slot, now):
+        """
+        Returns True if the entry in the given bucket slot is not worth keeping, following Bitcoin Core's `IsTerrible`.
+        * bucket (`Bucket`): Bucket holding the entry.
+        * slot (int): Slot of the entry.
+        * now (int): Current timestamp of the table owner.
+        """
+        last_try = bucket.get(slot, LAST_TRY)
+        if last_try != NEVER and now - last_try < self._ticks(self.RECENT_TRY):
+            return False
+        timestamp = bucket.get(slot, TIMESTAMP)
+        if timestamp > now + self._ticks(self.FUTURE):
+            return True
+        if now - timestamp > self._ticks(self.HORIZON):
+            return True
+        last_success = bucket.get(slot, LAST_SUCCESS)
+        attempts = bucket.get(slot, ATTEMPTS)
+        if last_success == NEVER and attempts >= self.RETRIES:
+            return True
+        if now - last_success > self._ticks(self.MIN_FAIL) and attempts >= self.MAX_FAILURES:
+            return True
+        return False
+
+    def _place(self, addr: util.SimpleAddress, i, j, timestamp):
+        """
+        Store `addr` with the given timestamp in bucket `i`, preferably at slot `j`, keeping `data` and the bucket index consistent.
+        Addresses already in the table only have their timestamp refreshed.
+        Returns True if the address is in the table afterwards.
+        """
+        addr_id = int(addr)
+        if addr_id in self.data:
+            self.update(addr, timestamp)
+            return True
+        bucket = self._elems.get(i, None)
+        if bucket is None:
+            bucket = self._elems[i] = Bucket(slots=self._slots)
+        elif bucket[j] is not None:
+            j = bucket.free_slot()
+            if j is None:
+                j = bucket.oldest
+                if not self.is_terrible(bucket, j, timestamp):
+                    return self._on_collision(addr, i, j, timestamp)
+                self.delete(util.SimpleAddress.from_int(bucket[j]))
+        bucket.put(j, addr_id, timestamp)
+        if len(bucket) == 1:
+            self._filled_pos[i] = len(self._filled)
+            self._filled.append(i)
+        self.data[addr_id] = i * self._slots + j
+        return True
+
+    def _on_collision(self, addr: util.SimpleAddress, i, j, timestamp):
+        """
+        Called when `addr` maps to a full bucket `i` whose eviction candidate `j` is not terrible.
+        By default the existing entry is kept and the new address dropped. Returns True if `addr` was stored.
+        """
+        return False
+
+    def _locate(self, addr: util.SimpleAddress):
+        pos = self.data.get(int(addr), None)
+        if pos is None:
+            return None, None
+        return self._elems[pos // self._slots], pos % self._slots
+
     def update(self, ip: util.SimpleAddress, timestamp):
-        if ip not in self.data:
+        bucket, slot = self._locate(ip)
+        if bucket is None:
             return
-
-        pe = self.data[ip]['object']
-        pe.set_timestamp(timestamp)
+        bucket.touch(slot, timestamp)
+
+    def attempt(self, addr: util.SimpleAddress, timestamp):
+        """
+        Record a connection attempt to the given address.
+        """
+        bucket, slot = self._locate(addr)
+        if bucket is None:
+            return
+        bucket.set(slot, ATTEMPTS, bucket.get(slot, ATTEMPTS) + 1)
+        bucket.set(slot, LAST_TRY, timestamp)
+
+    def good(self, addr: util.SimpleAddress, timestamp):
+        """
+        Record a successful connection to the given address.
+        """
+        bucket, slot = self._locate(addr)
+        if bucket is None:
+            return
+        bucket.set(slot, ATTEMPTS, 0)
+        bucket.set(slot, LAST_SUCCESS, timestamp)
+        bucket.touch(slot, timestamp)
 
     def delete(self, ip: util.SimpleAddress):
-        if ip not in self.data:
+        addr_id = int(ip)
+        pos = self.data.pop(addr_id, None)
+        if pos is None:
             return
 
-        bucket = self.data[ip]['bucket']
-        slot = self.data[ip]['slot']
-        del self.data[ip]
-        self.elems[bucket][slot] = None
+        i, j = divmod(pos, self._slots)
+        bucket = self._elems[i]
+        del bucket[j]
+        if len(bucket) == 0:
+            # swap-remove the bucket from the filled index and release its arrays
+            del self._elems[i]
+            pos = self._filled_pos.pop(i)
+            last = self._filled.pop()
+            if last != i:
+                self._filled[pos] = last
+                self._filled_pos[last] = pos
 
 
 class NewTable(BaseTable):
-    def __init__(self, buckets = 256, slots = 64):
-        super().__init__(buckets = buckets, slots = slots)
+    def __init__(self, buckets = 256, slots = 64, iter_seconds=1):
+        super().__init__(buckets = buckets, slots = slots, iter_seconds = iter_seconds)
 
-    def newbucket(self, my_addr: util.SimpleAddress, new_addr: util.SimpleAddress, buckets=256):
-        i = util.hash(new_addr.group, my_addr.group) % 32
-        return util.hash(new_addr.group, i) % buckets
+    @staticmethod
+    def newbucket(my_addr: util.SimpleAddress, new_addr: util.SimpleAddress, buckets=256):
+        return _newbucket(my_addr.group, new_addr.group, buckets)
 
-    def newslot(self, my_addr: util.SimpleAddress, new_addr: util.SimpleAddress, buckets=256, slots=64):
-        pos = self.newbucket(my_addr, new_addr, buckets=buckets * slots)
-        return pos // slots, pos % slots
+    @staticmethod
+    def newslot(my_addr: util.SimpleAddress, new_addr: util.SimpleAddress, buckets=256, slots=64):
+        return _cached_newslot(my_addr.group, new_addr.group, buckets, slots)
 
 
     def add(self, src_addr: util.SimpleAddress, addr: util.SimpleAddress, timestamp):
-        pe = PeerEntry(addr, timestamp)
-        i, j = self.newslot(src_addr, addr)
-        self.elems[i][j] = pe
-        self.data[addr] = pe
-        self.data[addr] = {
-            'bucket': i,
-            'slot': j,
-            'object': pe
-        }
+        i, j = _cached_newslot(src_addr.group, addr.group, self.buckets, self.slots)
+        return self._place(addr, i, j, timestamp)
+
+    def add_many(self, src_addr: util.SimpleAddress, addrs, timestamp) -> int:
+        """
+        Add the addresses of one ADDR message, like calling `add` for each of them. Addresses already in
+        the table only have their timestamp refreshed, without computing their slots.
+        Returns the number of addresses in the table afterwards among the given ones.
+        * src_addr (`sim.util.SimpleAddress`): Address of the node that sent the addresses.
+        * addrs (List[`sim.util.SimpleAddress`]): Addresses to add.
+        * timestamp (int): Current timestamp.
+        """
+        data, elems, slots, buckets = self.data, self._elems, self._slots, self._buckets
+        src_group = src_addr.group
+        stored = 0
+        for addr in addrs:
+            pos = data.get(int(addr), None)
+            if pos is not None:
+                elems[pos // slots].touch(pos % slots, timestamp)
+                stored += 1
+                continue
+            i, j = _cached_newslot(src_group, addr.group, buckets, slots)
+            stored += self._place(addr, i, j, timestamp)
+        return stored
 
 
 class TriedTable(BaseTable):
-    def __init__(self, buckets = 64, slots = 64):
-        super().__init__(buckets = buckets, slots = slots)
-
-    def triedbucket(self, addr: util.SimpleAddress, buckets=64):
+    """
+    Table of addresses that were connected to before.
+
+    Full buckets use test-before-evict: instead of replacing a healthy entry, the new address is
+    parked in `collisions` while the owner tests the eviction candidate (see `untested_collisions`).
+    `resolve_collisions` then keeps whichever of the two proves alive.
+    """
+
+    TEST_WINDOW = 40 * 60
+    """Seconds an eviction candidate has to answer before it is replaced."""
+    MAX_COLLISIONS = 10
+    """Maximum number of pending collisions."""
+
+    def __init__(self, buckets = 64, slots = 64, iter_seconds=1):
+        super().__init__(buckets = buckets, slots = slots, iter_seconds = iter_seconds)
+        self.collisions = dict()
+        """Pending collisions with new address ids as keys and `[address, registered_at, tested, candidate_id]` lists as values."""
+
+    @staticmethod
+    def triedbucket(addr: util.SimpleAddress, buckets=64):
         i = util.hash(addr) % 4
         return util.hash(addr.group, i) % buckets
 
-    def triedslot(self, addr: util.SimpleAddress, buckets=64, slots=64):
-        pos = self.triedbucket(addr, buckets=buckets * slots)
+    @staticmethod
+    def triedslot(addr: util.SimpleAddress, buckets=64, slots=64):
+        pos = TriedTable.triedbucket(addr, buckets=buckets * slots)
         return pos // slots, pos % slots
 
     def add(self, addr: util.SimpleAddress, timestamp):
-        pe = PeerEntry(addr, timestamp)
-        i, j = self.triedslot(addr)
-        self.elems[i][j] = pe
-        self.data[addr] = {
-            'bucket': i,
-            'slot': j,
-            'object': pe
-        }
+        i, j = _cached_triedslot(int(addr), self.buckets, self.slots)
+        return self._place(addr, i, j, timestamp)
+
+    def clear(self):
+        super().clear()
+        self.collisions.clear()
+
+    def _on_collision(self, addr: util.SimpleAddress, i, j, timestamp):
+        if int(addr) not in self.collisions and len(self.collisions) < self.MAX_COLLISIONS:
+            self.collisions[int(addr)] = [addr, timestamp, False, self._elems[i][j]]
+        return False
+
+    def untested_collisions(self):
+        """
+        Returns the eviction candidates of pending collisions that have not been tested yet, marking them as tested.
+        The owner is expected to contact them; any reply refreshes their timestamp through `update`.
+        """
+        candidates = []
+        for collision in self.collisions.values():
+            if collision[2]:
+                continue
+            collision[2] = True
+            if collision[3] in self.data:
+                candidates.append(util.SimpleAddress.from_int(collision[3]))
+        return candidates
+
+    def resolve_collisions(self, now):
+        """
+        Settle pending collisions: a candidate seen since the collision was registered is kept and the new address dropped,
+        a candidate silent for `TEST_WINDOW` is evicted in favor of the new address. Only the candidate recorded when the
+        collision was registered is considered, since other entries of the bucket were never tested.
+        * now (int): Current timestamp of the table owner.
+        """
+        for addr_id, (addr, registered_at, _, candidate_id) in list(self.collisions.items()):
+            i, j = _cached_triedslot(int(addr), self.buckets, self.slots)
+            bucket = self._elems.get(i, None)
+            if bucket is None or bucket.free_slot() is not None or addr_id in self.data:
+                del self.collisions[addr_id]
+                self._place(addr, i, j, now)
+                continue
+            candidate = util.SimpleAddress.from_int(candidate_id)
+            last_seen = self.get_timestamp(candidate)
+            if last_seen is None or last_seen > registered_at:  # candidate replaced by another entry, or alive
+                del self.collisions[addr_id]
+            elif now - registered_at >= self._ticks(self.TEST_WINDOW):
+                del self.collisions[addr_id]
+                self.delete(candidate)
+                self._place(addr, i, j, now)
+
+def _newbucket(src_group: str, group: str, buckets):
+    i = util.hash(group, src_group) % 32
+    return util.hash(group, i) % buckets
+
+
+# slot positions only depend on the groups (new table) or the address (tried table), so every table
+# can share them; the caches are keyed on plain values to not keep addresses alive
+@functools.lru_cache(maxsize=2 ** 16)
+def _cached_newslot(src_group: str, group: str, buckets, slots):
+    pos = _newbucket(src_group, group, buckets * slots)
+    return pos // slots, pos % slots
+
+
+@functools.lru_cache(maxsize=2 ** 16)
+def _cached_triedslot(addr_id: int, buckets, slots):
+    return TriedTable.triedslot(util.SimpleAddress.from_int(addr_id), buckets=buckets, slots=slots)
+
 
 class PeerEntry:
-    def __init__(self, ip, timestamp=None):
+    def __init__(self, ip, timestamp=None, attempts=0):
         self._ip = ip
         self._timestamp = timestamp
+        self._attempts = attempts
 
     @property
     def ip(self):
@@ -122,6 +408,10 @@ class PeerEntry:
     def timestamp(self):
         return self._timestamp
 
+    @property
+    def attempts(self):
+        return self._attempts
+
     def __lt__(self, other):
         return self.timestamp < other.timestamp
 
@@ -134,46 +424,181 @@ class PeerEntry:
         return self.ip == other.ip and \
                self.timestamp == other.timestamp
 
+# fields of a bucket row
+ID, TIMESTAMP, ATTEMPTS, LAST_TRY, LAST_SUCCESS = range(5)
+_SLOT, _PREV, _NEXT = 5, 6, 7
+_FIELDS = 8
+_NO_ROW = 0xFF
+
+
 class Bucket:
+    """
+    Fixed number of slots backed by a single packed array with one row per occupied slot.
+    A row holds the address id, timestamp, connection attempts, last try and last success of the
+    entry (see the `ID`, `TIMESTAMP`, ... field constants), so a bucket costs memory proportional
+    to its occupancy rather than its size.
+
+    Occupied rows are additionally kept in least-recently-seen order, so the bucket's eviction
+    candidate (`oldest`) is available in O(1). This relies on timestamps being written in
+    non-decreasing order, which holds since every table is only written with its owner's clock.
+    """
+    __slots__ = ('_slots', '_rows', '_row_of', '_mask', '_head', '_tail')
+
     def __init__(self, slots = 64):
+        if slots > _NO_ROW:
+            raise ValueError(f'Buckets support at most {_NO_ROW} slots')
         self._slots = slots
-        self._elems = [None for _ in range(self.slots)]
-        self._len = 0
+        self._rows = array('q')
+        self._row_of = bytearray([_NO_ROW]) * slots
+        self._mask = 0  # occupancy bitmask over slots
+        # doubly linked least-recently-seen list over rows
+        self._head = -1
+        self._tail = -1
 
     def __len__(self):
-        return self._len
+        return len(self._rows) // _FIELDS
 
     def __getitem__(self, item):
-        return self._elems[item]
-
-    def __setitem__(self, key, value):
-        if not self._elems[key] and value:
-            if self._len == self.slots:
-                deleted_index = self._is_terrible()
-                key = deleted_index
-            self._len += 1
-        elif self._elems[key] and not value:
-            self._len -= 1
-        self._elems[key] = value
+        """
+        Returns the address id stored in the given slot, or None if the slot is empty.
+        """
+        row = self._row_of[item]
+        return None if row == _NO_ROW else self._rows[row * _FIELDS + ID]
+
+    def get(self, key, field):
+        """
+        Returns the given field (e.g. `TIMESTAMP`) of an occupied slot.
+        """
+        return self._rows[self._row_of[key] * _FIELDS + field]
+
+    def set(self, key, field, value):
+        """
+        Sets the given field of an occupied slot. Use `touch` for timestamps to keep the eviction order.
+        """
+        self._rows[self._row_of[key] * _FIELDS + field] = value
+
+    def put(self, key, addr_id, timestamp):
+        row = self._row_of[key]
+        if row == _NO_ROW:
+            row = len(self)
+            self._rows.extend((addr_id, timestamp, 0, NEVER, NEVER, key, -1, -1))
+            self._row_of[key] = row
+            self._mask |= 1 << key
+        else:
+            self._unlink(row)
+            base = row * _FIELDS
+            self._rows[base:base + _SLOT] = array('q', (addr_id, timestamp, 0, NEVER, NEVER))
+        self._link(row)
+
+    def touch(self, key, timestamp):
+        """
+        Record that the address in the given slot was seen at `timestamp`.
+        """
+        row = self._row_of[key]
+        self._rows[row * _FIELDS + TIMESTAMP] = timestamp
+        if row != self._tail:
+            self._unlink(row)
+            self._link(row)
 
     def __delitem__(self, key):
-        if self._elems[key]:
-            self._len -= 1
-        self._elems[key] = None
+        row = self._row_of[key]
+        if row == _NO_ROW:
+            return
+        self._unlink(row)
+        self._row_of[key] = _NO_ROW
+        self._mask &= ~(1 << key)
+        rows = self._rows
+        last = len(self) - 1
+        if row != last:
+            # move the last row into the hole and repoint its neighbours
+            base = row * _FIELDS
+            rows[base:base + _FIELDS] = rows[last * _FIELDS:(last + 1) * _FIELDS]
+            self._row_of[rows[base + _SLOT]] = row
+            prev, nxt = rows[base + _PREV], rows[base + _NEXT]
+            if prev == -1:
+                self._head = row
+            else:
+                rows[prev * _FIELDS + _NEXT] = row
+            if nxt == -1:
+                self._tail = row
+            else:
+                rows[nxt * _FIELDS + _PREV] = row
+        del rows[last * _FIELDS:]
+
+    def _link(self, row):
+        rows = self._rows
+        rows[row * _FIELDS + _PREV] = self._tail
+        rows[row * _FIELDS + _NEXT] = -1
+        if self._tail == -1:
+            self._head = row
+        else:
+            rows[self._tail * _FIELDS + _NEXT] = row
+        self._tail = row
+
+    def _unlink(self, row):
+        rows = self._rows
+        prev, nxt = rows[row * _FIELDS + _PREV], rows[row * _FIELDS + _NEXT]
+        if prev == -1:
+            self._head = nxt
+        else:
+            rows[prev * _FIELDS + _NEXT] = nxt
+        if nxt == -1:
+            self._tail = prev
+        else:
+            rows[nxt * _FIELDS + _PREV] = prev
 
     def __eq__(self, other):
-        return self.slots == other.slots and \
+        return other is not None and \
+            self.slots == other.slots and \
             self.elems == other.elems
 
+    def entry(self, key, addr):
+        """
+        Returns a `PeerEntry` snapshot of the given slot.
+        """
+        base = self._row_of[key] * _FIELDS
+        return PeerEntry(addr, self._rows[base + TIMESTAMP], self._rows[base + ATTEMPTS])
+
+    def addr_ids(self):
+        """
+        Returns the address ids stored in the bucket.
+        """
+        return self._rows[ID::_FIELDS].tolist()
+
+    def random_slot(self, rand=random):
+        """
+        Returns a random occupied slot index of the bucket, or None if the bucket is empty.
+        """
+        if not self._rows:
+            return None
+        return self._rows[rand.randrange(len(self)) * _FIELDS + _SLOT]
+
+    def free_slot(self):
+        """
+        Returns the lowest unoccupied slot index, or None if the bucket is full.
+        """
+        free = ~self._mask & (self._mask + 1)
+        slot = free.bit_length() - 1
+        return slot if slot < self._slots else None
+
+    @property
+    def oldest(self):
+        """
+        The occupied slot that was seen least recently, or None if the bucket is empty.
+        """
+        return None if self._head == -1 else self._rows[self._head * _FIELDS + _SLOT]
+
     def clear(self):
-        for i in range(self.slots):
-            self._elems[i] = None
-        self._len = 0
+        self._rows = array('q')
+        self._row_of = bytearray([_NO_ROW]) * self._slots
+        self._mask = 0
+        self._head = -1
+        self._tail = -1
 
     @property
     def elems(self):
-        return tuple(self._elems)
+        return tuple(self[i] for i in range(self._slots))
 
     @property
     def slots(self):
-        return self._slots
\ No newline at end of file
+        return self._slots
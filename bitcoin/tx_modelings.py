@@ -1,32 +1,55 @@
+import math
 import sys
 import heapq
-import random
+from array import array
+from typing import Dict, List
+
+import numpy as np
 
 sys.path.append("..")
 
-from bitcoin.models import Miner, Block, Transaction
+from sim import rng
+from bitcoin.models import Miner, Block, Transaction, RollingMinFeerate
 from bitcoin.messages import InvMessage
 
 from loguru import logger
 
-
 class TxModel:
     def __init__(self):
         pass
 
     def generate(self, node: Miner) -> Transaction:
-        size = random.gauss(509.23, 191.45)  # https://tradeblock.com/bitcoin/historical/1w-f-tsize_per_avg-01101
-        fee = random.gauss(7.17E-5, 7.53E-5)  # https://www.blockchain.com/btc/blocks?page=1
-        value = random.gauss(1.1185684485714287, 2.2917997016339346)  # same
+        size = node.rng.gauss(509.23, 191.45)  # https://tradeblock.com/bitcoin/historical/1w-f-tsize_per_avg-01101
+        fee = node.rng.gauss(7.17E-5, 7.53E-5)  # https://www.blockchain.com/btc/blocks?page=1
+        value = node.rng.gauss(1.1185684485714287, 2.2917997016339346)  # same
         tx = Transaction(node.id, node.timestamp, size, value, fee)
         return tx
 
+    def generate_many(self, node: Miner, count: int):
+        """
+        Generate the given number of transactions for a node.
+        """
+        for _ in range(count):
+            self.generate(node)
+
     def publish(self, node: Miner, tx: Transaction, direct: bool = False):
         pass
 
     def receive(self, node: Miner, tx: Transaction = None):
         pass
 
+    def request(self, node: Miner, index: int) -> bool:
+        """
+        Returns True if the node should request an announced transaction.
+        """
+        return False
+
+    def get_tx(self, node: Miner, index: int) -> Transaction:
+        """
+        Returns the requested transaction if the node can serve it, or None.
+        """
+        return None
+
     def fill_block(self, node: Miner, block: Block) -> Block:
         pass
 
@@ -39,6 +62,18 @@ class TxModel:
     def get_waiting_tx_count(self, node: Miner):
         return 0
 
+    def get_min_feerate(self, node: Miner) -> float:
+        """
+        Returns the minimum feerate the node's mempool currently accepts (0 if the mempool size is not limited).
+        """
+        return 0.0
+
+    def get_evictions(self, nodes: List[Miner]) -> int:
+        """
+        Returns the number of transactions evicted so far from the mempools of the given nodes.
+        """
+        return 0
+
 
 class NoneTxModel(TxModel):
     def __init__(self):
@@ -51,99 +86,335 @@ class NoneTxModel(TxModel):
         """
         Assign tx count and total size to block.
         """
-        block.tx_count = random.gauss(2104.72, 236.63)
-        block.size = block.tx_count * random.gauss(615.32, 89.43)
+        block.tx_count = node.rng.gauss(2104.72, 236.63)
+        block.size = block.tx_count * node.rng.gauss(615.32, 89.43)
         return block
 
 
 class SimpleTxModel(TxModel):
+    """
+    Shared mempool kept as columns (id, size, fee, feerate, created_at) of NumPy arrays instead of
+    `Transaction` objects. Transactions requested during a step are only counted, and drawn together in
+    one vectorized batch from the 'transactions' random stream when the step ends or the mempool is read.
+    Blocks reference their transactions by id (`Block.tx_ids`).
+
+    If the miners have a `max_mempool_bytes`, the lowest feerate transactions are evicted whenever the
+    mempool outgrows it, and new transactions below the resulting rolling minimum feerate are rejected.
+    """
+    COLUMNS = {'ids': np.int64, 'size': float, 'fee': float, 'feerate': float, 'created_at': np.int64}
+
     def __init__(self):
         """
         Initialize shared mempool.
         """
         super().__init__()
-        self.mempool = []
-        self.updated_blocks = dict()
+        self.count = 0
+        """Number of transactions in the mempool, i.e. used rows of the columns."""
+        for name, dtype in self.COLUMNS.items():
+            setattr(self, name, np.zeros(1024, dtype=dtype))
+        self.next_id = 0
+        self.mempool_bytes = 0
+        self.pending = 0
+        self.pending_timestamp = 0
+        self.max_mempool_bytes = 0
+        self.iter_seconds = 1
+        self.min_feerate = RollingMinFeerate()
+        self.evictions = 0
+        self.rejections = 0
 
     def generate(self, node: Miner) -> Transaction:
         """
         Create transaction and add it to shared mempool.
         """
-        tx = super().generate(node)
-        heapq.heappush(self.mempool, tx)
+        self.generate_many(node, 1)
+
+    def generate_many(self, node: Miner, count: int):
+        """
+        Add the given number of transactions, created at the node's current step, to the shared mempool.
+        """
+        if node.timestamp != self.pending_timestamp:
+            self.flush()
+            self.pending_timestamp = node.timestamp
+            self.max_mempool_bytes = node.max_mempool_bytes
+            self.iter_seconds = node.iter_seconds
+        self.pending += count
+
+    def flush(self):
+        """
+        Draw all pending transactions and append them to the mempool.
+        """
+        count, self.pending = self.pending, 0
+        if not count:
+            return
+        end = self.count + count
+        if end > len(self.ids):
+            capacity = max(end, 2 * len(self.ids))
+            for name in self.COLUMNS:
+                column = getattr(self, name)
+                grown = np.zeros(capacity, dtype=column.dtype)
+                grown[:self.count] = column[:self.count]
+                setattr(self, name, grown)
+        rows = slice(self.count, end)
+        self.ids[rows] = np.arange(self.next_id, self.next_id + count)
+        self.size[rows] = Transaction.SIZE
+        self.fee[rows] = rng.streams.numpy_stream('transactions').normal(7.17E-5, 7.53E-5, count)
+        self.feerate[rows] = self.fee[rows] / self.size[rows]
+        self.created_at[rows] = self.pending_timestamp
+        self.next_id += count
+        self.mempool_bytes += Transaction.SIZE * count
+        self.count = end
+        if self.max_mempool_bytes:
+            self.__limit(rows)
+
+    def __limit(self, new_rows: slice):
+        """
+        Reject the new transactions below the minimum feerate, then evict the lowest feerate transactions
+        until the mempool fits `max_mempool_bytes`.
+        """
+        now = self.pending_timestamp * self.iter_seconds
+        min_feerate = self.min_feerate.get(now, self.mempool_bytes, self.max_mempool_bytes)
+        if min_feerate:
+            rejected = new_rows.start + np.flatnonzero(self.feerate[new_rows] < min_feerate)
+            self.rejections += len(rejected)
+            self.__remove(rejected)
+        excess = self.mempool_bytes - self.max_mempool_bytes
+        if excess <= 0:
+            return
+        size, feerate = self.size[:self.count], self.feerate[:self.count]
+        limit = min(self.count, math.ceil(excess / size.min()))
+        if limit < self.count:
+            bottom = np.argpartition(feerate, limit - 1)[:limit]
+        else:
+            bottom = np.arange(self.count)
+        bottom = bottom[np.argsort(feerate[bottom], kind='stable')]
+        evicted = bottom[:np.searchsorted(np.cumsum(size[bottom]), excess) + 1]
+        self.min_feerate.bump(float(feerate[evicted].max()), now)
+        self.evictions += len(evicted)
+        self.__remove(evicted)
+
+    def __remove(self, rows: np.ndarray):
+        """
+        Remove the given rows from the mempool, keeping the order of the others.
+        """
+        if not len(rows):
+            return
+        self.mempool_bytes -= float(self.size[rows].sum())
+        keep = np.ones(self.count, dtype=bool)
+        keep[rows] = False
+        remaining = int(keep.sum())
+        for name in self.COLUMNS:
+            column = getattr(self, name)
+            column[:remaining] = column[:self.count][keep]
+        self.count = remaining
 
     def fill_block(self, node: Miner, block: Block) -> Block:
         """
-        Add txs to block from shared mempool until it reaches max size.
+        Add the highest feerate txs from the shared mempool to the block until it reaches max size.
         """
-        while block.size < node.max_block_size:
-            try:
-                block.add_tx(heapq.heappop(self.mempool))
-            except IndexError:
-                break
+        self.flush()
+        space = node.max_block_size - block.size
+        if space <= 0 or not self.count:
+            return block
+        size, feerate = self.size[:self.count], self.feerate[:self.count]
+        # no more than this many txs are needed to fill the block
+        limit = min(self.count, math.ceil(space / size.min()))
+        if limit < self.count:
+            top = np.argpartition(-feerate, limit - 1)[:limit]
+        else:
+            top = np.arange(self.count)
+        top = top[np.argsort(-feerate[top], kind='stable')]
+        # like adding txs one by one while the block is smaller than max size
+        chosen = top[:np.searchsorted(np.cumsum(size[top]), space) + 1]
+
+        block.tx_ids = self.ids[chosen]
+        block.tx_count += len(chosen)
+        block.size += float(size[chosen].sum())
+        self.__remove(chosen)
         return block
 
     def get_mempool_size(self, node: Miner):
-        return sum([tx.size for tx in self.mempool])
+        self.flush()
+        return self.mempool_bytes
 
     def get_waiting_tx_count(self, node: Miner):
-        return len(self.mempool)
+        self.flush()
+        return self.count
+
+    def get_min_feerate(self, node: Miner) -> float:
+        self.flush()
+        return self.min_feerate.get(node.timestamp * node.iter_seconds, self.mempool_bytes, self.max_mempool_bytes)
+
+    def get_evictions(self, nodes: List[Miner]) -> int:
+        return self.evictions
 
 
 class FullTxModel(TxModel):
+    """
+    Transactions propagate over the network and every node keeps its own mempool.
+
+    Transactions get dense indices into a global table of their sizes, feerates and creation steps. Nodes
+    only keep bitmaps of the indices they have seen and that are in their mempool (see
+    `sim.bitmap.ChunkedBitmap`), and a heap of the shared transactions ordering their mempool. Heap entries
+    of transactions that left the mempool are skipped when popping, and the heaps are rebuilt once they
+    mostly hold such entries. `Transaction` objects are only kept while some mempool holds them, to answer
+    GETDATA requests; blocks reference their transactions by index (`Block.tx_ids`). Nodes forget which of the
+    transactions older than the last `SEEN_WINDOW` they have seen and treat them all as seen.
+
+    If the miners have a `max_mempool_bytes`, the lowest feerate transactions are evicted whenever a
+    mempool outgrows it, and transactions below the node's rolling minimum feerate are neither kept nor relayed.
+    """
+    SEEN_WINDOW = 1 << 20
+
     def __init__(self):
         super().__init__()
+        self.count = 0
+        """Number of transactions created so far."""
+        self.size = array('f')
+        self.feerate = array('d')
+        self.created_at = array('q')
+        self.holders = array('I')
+        """Number of mempools holding each transaction."""
+        self.txs: Dict[int, Transaction] = dict()
+        """Transactions held by at least one mempool, with their indices as keys."""
+
+    def add(self, tx: Transaction):
+        """
+        Append a new transaction to the global table and set its index.
+        """
+        tx.index = self.count
+        self.size.append(tx.size)
+        self.feerate.append(tx.feerate)
+        self.created_at.append(tx.created_at)
+        self.holders.append(0)
+        self.count += 1
+
+    def __hold(self, tx: Transaction):
+        """
+        Count a mempool that accepted the transaction.
+        """
+        if not self.holders[tx.index]:
+            self.txs[tx.index] = tx
+        self.holders[tx.index] += 1
+
+    def __release(self, index: int):
+        """
+        Count a mempool that dropped the transaction, and forget the transaction once no mempool holds it.
+        """
+        self.holders[index] -= 1
+        if not self.holders[index]:
+            del self.txs[index]
 
     def generate(self, node: Miner) -> Transaction:
         """
         Create transaction and directly (without inv/getdata) send to all peers.
         """
         tx = super().generate(node)
+        self.add(tx)
         self.publish(node, tx, direct=True)
 
     def publish(self, node: Miner, tx: Transaction, direct: bool = False):
         """
         Send transaction either directly (without inv/getdata) or with inv/getdata to all peers
         """
-        msg = tx if direct else InvMessage(tx.id, 'tx', node.id)
-        for peer in node.outs.values():
-            node.send_to(peer, msg)
+        node.broadcast(tx if direct else InvMessage(tx.index, 'tx', node.id))
+
+    def request(self, node: Miner, index: int) -> bool:
+        """
+        Returns True if the node should request the announced transaction, i.e. has not seen it yet.
+        """
+        return node.tx_seen.add(index)
+
+    def get_tx(self, node: Miner, index: int) -> Transaction:
+        """
+        Returns the requested transaction if it is in the node's mempool, or None.
+        """
+        return self.txs.get(index, None) if index in node.tx_pool else None
 
     def receive(self, node: Miner, tx: Transaction = None):
         """
         Receive transaction, add it local mempool, save its receipt time, and relay to peers.
         """
         logger.debug(f'[{node.timestamp}] {node.name} RECEIVED TX {tx.id}')
+        index = tx.index
         node.bookkeeper.save_tx(node, tx, node.timestamp)
-        node.tx_ids[tx.id] = tx
+        node.tx_seen.add(index)
+        node.compute += 1
+        if node.max_mempool_bytes and tx.feerate < self.get_min_feerate(node):
+            return
+        if not node.tx_pool.add(index):
+            return
+        self.__hold(tx)
         heapq.heappush(node.mempool, tx)
+        node.mempool_bytes += tx.size
+        if node.max_mempool_bytes:
+            heapq.heappush(node.mempool_low, (tx.feerate, index))
+            if node.mempool_bytes > node.max_mempool_bytes:
+                self.trim(node)
+                if index not in node.tx_pool:  # evicted right away
+                    return
         self.publish(node, tx, direct=False)  # relay
 
+    def trim(self, node: Miner):
+        """
+        Evict the lowest feerate transactions until the node's mempool fits `max_mempool_bytes`.
+        """
+        now = node.timestamp * node.iter_seconds
+        node.min_feerate.get(now, node.mempool_bytes, node.max_mempool_bytes)
+        while node.mempool_bytes > node.max_mempool_bytes and node.mempool_low:
+            feerate, index = heapq.heappop(node.mempool_low)
+            if not node.tx_pool.discard(index):  # already mined
+                continue
+            self.__release(index)
+            node.mempool_bytes -= self.size[index]
+            node.evictions += 1
+            node.min_feerate.bump(feerate, now)
+
     def fill_block(self, miner: Miner, block: Block) -> Block:
         """
         Fill block until reaching max block size.
         """
-        while block.size < miner.max_block_size:
-            try:
-                block.add_tx(heapq.heappop(miner.mempool))
-            except IndexError:
-                break
+        chosen = []
+        while block.size < miner.max_block_size and miner.mempool:
+            index = heapq.heappop(miner.mempool).index
+            if not miner.tx_pool.discard(index):  # already mined or evicted
+                continue
+            chosen.append(index)
+            size = self.size[index]
+            block.size += size
+            miner.mempool_bytes -= size
+            self.__release(index)
+        block.tx_ids = np.array(chosen, dtype=np.int64)
+        block.tx_count += len(chosen)
         return block
 
     def update_mempool(self, node: Miner, block: Block):
         """
-        Remove the transactions in the block from the local mempool.
+        Remove the transactions in the block from the local mempool and mark them as seen.
         """
-        for tx in block.transactions:
-            # del node.tx_ids[tx.id]
-            try:
-                node.mempool.remove(tx)
-            except ValueError:
-                pass
-        heapq.heapify(node.mempool)
+        if block.tx_ids is None:
+            return
+        for index in block.tx_ids.tolist():
+            node.tx_seen.add(index)
+            if node.tx_pool.discard(index):
+                node.mempool_bytes -= self.size[index]
+                self.__release(index)
+        node.tx_seen.fill_below(self.count - self.SEEN_WINDOW)
+        if len(node.mempool) > 2 * len(node.tx_pool) + 1024:
+            indices = node.tx_pool.indices().tolist()
+            node.mempool = [self.txs[index] for index in indices]
+            heapq.heapify(node.mempool)
+            if node.max_mempool_bytes:
+                node.mempool_low = [(self.feerate[index], index) for index in indices]
+                heapq.heapify(node.mempool_low)
 
     def get_mempool_size(self, node: Miner):
-        return sum([tx.size for tx in node.mempool])
+        return node.mempool_bytes
 
     def get_waiting_tx_count(self, node: Miner):
-        return len(node.mempool)
+        return len(node.tx_pool)
+
+    def get_min_feerate(self, node: Miner) -> float:
+        return node.min_feerate.get(node.timestamp * node.iter_seconds, node.mempool_bytes, node.max_mempool_bytes)
+
+    def get_evictions(self, nodes: List[Miner]) -> int:
+        return sum(node.evictions for node in nodes)
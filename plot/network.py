@@ -1,129 +1,174 @@
-import plotly.graph_objects as go
+import math
 
-import random
+import numpy as np
+import plotly.graph_objects as go
+from loguru import logger
 
 
 class NetworkPlot:
-    def edge_trace(self, nodes):
-        edge_x = []
-        edge_y = []
-        hover_text = []
-        for addr, node in nodes.items():
-            for out in node['outs']:
-                x0, y0 = node['pos']
-                x1, y1 = nodes[str(out)]['pos']
-                edge_x.append(x0)
-                edge_x.append(x1)
-                edge_x.append(None)
-                edge_y.append(y0)
-                edge_y.append(y1)
-                edge_y.append(None)
-                hover_text.append(f'from {addr} to {str(out)}')
-        edge_trace = go.Scatter(
-            x=edge_x, y=edge_y,
-            line=dict(width=0.5, color='#888'),
-            hoverinfo='text',
-            hovertext=hover_text,
-            mode='lines')
-        return edge_trace
+    """
+    Renders the simulated P2P network with WebGL traces.
 
-    def put_arrows(self, fig, nodes):
-        for addr, node in nodes.items():
-            x0, y0 = node['pos']
-            for out in node['outs']:
-                x1, y1 = nodes[str(out)]['pos']
-                ay = y1-y0
-                ax = x1-x0
-                fig.add_annotation(
-                    x=x0, y=y0,
-                    xref="x", yref="y",
-                    text='',
-                    showarrow=True,
-                    font=dict(
-                        family="Courier New, monospace", size=2, color='red'
-                    ),
-                    align="center",
-                    arrowhead=1, arrowsize=1, arrowwidth=1, arrowcolor="#636363",
-                    ax=ax, ay=ay,
-                    borderpad=2,
-                    bgcolor='black',
-                    opacity=0.3,
-                    # Place in the chart
-                )
+    Positions come from a region-clustered layout, refined with a force-directed pass for graphs small
+    enough to afford it. Above `max_edges` connections a uniform sample of the edges is drawn.
+    Output is written to files only; no browser is opened.
+    """
 
-        return fig
+    def __init__(self, layout: str = 'region', max_edges: int = 20000, force_max_nodes: int = 2000,
+                 iterations: int = 50, seed: int = 0):
+        """
+        Create a NetworkPlot object.
+        * layout (str): 'region' to cluster nodes by region, 'force' to additionally run a force-directed
+          layout when the graph has at most `force_max_nodes` nodes.
+        * max_edges (int): Maximum number of edges drawn; larger graphs are sampled.
+        * force_max_nodes (int): Size limit for the O(n^2) force-directed layout.
+        * iterations (int): Force-directed layout iterations.
+        * seed (int): Seed for layout jitter and edge sampling.
+        """
+        if layout not in ('region', 'force'):
+            raise ValueError(f'Unknown layout {layout}')
+        self.layout = layout
+        self.max_edges = max_edges
+        self.force_max_nodes = force_max_nodes
+        self.iterations = iterations
+        self.rng = np.random.default_rng(seed)
+
+    def edges(self, nodes):
+        """
+        Returns the `(E, 2)` array of outgoing connections as positions in `nodes`.
+        """
+        index = {node.id: i for i, node in enumerate(nodes)}
+        pairs = [(i, index[addr]) for i, node in enumerate(nodes) for addr in node.outs if addr in index]
+        return np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
+    def region_layout(self, nodes) -> np.ndarray:
+        """
+        Places region clusters on a circle and the nodes of each region on a sunflower spiral around its center.
+        """
+        regions = [str(node.region) for node in nodes]
+        names = sorted(set(regions))
+        pos = np.zeros((len(nodes), 2))
+        golden = math.pi * (3 - math.sqrt(5))
+        for r, name in enumerate(names):
+            members = np.array([i for i, region in enumerate(regions) if region == name])
+            angle = 2 * math.pi * r / len(names)
+            center = np.array([math.cos(angle), math.sin(angle)]) * (len(names) > 1)
+            k = np.arange(len(members))
+            radius = 0.8 * math.pi / max(len(names), 3) * np.sqrt((k + 0.5) / len(members))
+            pos[members, 0] = center[0] + radius * np.cos(k * golden)
+            pos[members, 1] = center[1] + radius * np.sin(k * golden)
+        return pos
+
+    def force_layout(self, pos: np.ndarray, edges: np.ndarray) -> np.ndarray:
+        """
+        Fruchterman-Reingold refinement of the given positions.
+        """
+        n = len(pos)
+        pos = pos + self.rng.normal(scale=1e-3, size=pos.shape)
+        k = 2 / math.sqrt(n)
+        temperature = 0.1
+        for _ in range(self.iterations):
+            x, y = pos[:, 0].astype(np.float32), pos[:, 1].astype(np.float32)
+            dx = x[:, None] - x[None, :]
+            dy = y[:, None] - y[None, :]
+            inv = dx * dx
+            inv += dy * dy
+            np.maximum(inv, 1e-6, out=inv)
+            np.divide(k * k, inv, out=inv)
+            disp = np.stack([(dx * inv).sum(axis=1), (dy * inv).sum(axis=1)], axis=1).astype(float)
+            if len(edges):
+                d = pos[edges[:, 0]] - pos[edges[:, 1]]
+                force = d * (np.linalg.norm(d, axis=1) / k)[:, None]
+                np.subtract.at(disp, edges[:, 0], force)
+                np.add.at(disp, edges[:, 1], force)
+            length = np.maximum(np.linalg.norm(disp, axis=1), 1e-9)
+            pos += disp * (np.minimum(length, temperature) / length)[:, None]
+            temperature *= 0.95
+        return pos
 
-    def node_trace(self, nodes):
-        node_x = []
-        node_y = []
-        for node in nodes.values():
-            x, y = node['pos']
-            node_x.append(x)
-            node_y.append(y)
+    def positions(self, nodes, edges) -> np.ndarray:
+        pos = self.region_layout(nodes)
+        if self.layout == 'force':
+            if len(nodes) <= self.force_max_nodes:
+                pos = self.force_layout(pos, edges)
+            else:
+                logger.warning(f'Skipping force layout for {len(nodes)} nodes (limit {self.force_max_nodes})')
+        return pos
 
-        node_trace = go.Scatter(
-            x=node_x, y=node_y,
+    def sample_edges(self, edges: np.ndarray) -> np.ndarray:
+        if len(edges) <= self.max_edges:
+            return edges
+        return edges[self.rng.choice(len(edges), size=self.max_edges, replace=False)]
+
+    def edge_trace(self, pos: np.ndarray, edges: np.ndarray):
+        # one polyline with NaN breaks between segments
+        segments = np.full((len(edges), 3, 2), np.nan)
+        segments[:, 0] = pos[edges[:, 0]]
+        segments[:, 1] = pos[edges[:, 1]]
+        return go.Scattergl(
+            x=segments[:, :, 0].ravel(), y=segments[:, :, 1].ravel(),
+            line=dict(width=0.5, color='#888'),
+            hoverinfo='skip',
+            mode='lines')
+
+    def node_trace(self, nodes, pos: np.ndarray):
+        node_adjacencies = [len(node.outs) + len(node.ins) for node in nodes]
+        node_text = [f'#{len(node.outs)}outs #{len(node.ins)}ins <{node.id}> name: {node.name}' for node in nodes]
+        return go.Scattergl(
+            x=pos[:, 0], y=pos[:, 1],
             mode='markers',
             hoverinfo='text',
+            text=node_text,
             marker=dict(
                 showscale=True,
-                # colorscale options
-                # 'Greys' | 'YlGnBu' | 'Greens' | 'YlOrRd' | 'Bluered' | 'RdBu' |
-                # 'Reds' | 'Blues' | 'Picnic' | 'Rainbow' | 'Portland' | 'Jet' |
-                # 'Hot' | 'Blackbody' | 'Earth' | 'Electric' | 'Viridis' |
                 colorscale='YlGnBu',
                 reversescale=True,
-                color=[],
-                size=10,
+                color=node_adjacencies,
+                size=6 if len(nodes) > 1000 else 10,
                 colorbar=dict(
                     thickness=15,
                     title='Node Connections',
                     xanchor='left',
                     titleside='right'
                 ),
-                line_width=2))
+                line_width=1))
 
-        node_adjacencies = []
-        node_text = []
-        for ip, node in nodes.items():
-            node_adjacencies.append(len(node["outs"]) + len(node["ins"]))
-            node_text.append(
-                f'#{len(node["outs"])}outs #{len(node["ins"])}ins <{ip}> name: {node["name"]}')
+    def figure(self, nodes):
+        """
+        Returns the plotly figure of the network.
+        * nodes (List[`sim.base_models.Node`]): Nodes to draw.
+        """
+        edges = self.edges(nodes)
+        pos = self.positions(nodes, edges)
+        shown = self.sample_edges(edges)
+        title = '<b>BITCOIN SIMULATED NETWORK GRAPH</b>'
+        if len(shown) < len(edges):
+            title += f' ({len(shown)} of {len(edges)} connections shown)'
+        return go.Figure(data=[self.edge_trace(pos, shown), self.node_trace(nodes, pos)],
+                         layout=go.Layout(
+                         title=title,
+                         titlefont_size=16,
+                         showlegend=False,
+                         hovermode='closest',
+                         margin=dict(b=20, l=5, r=5, t=40),
+                         xaxis=dict(showgrid=False, zeroline=False,
+                                    showticklabels=False),
+                         yaxis=dict(showgrid=False, zeroline=False, showticklabels=False))
+                         )
 
-        node_trace.marker.color = node_adjacencies
-        node_trace.text = node_text
-
-        return node_trace
-
-    def __manipulate_nodes(self, nodes):
-        new_nodes = {}
-        for node in nodes:
-            new_nodes[str(node.id)] = {
-                'pos': (random.random(), random.random()),
-                'outs': node.outs,
-                'ins': node.ins,
-                'name': node.name,
-            }
-        return new_nodes
-
-    def plot(self, nodes):
-        nodes = self.__manipulate_nodes(nodes)
-        edge_trace = self.edge_trace(nodes)
-        node_trace = self.node_trace(nodes)
-        fig = go.Figure(data=[edge_trace, node_trace],
-                        layout=go.Layout(
-                        title='<b>BITCOIN SIMULATED NETWORK GRAPH</b>',
-                        titlefont_size=16,
-                        showlegend=False,
-                        hovermode='closest',
-                        margin=dict(b=20, l=5, r=5, t=40),
-                        annotations=[dict(
-                            showarrow=False,
-                            xref="paper", yref="paper",
-                            x=0.005, y=-0.002)],
-                        xaxis=dict(showgrid=False, zeroline=False,
-                                   showticklabels=False),
-                        yaxis=dict(showgrid=False, zeroline=False, showticklabels=False))
-                        )
-        fig.write_html("graph.html")
-        fig.show()
+    def plot(self, nodes, path: str = 'graph.html', image_path: str = None):
+        """
+        Render the network to an HTML file and optionally a static image.
+        * nodes (List[`sim.base_models.Node`]): Nodes to draw.
+        * path (str): HTML output path, or None to skip it.
+        * image_path (str): Image output path (e.g. 'graph.png'); requires the kaleido package.
+        """
+        fig = self.figure(nodes)
+        if path is not None:
+            fig.write_html(path, include_plotlyjs='cdn')
+        if image_path is not None:
+            try:
+                fig.write_image(image_path)
+            except (ValueError, ImportError) as e:
+                logger.warning(f'Could not export {image_path}: {e}')
+        return fig
@@ -9,8 +9,11 @@ from loguru import logger
 
 from typing import List, Dict
 
-from sim import util
-from sim.network_util import get_delay, Region
+import numpy as np
+
+from sim import rng, util
+from sim.connections import ConnectionManager, FEELER, MANUAL, OUTBOUND
+from sim.network_util import get_delays, LATENCY_ROWS, REGION_INDEX, SPEED_ROWS, Region
 
 from bitcoin.tables import *
 import random
@@ -18,17 +21,21 @@ import os
 import time
 # from bitcoin.messages import VersionMessage
 
+VECTORIZED_BROADCAST_PEERS = 32
+"""`Node.broadcast` computes delays with NumPy from this many peers on; below, a plain loop is faster."""
+
 
 class Item:
     """Represents objects that can be transmitted over a network (e.g. blocks, messages)."""
 
-    def __init__(self, sender_id: str, size: float, sender_node = None):
+    def __init__(self, sender_id: str, size: float, sender_node = None, creator_id = None):
         """
         Create an Item object.
         * sender_id (str): Id of the sender node. Can be used as a return address.
         * size (float): size of the item in bytes.
+        * creator_id (`sim.util.SimpleAddress`): Id of the node creating the item, whose stream the item id is drawn from. Defaults to `sender_id`.
         """
-        self.id = util.generate_uuid()
+        self.id = util.generate_uuid(sender_id if creator_id is None else creator_id)
         self.size = size
         self.sender_id = sender_id
         self.sender_node = sender_node
@@ -58,7 +65,7 @@ class Block(Item):
         * prev_id (str): Id of the block this block was mined on top of.
         * height (int): Height of the block in the blockchain.
         """
-        super().__init__(None, 0)
+        super().__init__(None, 0, creator_id=creator.id)
         self.prev_id = prev_id
         self.miner = creator.name
         self.created_at = creator.timestamp
@@ -66,6 +73,8 @@ class Block(Item):
         self.size = 0
         self.tx_count = 0
         self.transactions = []
+        self.tx_ids = None
+        """Ids of the transactions of the block if they are kept in a columnar store instead of `transactions`."""
         self.reward: Reward = None
 
     def add_tx(self, tx):
@@ -89,6 +98,35 @@ class Block(Item):
         return f'BLOCK (id:{self.id}, prev: {self.prev_id})'
 
 
+class BlockHeader:
+    """Headers-only stub of a `Block`, as kept in the bookkeeper's global block record."""
+    __slots__ = ('id', 'prev_id', 'miner', 'created_at', 'height', 'size', 'tx_count', 'reward')
+
+    def __init__(self, block: Block):
+        """
+        Create a BlockHeader object.
+        * block (`Block`): Block to keep the header of.
+        """
+        self.id = block.id
+        self.prev_id = block.prev_id
+        self.miner = block.miner
+        self.created_at = block.created_at
+        self.height = block.height
+        self.size = block.size
+        self.tx_count = block.tx_count
+        self.reward = block.reward
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __str__(self) -> str:
+        return f'HEADER (id:{self.id}, prev: {self.prev_id})'
+
+
 class GetAddrMessage(Item):
     """Represents GetAddr messages"""
     def __init__(self, sender_id: str):
@@ -107,6 +145,7 @@ class Packet:
         """
         self.payload = payload
         self.reveal_at = 0
+        """Reveal time at the target; not set for packets shared by the targets of `Node.broadcast`."""
 
 
 class Node:
@@ -118,10 +157,16 @@ class Node:
         * region (`sim.util.Region`): Geographic region of the node.
         * timestamp (int): Initial timestamp of the node. Defaults to zero.
         """
-        self.id = util.SimpleAddress.randomaddress()
+        self.rng: random.Random = rng.streams.stream('nodes')
+        """Node's source of randomness; `Simulation.add_node` gives every node its own stream of `sim.rng`."""
+        self.id = util.SimpleAddress.randomaddress(fresh=True)
+        self.index = None
+        """Position of the node in the simulation's node list, set by `Simulation.add_node`."""
         self.name = name
         self.timestamp = timestamp
         self.region = region
+        self.region_index = REGION_INDEX.get(region, None)
+        """Index of the node's region in the delay matrices of `sim.network_util`."""
         self.iter_seconds = iter_seconds
 
         self.blockchain: Dict[str, Block] = dict()
@@ -143,16 +188,40 @@ class Node:
         This is used to simulate links that can only  transmit one message at a time. A new message starts transmission only after the previous one has been received.
         """
 
-        self.new_table: NewTable = NewTable()
+        self.new_table: NewTable = NewTable(iter_seconds=iter_seconds)
         """
         A table holding new Nodes that want to connect and havent been seen.
         """
 
-        self.tried_table: TriedTable = TriedTable()
+        self.tried_table: TriedTable = TriedTable(iter_seconds=iter_seconds)
         """
         A table holding tried Nodes that have been seen perviously.
         """
 
+        self.traffic = None
+        """Optional `sim.traffic.TrafficCounter` that counts every item sent by the node."""
+
+        self.connections = ConnectionManager(iter_seconds)
+        """Pending handshakes and schedule of outgoing connection attempts."""
+
+        self.addr_tokens: Dict[str, tuple] = dict()
+        """Dictionary with peer ids as keys and (tokens, timestamp) of their ADDR rate limit as values, see `rate_limit_addrs`."""
+
+        self.keepalive_timers: Dict[int, List[str]] = dict()
+        """Timers with simulation timestamps as keys and lists of ids of outgoing connections to check at that timestamp as values."""
+
+        self.keepalive_due: Dict[str, int] = dict()
+        """Dictionary with ids of outgoing connections as keys and the timestamp of their pending keepalive check as values; other timers of a connection are stale."""
+
+        self.ping_steps = self.connections.steps(util.PING_INTERVAL)
+        """Simulation steps of silence on an outgoing connection before it is pinged, see `sim.util.PING_INTERVAL`."""
+
+        self.stale_steps = self.connections.steps(util.STALE_TIMEOUT)
+        """Simulation steps of silence after which an outgoing connection is dropped, see `sim.util.STALE_TIMEOUT`."""
+
+        self.connected_at: Dict[str, int] = dict()
+        """Dictionary with ids of outgoing connections as keys and the timestamp they were established at as values, see `last_seen`."""
+
         self.is_online = True
 
     def __getstate__(self):
@@ -165,6 +234,7 @@ class Node:
         del state['timestamp']
         del state['new_table']
         del state['tried_table']
+        state.pop('traffic', None)
         return state
 
     def __str__(self) -> str:
@@ -179,20 +249,70 @@ class Node:
         Perform one simulation step. Increments its timestamp by 1 and returns the list of `Item` objects to act on in that step.
         * seconds (float): How many real-time seconds one simulation step corresponds to.
         """
-        if len(self.outs) < util.MAX_OUTGOING_CONNECTIONS and self.timestamp > 400:
-            node = self.get_peer(len(self.outs) + 1)
-            if node.id not in self.outs and node.is_online:
-                self.connect(node)
-                self.send_to(node, GetAddrMessage(self.id))
+        if self.timestamp > 400:
+            self.connections.step(self)
         self.timestamp += 1
+        return self.pop_inbox()
+
+    def open_connection(self) -> bool:
+        """
+        Try to open an outgoing connection to a random known peer. Returns False if no handshake was started.
+        """
+        node = self.get_peer(len(self.outs) + 1)
+        if node is None or node.id in self.outs or node.id in self.connections.pending or not node.is_online:
+            return False
+        return self.connect(node, kind=OUTBOUND)
+
+    def open_feeler(self) -> bool:
+        """
+        Try to open a feeler connection to a random address of the new table. Returns False if no handshake was started.
+        """
+        entry = self.new_table.random_entry(self.rng)
+        node = None if entry is None else self.node_storage.get_node(entry.ip)
+        if node is None or node.id in self.outs or node.id in self.connections.pending or not node.is_online:
+            return False
+        self.send_to(node, VersionMessage(self.id, self))
+        self.new_table.attempt(node.id, self.timestamp)
+        self.connections.add_pending(node.id, self.timestamp, FEELER)
+        return True
+
+    def pop_inbox(self) -> List[Item]:
+        """
+        Remove and return the items revealed at the current timestamp.
+        """
         try:
             return [packet.payload for packet in self.inbox.pop(self.timestamp)]
         except KeyError:
             return []
 
     def fill_new_table(self, sender_id, addresses):
-        for address in addresses:
-            self.new_table.add(sender_id, address, self.timestamp)
+        self.new_table.add_many(sender_id, addresses, self.timestamp)
+
+    def rate_limit_addrs(self, sender_id, addresses: List) -> List:
+        """
+        Returns the addresses of an ADDR message the node processes, following Bitcoin Core's token bucket:
+        every peer earns `MAX_ADDR_RATE_PER_SECOND` addresses per second, and a GETADDR request allows a full
+        response (see `expect_addrs`). Messages with more than `MAX_ADDR_TO_SEND` addresses are ignored.
+        * sender_id (`sim.util.SimpleAddress`): Id of the sender.
+        * addresses (List[`sim.util.SimpleAddress`]): Addresses of the message.
+        """
+        if len(addresses) > util.MAX_ADDR_TO_SEND:
+            return []
+        tokens, since = self.addr_tokens.get(sender_id, (1.0, self.timestamp))
+        if tokens < util.MAX_ADDR_PROCESSING_TOKEN_BUCKET:  # refills stop at the cap, a GETADDR allowance may exceed it
+            tokens = min(tokens + (self.timestamp - since) * self.iter_seconds * util.MAX_ADDR_RATE_PER_SECOND,
+                         util.MAX_ADDR_PROCESSING_TOKEN_BUCKET)
+        count = min(len(addresses), int(tokens))
+        self.addr_tokens[sender_id] = (tokens - count, self.timestamp)
+        return addresses if count == len(addresses) else addresses[:count]
+
+    def expect_addrs(self, peer_id):
+        """
+        Allow a full ADDR response from a peer that was just sent a GETADDR.
+        * peer_id (`sim.util.SimpleAddress`): Id of the peer.
+        """
+        tokens, since = self.addr_tokens.get(peer_id, (1.0, self.timestamp))
+        self.addr_tokens[peer_id] = (tokens + util.MAX_ADDR_TO_SEND, since)
 
     def fill_tried_table(self, addresses):
         for address in addresses:
@@ -206,17 +326,19 @@ class Node:
         return self.tried_table if util.triedprob(rho, omega) else self.new_table
 
     def choose_one(self, l):
-        return random.choice(l)
+        return self.rng.choice(l)
 
     def get_peer(self, omega):
+        """
+        Pick a random known peer from one of the address tables, or None if the chosen table is empty
+        or the address does not belong to a simulated node.
+        * omega (int): Number of outgoing connections, used to choose between the tried and new tables.
+        """
         table = self.choose_table(omega)
-        filled_buckets_index = set()
-        for data in table.data.values():
-            filled_buckets_index.add(data['bucket'])
-        index = self.choose_one(list(filled_buckets_index))
-        peer_entry = self.choose_one([i for i in table[index] if i])
-        node = self.node_storage.get_node(peer_entry.ip)
-        return node
+        peer_entry = table.random_entry(self.rng)
+        if peer_entry is None:
+            return None
+        return self.node_storage.get_node(peer_entry.ip)
 
     def reset(self):
         """
@@ -228,6 +350,54 @@ class Node:
         self.ins = dict()
         self.outs = dict()
         self.last_reveal_times = dict()
+        self.connections = ConnectionManager(self.iter_seconds)
+        self.addr_tokens = dict()
+        self.keepalive_timers = dict()
+        self.keepalive_due = dict()
+        self.connected_at = dict()
+
+    def network_step(self, seconds: float):
+        """
+        Perform one simulation step of peer-to-peer activity only, without producing blocks or transactions.
+        Used to bootstrap the network, see `sim.warm_start`.
+        * seconds (float): How many real-time seconds one simulation step corresponds to.
+        """
+        return self.step(seconds)
+
+    def network_state(self) -> dict:
+        """
+        Returns the node's connections, address tables and timestamp.
+        """
+        return {
+            'id': int(self.id),
+            'timestamp': self.timestamp,
+            'outs': [int(addr) for addr in self.outs],
+            'ins': [int(addr) for addr in self.ins],
+            'new_table': self.new_table,
+            'tried_table': self.tried_table,
+        }
+
+    def restore_network_state(self, state: dict):
+        """
+        Restore connections, address tables and timestamp saved by `network_state`. Messages in flight
+        are dropped and links become idle.
+        * state (dict): Saved state; peers are looked up in the node storage.
+        """
+        peers = [self.node_storage.get_node(util.SimpleAddress.from_int(addr)) for addr in state['outs'] + state['ins']]
+        self.timestamp = state['timestamp']
+        self.outs = {peer.id: peer for peer in peers[:len(state['outs'])]}
+        self.ins = {peer.id: peer for peer in peers[len(state['outs']):]}
+        self.new_table = state['new_table']
+        self.tried_table = state['tried_table']
+        self.inbox = dict()
+        self.last_reveal_times = dict()
+        self.connections = ConnectionManager(self.iter_seconds)
+        self.addr_tokens = dict()
+        self.keepalive_timers = dict()
+        self.keepalive_due = dict()
+        self.connected_at = {addr: self.timestamp for addr in self.outs}
+        for addr in self.outs:
+            self.schedule_keepalive(addr, self.last_seen(addr) + self.ping_steps + 1)
 
     def restart(self):
         current_time = self.timestamp
@@ -240,8 +410,11 @@ class Node:
         * node (`sim.base_models.Node`): Target node.
         * item (`sim.base_models.Item`): Item to send.
         """
+        if self.traffic is not None:
+            self.traffic.record(self.index, node.index, item)
         packet = Packet(item)
-        delay = get_delay(self.region, node.region, item.size) / self.iter_seconds
+        region = node.region_index
+        delay = (LATENCY_ROWS[self.region_index][region] + item.size / SPEED_ROWS[self.region_index][region]) / self.iter_seconds
         reveal_time = math.ceil(max(self.timestamp, self.last_reveal_times.get(node.id, 0)) + delay)
         self.last_reveal_times[node.id] = reveal_time
         packet.reveal_at = reveal_time
@@ -250,20 +423,90 @@ class Node:
         except KeyError:
             node.inbox[packet.reveal_at] = [packet]
 
+    def broadcast(self, item: Item, peers: List = None):
+        """
+        Send the same item to many nodes, e.g. to flood INV messages. Equivalent to calling `send_to` for
+        every peer, but all targets share one packet and large fan-outs compute their delays in one step.
+        * item (`sim.base_models.Item`): Item to send.
+        * peers (List[`sim.base_models.Node`]): Target nodes. Defaults to the node's outgoing connections.
+        """
+        peers = list(self.outs.values() if peers is None else peers)
+        if not peers:
+            return
+        if self.traffic is not None:
+            for node in peers:
+                self.traffic.record(self.index, node.index, item)
+        packet = Packet(item)
+        last_reveal_times = self.last_reveal_times
+        if len(peers) >= VECTORIZED_BROADCAST_PEERS:
+            count = len(peers)
+            regions = np.fromiter((node.region_index for node in peers), dtype=np.intp, count=count)
+            busy = np.fromiter((last_reveal_times.get(node.id, 0) for node in peers), dtype=np.float64, count=count)
+            delays = get_delays(self.region_index, regions, item.size) / self.iter_seconds
+            reveal_times = np.ceil(np.maximum(busy, self.timestamp) + delays).astype(np.int64).tolist()
+        else:
+            latencies, speeds = LATENCY_ROWS[self.region_index], SPEED_ROWS[self.region_index]
+            reveal_times = [math.ceil(max(self.timestamp, last_reveal_times.get(node.id, 0))
+                                      + (latencies[node.region_index] + item.size / speeds[node.region_index]) / self.iter_seconds)
+                            for node in peers]
+        for node, reveal_time in zip(peers, reveal_times):
+            last_reveal_times[node.id] = reveal_time
+            try:
+                node.inbox[reveal_time].append(packet)
+            except KeyError:
+                node.inbox[reveal_time] = [packet]
+
+    def last_seen(self, addr) -> int:
+        """
+        Returns the timestamp of the last message from the peer of an outgoing connection: its tried table
+        timestamp, or the time the connection was established if its entry has been evicted since.
+        * addr (`sim.util.SimpleAddress`): Id of the connected node.
+        """
+        return self.tried_table.get_timestamp(addr, self.connected_at.get(addr, 0))
+
+    def schedule_keepalive(self, addr, timestamp: int):
+        """
+        Schedule the keepalive check of an outgoing connection, replacing its pending check.
+        * addr (`sim.util.SimpleAddress`): Id of the connected node.
+        * timestamp (int): Simulation timestamp of the check; moved to the next step if it is not in the future.
+        """
+        timestamp = max(timestamp, self.timestamp + 1)
+        self.keepalive_due[addr] = timestamp
+        try:
+            self.keepalive_timers[timestamp].append(addr)
+        except KeyError:
+            self.keepalive_timers[timestamp] = [addr]
+
+    def pop_keepalive_timers(self) -> List:
+        """
+        Remove the keepalive timers of the current timestamp and return the ids of the outgoing connections
+        whose check is due now.
+        """
+        addrs = self.keepalive_timers.pop(self.timestamp, None)
+        if addrs is None:
+            return []
+        return [addr for addr in addrs if self.keepalive_due.get(addr, None) == self.timestamp]
+
     def preconnect(self, node):
         return node.is_online and len(self.outs) < util.MAX_OUTGOING_CONNECTIONS
 
-    def connect(self, node):
+    def connect(self, node, kind: str = MANUAL) -> bool:
         """
-        Establish an outgoing connection to one or more nodes.
-        * argv (`sim.base_models.Node`+): Node(s) to establish connections with.
+        Start the handshake of an outgoing connection to a node. Returns False if the connection is not allowed.
+        * node (`sim.base_models.Node`): Node to establish a connection with.
+        * kind (str): Kind of the connection, see `sim.connections`.
         """
         if self.preconnect(node):
             self.send_to(node, VersionMessage(self.id, self))
             # self.outs[node.id] = node
             # node.ins[self.id] = self
             self.fill_tried_table([node.id])
+            self.tried_table.attempt(node.id, self.timestamp)
+            self.new_table.attempt(node.id, self.timestamp)
             node.fill_tried_table([self.id])
+            self.connections.add_pending(node.id, self.timestamp, kind)
+            return True
+        return False
 
     def print_blockchain(self, head: Block = None):
         logger.warning(f'{self.name}')
@@ -278,6 +521,12 @@ class Reward:
         self.timestamp = node.timestamp
         self.node = node
 
+    def __getstate__(self):
+        # keep pickled blocks and bookkeepers from dragging the whole network along
+        state = self.__dict__.copy()
+        state['node'] = None
+        return state
+
 @util.singleton
 class NodeStorage:
     def __init__(self) -> None:
@@ -289,11 +538,21 @@ class NodeStorage:
     def get_node(self, _id):
         return self.nodes[_id] if _id in self.nodes else None
 
+    def clear(self):
+        self.nodes.clear()
+
 class MessageStorage:
     def __init__(self) -> None:
         self.messages = {}
+        self.count = 0
+        """Number of messages consumed, counted even when recording is disabled."""
+        self.enabled = True
+        """Set to False to skip recording messages, e.g. in headless batch runs."""
 
     def add(self, to, item):
+        self.count += 1
+        if not self.enabled:
+            return
         if item.__class__.__name__ in self.messages:
             if f"[{item.sender_id}] [{to.id}]" in self.messages[item.__class__.__name__]:
                 self.messages[item.__class__.__name__][f"[{item.sender_id}] [{to.id}]"] += [item.__dict__]
@@ -0,0 +1,110 @@
+"""
+Sparse sets of dense integer ids.
+
+`ChunkedBitmap` stores a set of non-negative integers, such as transaction indices, as fixed-size
+bitmap chunks that are created on first use and dropped once empty. Chunks whose bits are all set,
+or that were declared fully set with `fill_below`, are replaced by one shared read-only chunk, so a
+set that covers almost all old ids costs memory only for its recent, partially filled chunks.
+"""
+
+import numpy as np
+
+CHUNK_BITS = 1 << 12
+"""Number of ids per chunk."""
+
+_SHIFT = CHUNK_BITS.bit_length() - 1
+_MASK = CHUNK_BITS - 1
+_FULL = bytes([0xFF]) * (CHUNK_BITS // 8)
+
+
+class ChunkedBitmap:
+    """Set of non-negative integers stored as sparse bitmap chunks."""
+
+    __slots__ = ('chunks', 'counts', 'size', 'filled')
+
+    def __init__(self):
+        self.chunks = dict()
+        """Dictionary with chunk numbers as keys and bytearrays (or the shared full chunk) as values."""
+        self.counts = dict()
+        """Number of set bits of every partially filled chunk."""
+        self.size = 0
+        self.filled = 0
+        """Chunks below this chunk number are all set, see `fill_below`."""
+
+    def __contains__(self, i: int) -> bool:
+        c = i >> _SHIFT
+        if c < self.filled:
+            return True
+        chunk = self.chunks.get(c, None)
+        return chunk is not None and chunk[(i & _MASK) >> 3] >> (i & 7) & 1 == 1
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, i: int) -> bool:
+        """
+        Add an id to the set. Returns False if it was already in it.
+        * i (int): Id to add.
+        """
+        c = i >> _SHIFT
+        if c < self.filled:
+            return False
+        chunk = self.chunks.get(c, None)
+        if chunk is None:
+            chunk = self.chunks[c] = bytearray(CHUNK_BITS // 8)
+            self.counts[c] = 0
+        byte, bit = (i & _MASK) >> 3, 1 << (i & 7)
+        if chunk[byte] & bit:
+            return False
+        chunk[byte] |= bit
+        self.size += 1
+        count = self.counts[c] = self.counts[c] + 1
+        if count == CHUNK_BITS:
+            self.chunks[c] = _FULL
+            del self.counts[c]
+        return True
+
+    def discard(self, i: int) -> bool:
+        """
+        Remove an id from the set. Returns False if it was not in it.
+        * i (int): Id to remove.
+        """
+        c = i >> _SHIFT
+        chunk = self.chunks.get(c, None)
+        if chunk is None:
+            return False
+        byte, bit = (i & _MASK) >> 3, 1 << (i & 7)
+        if not chunk[byte] & bit:
+            return False
+        if chunk is _FULL:
+            chunk = self.chunks[c] = bytearray(_FULL)
+            self.counts[c] = CHUNK_BITS
+        chunk[byte] &= ~bit
+        self.size -= 1
+        count = self.counts[c] = self.counts[c] - 1
+        if count == 0:
+            del self.chunks[c]
+            del self.counts[c]
+        return True
+
+    def fill_below(self, i: int):
+        """
+        Treat all ids below the chunk of the given id as set and free their chunks, e.g. to forget which
+        old transactions a node has seen. Ids filled this way are not counted by `len` and cannot be removed.
+        * i (int): Id.
+        """
+        c = i >> _SHIFT
+        if c <= self.filled:
+            return
+        for old in [old for old in self.chunks if old < c]:
+            self.size -= self.counts.pop(old, CHUNK_BITS)
+            del self.chunks[old]
+        self.filled = c
+
+    def indices(self) -> np.ndarray:
+        """
+        Returns the sorted ids of the set stored in chunks, i.e. not filled with `fill_below`.
+        """
+        parts = [np.flatnonzero(np.unpackbits(np.frombuffer(bytes(self.chunks[c]), dtype=np.uint8),
+                                              bitorder='little')) + (c << _SHIFT) for c in sorted(self.chunks)]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
@@ -0,0 +1,123 @@
+"""
+Outbound connection management.
+
+Nodes used to pick a peer and send VERSION and GETADDR on every step while they had free outbound slots,
+also while their handshakes were still in flight. `ConnectionManager` keeps the pending handshakes of a
+node, waits with exponential backoff after failed attempts, and, once all outbound slots are used,
+periodically opens a feeler connection to an address of the new table like Bitcoin Core: a feeler that
+completes the handshake moves its address to the tried table and is closed right away. GETADDR is only
+sent once an outbound handshake completes.
+
+Every attempt draws up to `ADDRESS_TRIES` addresses. Attempts that find no usable address and
+handshakes that time out both count as failures.
+
+Delays are given in seconds and converted to simulation steps with the node's `iter_seconds`.
+"""
+
+import math
+from typing import Dict, Tuple
+
+from sim import util
+
+HANDSHAKE_TIMEOUT_SECONDS = 60
+"""Seconds after which an unanswered VERSION counts as a failed connection attempt."""
+CONNECT_RETRY_SECONDS = 0.5
+"""Delay after the first failed attempt; it doubles with every further consecutive failure."""
+MAX_CONNECT_BACKOFF_SECONDS = 60
+"""Upper bound of the delay between failed attempts."""
+FEELER_INTERVAL_SECONDS = 2 * 60
+"""Seconds between feeler connections."""
+ADDRESS_TRIES = 10
+"""Addresses drawn per attempt before giving up until the next one, e.g. because all were connected already."""
+
+OUTBOUND = 'outbound'
+"""Kind of the connections opened to fill outbound slots."""
+FEELER = 'feeler'
+"""Kind of the short-lived connections that test addresses of the new table."""
+MANUAL = 'manual'
+"""Kind of the connections opened directly with `Node.connect`, e.g. by `sim.topology`."""
+
+
+class ConnectionManager:
+    """Pending handshakes and connection attempt schedule of one node."""
+
+    def __init__(self, iter_seconds: float):
+        """
+        Create a ConnectionManager object.
+        * iter_seconds (float): How many real-world seconds one simulation step corresponds to.
+        """
+        self.iter_seconds = iter_seconds
+        self.pending: Dict[str, Tuple[int, str]] = dict()
+        """Dictionary with ids of the nodes a handshake is in flight with as keys and (deadline, kind) as values."""
+        self.failures = 0
+        """Consecutive failed attempts, reset by a completed handshake."""
+        self.next_attempt = 0
+        """Timestamp of the next outbound connection attempt."""
+        self.next_feeler = self.steps(FEELER_INTERVAL_SECONDS)
+        """Timestamp of the next feeler connection."""
+
+    def steps(self, seconds: float) -> int:
+        """
+        Returns the number of simulation steps (at least one) corresponding to the given seconds.
+        * seconds (float): Duration in seconds.
+        """
+        return max(1, math.ceil(seconds / self.iter_seconds))
+
+    def step(self, node):
+        """
+        Expire overdue handshakes and open an outbound or feeler connection if one is due.
+        * node (`sim.base_models.Node`): Node owning the manager.
+        """
+        now = node.timestamp
+        if self.pending:
+            self.expire(now)
+        outbound = sum(1 for _, kind in self.pending.values() if kind != FEELER)
+        if len(node.outs) + outbound < util.MAX_OUTGOING_CONNECTIONS:
+            if now >= self.next_attempt:
+                if any(node.open_connection() for _ in range(ADDRESS_TRIES)):
+                    self.next_attempt = now + 1
+                else:
+                    self.fail(now)
+        elif now >= self.next_feeler:
+            self.next_feeler = now + self.steps(FEELER_INTERVAL_SECONDS)
+            if all(kind != FEELER for _, kind in self.pending.values()):
+                node.open_feeler()
+
+    def add_pending(self, addr, now: int, kind: str):
+        """
+        Track a handshake that was just started.
+        * addr (`sim.util.SimpleAddress`): Id of the node the VERSION was sent to.
+        * now (int): Current timestamp.
+        * kind (str): `OUTBOUND`, `FEELER` or `MANUAL`.
+        """
+        self.pending[addr] = (now + self.steps(HANDSHAKE_TIMEOUT_SECONDS), kind)
+
+    def complete(self, addr) -> str:
+        """
+        Record a completed handshake and return its kind, or None if no handshake with the node was pending.
+        * addr (`sim.util.SimpleAddress`): Id of the node that answered with VERACK.
+        """
+        entry = self.pending.pop(addr, None)
+        if entry is None:
+            return None
+        self.failures = 0
+        return entry[1]
+
+    def expire(self, now: int):
+        """
+        Drop the handshakes that are overdue, counting the outbound ones as failed attempts.
+        * now (int): Current timestamp.
+        """
+        for addr in [addr for addr, (deadline, _) in self.pending.items() if deadline <= now]:
+            _, kind = self.pending.pop(addr)
+            if kind != FEELER:
+                self.fail(now)
+
+    def fail(self, now: int):
+        """
+        Record a failed attempt and postpone the next one with exponential backoff.
+        * now (int): Current timestamp.
+        """
+        self.failures += 1
+        delay = min(CONNECT_RETRY_SECONDS * 2 ** min(self.failures - 1, 32), MAX_CONNECT_BACKOFF_SECONDS)
+        self.next_attempt = max(self.next_attempt, now + self.steps(delay))
@@ -2,6 +2,8 @@
 Helper functions to perform network-layer calculations.
 """
 
+import numpy as np
+
 from sim.util import Region
 
 
@@ -135,4 +137,29 @@ LATENCY = {  # seconds
     (Region.NR, Region.VN): 165 * 0.001,
 
     (Region.VN, Region.VN): 0 * 0.001,
-}
\ No newline at end of file
+}
+
+REGIONS = list(Region)
+"""The supported regions in the order of their indices."""
+
+REGION_INDEX = {region: i for i, region in enumerate(REGIONS)}
+"""Dictionary with regions as keys and their indices in the delay matrices as values."""
+
+LATENCY_MATRIX = np.array([[latency(a, b) for b in REGIONS] for a in REGIONS])
+"""Latency in seconds between every pair of regions, indexed by region indices."""
+
+SPEED_MATRIX = np.array([[speed(a, b) for b in REGIONS] for a in REGIONS])
+"""Bottleneck bandwidth in bytes per second between every pair of regions, indexed by region indices."""
+
+LATENCY_ROWS = LATENCY_MATRIX.tolist()
+SPEED_ROWS = SPEED_MATRIX.tolist()
+
+
+def get_delays(src: int, dests: np.ndarray, size: float) -> np.ndarray:
+    """
+    Returns the delays (in seconds) of a message from one region to many, like `get_delay`.
+    * src (int): Index of the source region.
+    * dests (np.ndarray): Indices of the destination regions.
+    * size (float): Message size in bytes.
+    """
+    return LATENCY_MATRIX[src, dests] + size / SPEED_MATRIX[src, dests]
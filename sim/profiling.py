@@ -0,0 +1,118 @@
+"""
+Opt-in instrumentation of the simulator's hot paths.
+
+A `Profiler` replaces methods on their classes with timing wrappers while it is installed, so
+nothing is paid when profiling is disabled. Each wrapper adds roughly a third of a microsecond per
+call; `Node.step` itself is not wrapped since its total is the simulation time. Times are inclusive:
+a `consume` that sends a reply also counts towards `send_to`.
+"""
+
+import json
+from time import perf_counter
+from typing import Dict, List
+
+from loguru import logger
+
+
+class Profiler:
+    """Cumulative wall time and call counts of instrumented methods."""
+
+    def __init__(self):
+        self.stats: Dict[str, List] = dict()
+        """Dictionary with labels as keys and `[seconds, calls]` lists as values."""
+        self._patched = []
+
+    def _stat(self, label: str) -> List:
+        return self.stats.setdefault(label, [0.0, 0])
+
+    def wrap(self, cls, name: str, label: str = None):
+        """
+        Time every call of a method of a class until `uninstall` is called.
+        * cls (type): Class to patch; subclasses that do not override the method are affected as well.
+        * name (str): Method name.
+        * label (str): Label of the measurements. Defaults to `<class>.<name>`.
+        """
+        original = getattr(cls, name)
+        stat = self._stat(label or f'{cls.__name__}.{name}')
+
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            result = original(*args, **kwargs)
+            stat[0] += perf_counter() - start
+            stat[1] += 1
+            return result
+
+        self._patched.append((cls, name, cls.__dict__.get(name, None)))
+        setattr(cls, name, timed)
+
+    def wrap_by_type(self, cls, name: str, label: str = None):
+        """
+        Like `wrap`, for methods taking a single item; measurements are labelled with the item's type.
+        * cls (type): Class to patch.
+        * name (str): Method name.
+        * label (str): Label prefix. Defaults to `<class>.<name>`.
+        """
+        original = getattr(cls, name)
+        prefix = label or f'{cls.__name__}.{name}'
+        stats = dict()
+
+        def timed(obj, item):
+            start = perf_counter()
+            result = original(obj, item)
+            item_type = type(item)
+            stat = stats.get(item_type, None)
+            if stat is None:
+                stat = stats[item_type] = self._stat(f'{prefix}[{item_type.__name__}]')
+            stat[0] += perf_counter() - start
+            stat[1] += 1
+            return result
+
+        self._patched.append((cls, name, cls.__dict__.get(name, None)))
+        setattr(cls, name, timed)
+
+    def install(self, tx_model=None):
+        """
+        Instrument the `Node.step` phases, `consume` per message type, `send_to` and the tx model methods.
+        * tx_model (`bitcoin.tx_modelings.TxModel`): Transaction model in use.
+        """
+        from sim.base_models import Node
+        from bitcoin.models import Miner
+
+        self.wrap(Node, 'open_connection', 'step.connect')
+        self.wrap(Miner, 'keepalive', 'step.keepalive')
+        self.wrap(Miner, 'drain_inbox', 'step.inbox')
+        self.wrap(Miner, 'generate_transactions', 'step.tx_generation')
+        self.wrap(Miner, 'mine', 'step.mining')
+        self.wrap_by_type(Miner, 'consume', 'consume')
+        self.wrap(Node, 'send_to', 'send_to')
+        self.wrap(Node, 'broadcast', 'broadcast')
+        if tx_model is not None:
+            for name in ('generate', 'generate_many', 'publish', 'receive', 'fill_block', 'update_mempool'):
+                self.wrap(type(tx_model), name, f'tx_model.{name}')
+
+    def uninstall(self):
+        """
+        Restore all patched methods.
+        """
+        for cls, name, original in reversed(self._patched):
+            if original is None:
+                delattr(cls, name)
+            else:
+                setattr(cls, name, original)
+        self._patched = []
+
+    def results(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the measurements sorted by total time, skipping methods that were never called.
+        """
+        return {label: {'seconds': seconds, 'calls': calls, 'us_per_call': seconds / calls * 1e6}
+                for label, (seconds, calls) in sorted(self.stats.items(), key=lambda kv: -kv[1][0]) if calls}
+
+    def report(self):
+        for label, stat in self.results().items():
+            logger.warning(f'{label:36} {stat["seconds"]:10.3f}s {stat["calls"]:12d} calls '
+                           f'{stat["us_per_call"]:10.2f}us/call')
+
+    def to_file(self, path: str):
+        with open(path, 'w+') as f:
+            json.dump(self.results(), f, indent=2)
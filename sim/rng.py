@@ -0,0 +1,107 @@
+"""
+Reproducible random number streams.
+
+All randomness of a run derives from one master seed through `np.random.SeedSequence`. Every node
+and every subsystem draws from its own stream, identified by a name and optional integer keys, so
+the draws of one stream do not depend on how many draws the others made, on the order in which
+nodes step, or on how many workers run simulations.
+
+Scalar draws use `random.Random` streams, which are faster than NumPy for single values;
+vectorized code uses `np.random.Generator` streams. `streams` holds the streams of the current run
+and is replaced by `seed`, so always access it as `rng.streams`.
+"""
+
+import random
+import zlib
+
+import numpy as np
+
+
+class Streams:
+    """Named random number streams derived from one seed sequence."""
+
+    def __init__(self, seed: int = None, *key: int):
+        """
+        Create a Streams object.
+        * seed (int): Master seed. Defaults to fresh OS entropy.
+        * key (int): Spawn key, e.g. the repetition number, to derive independent runs from one seed.
+        """
+        self.sequence = np.random.SeedSequence(seed, spawn_key=key)
+        self._python = dict()
+        self._numpy = dict()
+        self.ids = self.stream('ids')
+        """Stream of the ids of `sim.base_models.Item` objects created without a node; nodes draw item ids from their own `ids` streams."""
+        self.fresh_addresses = set()
+        """Packed addresses handed out as fresh node ids in this run, see `sim.util.SimpleAddress.randomaddress`."""
+
+    def _child(self, name: str, key) -> np.random.SeedSequence:
+        return np.random.SeedSequence(self.sequence.entropy,
+                                      spawn_key=self.sequence.spawn_key + (zlib.crc32(name.encode()),) + key)
+
+    def stream(self, name: str, *key: int) -> random.Random:
+        """
+        Returns the `random.Random` stream with the given name and keys, e.g. `stream('node', 3)`.
+        * name (str): Subsystem name.
+        * key (int): Further integer keys, e.g. a node index.
+        """
+        rand = self._python.get((name, key), None)
+        if rand is None:
+            state = self._child(name, key).generate_state(4, np.uint64)
+            rand = self._python[(name, key)] = random.Random(int.from_bytes(state.tobytes(), 'little'))
+        return rand
+
+    def numpy_stream(self, name: str, *key: int) -> np.random.Generator:
+        """
+        Returns the `np.random.Generator` stream with the given name and keys.
+        * name (str): Subsystem name.
+        * key (int): Further integer keys.
+        """
+        gen = self._numpy.get((name, key), None)
+        if gen is None:
+            gen = self._numpy[(name, key)] = np.random.default_rng(self._child(name, key))
+        return gen
+
+    def getstate(self) -> dict:
+        """
+        Returns the state of all streams created so far.
+        """
+        return {'python': {key: rand.getstate() for key, rand in self._python.items()},
+                'numpy': {key: gen.bit_generator.state for key, gen in self._numpy.items()}}
+
+    def setstate(self, state: dict):
+        """
+        Restore streams to a state returned by `getstate`, creating them if necessary.
+        * state (dict): Saved state.
+        """
+        for (name, key), value in state['python'].items():
+            self.stream(name, *key).setstate(value)
+        for (name, key), value in state['numpy'].items():
+            self.numpy_stream(name, *key).bit_generator.state = value
+
+
+streams = Streams()
+"""Streams of the current run."""
+
+
+def seed(value: int = None, *key: int) -> Streams:
+    """
+    Replace `streams` with the streams derived from the given seed and return them.
+    The global `random` and `np.random` states are seeded as well for code outside the simulator.
+    * value (int): Master seed. Defaults to fresh OS entropy.
+    * key (int): Spawn key, e.g. the repetition number.
+    """
+    global streams
+    streams = Streams(value, *key)
+    state = streams.sequence.generate_state(2)
+    random.seed(int(state[0]))
+    np.random.seed(int(state[1]))
+    return streams
+
+
+def entropy(value: int = None) -> int:
+    """
+    Returns the master seed to use for a run: the given seed, or fresh OS entropy that can be logged
+    to reproduce the run later.
+    * value (int): Seed, or None.
+    """
+    return np.random.SeedSequence(value).entropy
@@ -0,0 +1,237 @@
+"""
+Vectorized generators for P2P network topologies.
+
+Generators return directed edge lists as `(E, 2)` integer arrays of node indices, where each row
+`(src, dst)` means that `src` opens an outgoing connection to `dst`. Edge lists are applied to
+`sim.base_models.Node` objects in bulk with `connect_edges`.
+"""
+
+import gc
+import math
+from array import array
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from sim import util
+
+
+def _without_self_loops(src: np.ndarray, dst: np.ndarray, n: int) -> np.ndarray:
+    """
+    Returns the unique `(src, dst)` pairs with `src != dst`, sorted by source.
+    """
+    keep = src != dst
+    keys = np.unique(src[keep].astype(np.int64) * n + dst[keep])
+    return np.stack([keys // n, keys % n], axis=1)
+
+
+def random_k_out(n: int, k: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Every node connects to `k` nodes chosen uniformly at random among the others; repeated picks are dropped.
+    * n (int): Number of nodes.
+    * k (int): Outgoing connections per node.
+    * rng (`np.random.Generator`): Source of randomness.
+    """
+    if n < 2 or k <= 0:
+        return np.empty((0, 2), dtype=np.int64)
+    src = np.repeat(np.arange(n), k)
+    dst = rng.integers(0, n - 1, size=n * k)
+    dst = dst + (dst >= src)  # skip self
+    return _without_self_loops(src, dst, n)
+
+
+def random_regular(n: int, d: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Approximately `d`-regular random graph built with the configuration model; self-loops and
+    duplicate edges are dropped. Each undirected edge is returned once with a random direction.
+    * n (int): Number of nodes.
+    * d (int): Degree of each node.
+    * rng (`np.random.Generator`): Source of randomness.
+    """
+    stubs = np.repeat(np.arange(n), d)
+    if len(stubs) % 2:
+        stubs = stubs[:-1]
+    rng.shuffle(stubs)
+    pairs = stubs.reshape(-1, 2)
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    pairs = np.unique(np.sort(pairs, axis=1), axis=0)
+    flip = rng.random(len(pairs)) < 0.5
+    pairs[flip] = pairs[flip][:, ::-1]
+    return pairs
+
+
+def small_world(n: int, k: int, rng: np.random.Generator, rewire_prob: float = 0.1) -> np.ndarray:
+    """
+    Watts-Strogatz small-world graph: every node connects to its `k` clockwise ring neighbours,
+    then each edge is rewired to a uniformly random target with probability `rewire_prob`.
+    * n (int): Number of nodes.
+    * k (int): Outgoing connections per node.
+    * rng (`np.random.Generator`): Source of randomness.
+    * rewire_prob (float): Probability of rewiring each edge.
+    """
+    k = min(k, n - 1)
+    src = np.repeat(np.arange(n), k)
+    dst = (src + np.tile(np.arange(1, k + 1), n)) % n
+    rewire = rng.random(len(src)) < rewire_prob
+    targets = rng.integers(0, n - 1, size=int(rewire.sum()))
+    dst[rewire] = targets + (targets >= src[rewire])
+    return _without_self_loops(src, dst, n)
+
+
+def scale_free(n: int, m: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Barabasi-Albert preferential attachment: nodes join in index order and connect to `m` earlier
+    nodes chosen proportionally to their degree.
+    * n (int): Number of nodes.
+    * m (int): Outgoing connections of each joining node.
+    * rng (`np.random.Generator`): Source of randomness.
+    """
+    m = min(m, n - 1)
+    if m <= 0:
+        return np.empty((0, 2), dtype=np.int64)
+    src = np.empty((n - m) * m, dtype=np.int64)
+    dst = np.empty((n - m) * m, dtype=np.int64)
+    # every edge endpoint appears once, so uniform picks are degree-proportional
+    endpoints = np.empty(2 * (n - m) * m, dtype=np.int64)
+    src[:m] = m
+    dst[:m] = np.arange(m)
+    endpoints[:2 * m:2] = m
+    endpoints[1:2 * m:2] = np.arange(m)
+    picks = rng.random((n - m, m))
+    for v in range(m + 1, n):
+        e = (v - m) * m
+        targets = endpoints[(picks[v - m] * 2 * e).astype(np.int64)]
+        src[e:e + m] = v
+        dst[e:e + m] = targets
+        endpoints[2 * e:2 * e + 2 * m:2] = v
+        endpoints[2 * e + 1:2 * e + 2 * m:2] = targets
+    return _without_self_loops(src, dst, n)
+
+
+def region_weighted(regions: np.ndarray, k: int, weights: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    Every node connects to `k` targets chosen with probability proportional to the weight of the target's region.
+    * regions (np.ndarray): Region index of every node.
+    * k (int): Outgoing connections per node.
+    * weights (np.ndarray): Weight of every region index.
+    * rng (`np.random.Generator`): Source of randomness.
+    """
+    n = len(regions)
+    p = np.asarray(weights, dtype=float)[regions]
+    p = p / p.sum()
+    dst = rng.choice(n, size=n * k, p=p)
+    src = np.repeat(np.arange(n), k)
+    return _without_self_loops(src, dst, n)
+
+
+GENERATORS = {
+    'random_k_out': random_k_out,
+    'random_regular': random_regular,
+    'small_world': small_world,
+    'scale_free': scale_free,
+    'region_weighted': region_weighted,
+}
+"""Topology names accepted by `generate`."""
+
+
+def generate(name: str, n: int, k: int, rng: np.random.Generator,
+             regions: np.ndarray = None, weights: np.ndarray = None, rewire_prob: float = 0.1) -> np.ndarray:
+    """
+    Returns the edge list of the topology with the given name.
+    * name (str): One of `GENERATORS`.
+    * n (int): Number of nodes.
+    * k (int): Connections per node (out-degree, degree or attachment count depending on the topology).
+    * rng (`np.random.Generator`): Source of randomness.
+    * regions (np.ndarray): Region index of every node, for `region_weighted`.
+    * weights (np.ndarray): Weight of every region index, for `region_weighted`.
+    * rewire_prob (float): Rewiring probability, for `small_world`.
+    """
+    if name not in GENERATORS:
+        raise ValueError(f'Unknown topology {name}, expected one of {list(GENERATORS)}')
+    if name == 'region_weighted':
+        return region_weighted(regions, k, weights, rng)
+    if name == 'small_world':
+        return small_world(n, k, rng, rewire_prob=rewire_prob)
+    return GENERATORS[name](n, k, rng)
+
+
+def load_edge_list(path: str) -> Tuple[List[str], List[Optional[str]], np.ndarray, np.ndarray]:
+    """
+    Stream a topology snapshot from an edge list file, e.g. crawler data.
+
+    Every non-empty line describes one outgoing connection as whitespace or comma separated columns:
+
+        <src> <dst> [<src_region> <dst_region> [<src_mine_power> <dst_mine_power>]]
+
+    Node names are arbitrary tokens (e.g. IP addresses) and `#` starts a comment. Region and mining
+    power columns may be `-` when unknown; the last value seen for a node wins.
+
+    Returns a tuple with the node names in order of first appearance, their regions (None if unknown),
+    their mining powers (NaN if unknown) and the `(E, 2)` edge list over node indices.
+    * path (str): Path of the edge list file.
+    """
+    index = dict()
+    names, regions = [], []
+    powers, src, dst = array('d'), array('q'), array('q')
+
+    def node_index(name, region, power):
+        i = index.get(name, None)
+        if i is None:
+            i = index[name] = len(names)
+            names.append(name)
+            regions.append(None)
+            powers.append(math.nan)
+        if region is not None and region != '-':
+            regions[i] = region
+        if power is not None and power != '-':
+            powers[i] = float(power)
+        return i
+
+    with open(path, 'r') as f:
+        for line_no, line in enumerate(f, 1):
+            columns = line.split('#', 1)[0].replace(',', ' ').split()
+            if not columns:
+                continue
+            if len(columns) not in (2, 4, 6):
+                raise ValueError(f'{path}:{line_no}: expected 2, 4 or 6 columns, got {len(columns)}')
+            columns += [None] * (6 - len(columns))
+            src.append(node_index(columns[0], columns[2], columns[4]))
+            dst.append(node_index(columns[1], columns[3], columns[5]))
+
+    edges = np.stack([np.frombuffer(src, dtype=np.int64), np.frombuffer(dst, dtype=np.int64)], axis=1) \
+        if src else np.empty((0, 2), dtype=np.int64)
+    return names, regions, np.frombuffer(powers, dtype=float).copy(), edges
+
+
+def connect_edges(nodes: List, edges: np.ndarray, handshake: bool = True):
+    """
+    Apply an edge list to the given nodes.
+    * nodes (List[`sim.base_models.Node`]): Nodes indexed by the edge list.
+    * edges (np.ndarray): `(E, 2)` array of `(src, dst)` node indices.
+    * handshake (bool): If True, every source calls `Node.connect` and the connection completes through the
+      VERSION/VERACK exchange. If False, `outs`/`ins` and tried tables are filled directly, as if the
+      handshakes had already happened; connection limits are still respected.
+    """
+    # wiring allocates many long-lived objects; cyclic GC passes over them are wasted work
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        if handshake:
+            for src, dst in edges.tolist():
+                nodes[src].connect(nodes[dst])
+            return
+
+        for src, dst in edges.tolist():
+            a, b = nodes[src], nodes[dst]
+            if len(a.outs) >= util.MAX_OUTGOING_CONNECTIONS or len(b.ins) >= util.MAX_INCOMING_CONNECTIONS:
+                continue
+            a.outs[b.id] = b
+            a.connected_at[b.id] = a.timestamp
+            b.ins[a.id] = a
+            a.tried_table.add(b.id, a.timestamp)
+            a.tried_table.good(b.id, a.timestamp)
+            a.schedule_keepalive(b.id, a.timestamp + a.ping_steps + 1)
+            b.tried_table.add(a.id, b.timestamp)
+    finally:
+        if gc_enabled:
+            gc.enable()
@@ -0,0 +1,183 @@
+"""
+Per-node and per-link traffic accounting.
+
+`Node.send_to` reports every packet to the node's `TrafficCounter` as a `(src, dst, class, size)`
+event appended to flat buffers; no message object is kept alive. Buffers are folded into dense
+NumPy arrays in bulk whenever they fill up or the counters are read:
+
+* per node: `(nodes, classes)` arrays of sent/received message counts and bytes, indexed by `Node.index`;
+* per directed link: `(links, classes)` arrays of message counts and bytes, one row per link that carried
+  traffic, with the rows' endpoints in `link_src`/`link_dst`.
+
+Messages are counted when they are sent, so a message still in flight already counts as received.
+"""
+
+from array import array
+from typing import Dict, List
+
+import numpy as np
+
+
+class TrafficCounter:
+    """Message and byte counters per node and per directed link, broken down by message class."""
+
+    def __init__(self, buffer_size: int = 1 << 20):
+        """
+        Create a TrafficCounter object.
+        * buffer_size (int): Number of buffered events that triggers folding them into the arrays.
+        """
+        self.buffer_size = buffer_size
+        self.classes: Dict[type, int] = dict()
+        """Dictionary with message classes as keys and their column in the counter arrays as values."""
+
+        self.sent_msgs = np.zeros((0, 0), dtype=np.int64)
+        self.sent_bytes = np.zeros((0, 0))
+        self.recv_msgs = np.zeros((0, 0), dtype=np.int64)
+        self.recv_bytes = np.zeros((0, 0))
+
+        self._link_keys = np.zeros(0, dtype=np.int64)  # sorted src << 32 | dst
+        self.link_msgs = np.zeros((0, 0), dtype=np.int64)
+        self.link_bytes = np.zeros((0, 0))
+
+        self.samples: List[Dict[str, np.ndarray]] = []
+        """Per-node totals recorded by `sample`, see `totals`."""
+
+        self._clear_buffers()
+
+    def _clear_buffers(self):
+        self._src, self._dst, self._cls, self._size = array('q'), array('q'), array('q'), array('d')
+
+    def record(self, src: int, dst: int, item):
+        """
+        Count an item sent from one node to another.
+        * src (int): Index of the sender node.
+        * dst (int): Index of the receiver node.
+        * item (`sim.base_models.Item`): Item sent.
+        """
+        cls = self.classes.get(item.__class__, None)
+        if cls is None:
+            cls = self.classes[item.__class__] = len(self.classes)
+        self._src.append(src)
+        self._dst.append(dst)
+        self._cls.append(cls)
+        self._size.append(item.size)
+        if len(self._src) >= self.buffer_size:
+            self.flush()
+
+    @staticmethod
+    def _grow(a: np.ndarray, rows: int, columns: int) -> np.ndarray:
+        if a.shape == (rows, columns):
+            return a
+        grown = np.zeros((rows, columns), dtype=a.dtype)
+        grown[:a.shape[0], :a.shape[1]] = a
+        return grown
+
+    @staticmethod
+    def _accumulate(counts: np.ndarray, totals: np.ndarray, rows: np.ndarray, cls: np.ndarray, size: np.ndarray):
+        flat = rows * counts.shape[1] + cls
+        counts += np.bincount(flat, minlength=counts.size).reshape(counts.shape)
+        totals += np.bincount(flat, weights=size, minlength=totals.size).reshape(totals.shape)
+
+    def flush(self):
+        """
+        Fold the buffered events into the counter arrays.
+        """
+        if not self._src:
+            return
+        src = np.frombuffer(self._src, dtype=np.int64)
+        dst = np.frombuffer(self._dst, dtype=np.int64)
+        cls = np.frombuffer(self._cls, dtype=np.int64)
+        size = np.frombuffer(self._size, dtype=float)
+        columns = len(self.classes)
+
+        nodes = max(len(self.sent_msgs), int(src.max()) + 1, int(dst.max()) + 1)
+        self.sent_msgs = self._grow(self.sent_msgs, nodes, columns)
+        self.sent_bytes = self._grow(self.sent_bytes, nodes, columns)
+        self.recv_msgs = self._grow(self.recv_msgs, nodes, columns)
+        self.recv_bytes = self._grow(self.recv_bytes, nodes, columns)
+        self._accumulate(self.sent_msgs, self.sent_bytes, src, cls, size)
+        self._accumulate(self.recv_msgs, self.recv_bytes, dst, cls, size)
+
+        keys = (src << 32) | dst
+        link_keys = np.union1d(self._link_keys, keys)
+        if len(link_keys) != len(self._link_keys):
+            rows = np.searchsorted(link_keys, self._link_keys)
+            for name in ('link_msgs', 'link_bytes'):
+                old = getattr(self, name)
+                new = np.zeros((len(link_keys), columns), dtype=old.dtype)
+                new[rows, :old.shape[1]] = old
+                setattr(self, name, new)
+            self._link_keys = link_keys
+        self.link_msgs = self._grow(self.link_msgs, len(link_keys), columns)
+        self.link_bytes = self._grow(self.link_bytes, len(link_keys), columns)
+        self._accumulate(self.link_msgs, self.link_bytes, np.searchsorted(link_keys, keys), cls, size)
+
+        self._clear_buffers()
+
+    @property
+    def class_names(self) -> List[str]:
+        """Names of the message classes in column order."""
+        return [cls.__name__ for cls in sorted(self.classes, key=self.classes.get)]
+
+    @property
+    def link_src(self) -> np.ndarray:
+        self.flush()
+        return self._link_keys >> 32
+
+    @property
+    def link_dst(self) -> np.ndarray:
+        self.flush()
+        return self._link_keys & 0xFFFFFFFF
+
+    def totals(self) -> Dict[str, np.ndarray]:
+        """
+        Returns the per-node message and byte totals over all classes so far.
+        """
+        self.flush()
+        return {
+            'sent_msgs': self.sent_msgs.sum(axis=1),
+            'sent_bytes': self.sent_bytes.sum(axis=1),
+            'recv_msgs': self.recv_msgs.sum(axis=1),
+            'recv_bytes': self.recv_bytes.sum(axis=1),
+        }
+
+    def sample(self, timestamp: int):
+        """
+        Record the current per-node totals, e.g. every few thousand iterations.
+        * timestamp (int): Simulation step of the sample.
+        """
+        sample = self.totals()
+        sample['timestamp'] = np.array(timestamp)
+        self.samples.append(sample)
+
+    def bandwidth(self, sim_seconds: float) -> Dict[str, np.ndarray]:
+        """
+        Returns the average upload and download rate of every node in bytes per second.
+        * sim_seconds (float): Total real-world seconds simulated.
+        """
+        totals = self.totals()
+        return {'up': totals['sent_bytes'] / sim_seconds, 'down': totals['recv_bytes'] / sim_seconds}
+
+    def to_file(self, path: str):
+        """
+        Save all counters and samples as a `.npz` archive.
+        * path (str): Output path.
+        """
+        self.flush()
+        arrays = {
+            'classes': np.array(self.class_names),
+            'sent_msgs': self.sent_msgs,
+            'sent_bytes': self.sent_bytes,
+            'recv_msgs': self.recv_msgs,
+            'recv_bytes': self.recv_bytes,
+            'link_src': self.link_src,
+            'link_dst': self.link_dst,
+            'link_msgs': self.link_msgs,
+            'link_bytes': self.link_bytes,
+        }
+        if self.samples:
+            for key in self.samples[0]:
+                arrays[f'sample_{key}'] = np.stack([sample[key] if key == 'timestamp' else
+                                                    np.pad(sample[key], (0, len(self.sent_msgs) - len(sample[key])))
+                                                    for sample in self.samples])
+        np.savez_compressed(path, **arrays)
@@ -4,14 +4,30 @@ Various utility classes and methods.
 
 import uuid
 from enum import Enum
-import numpy as np
 import math
 import hashlib
-import json
+import weakref
+from pathlib import Path
+
+from sim import rng
 
 
 MAX_INCOMING_CONNECTIONS = 117
 MAX_OUTGOING_CONNECTIONS = 8
+PING_INTERVAL = 2 * 60
+"""Seconds of silence on an outgoing connection before it is pinged."""
+STALE_TIMEOUT = 4 * 60
+"""Seconds of silence after which an outgoing connection is dropped."""
+
+# ADDR relay limits, as in Bitcoin Core
+MAX_ADDR_TO_SEND = 1000
+"""Maximum number of addresses in an ADDR message; larger messages are ignored."""
+GETADDR_MAX_PCT = 23
+"""Percentage of the address table sampled for a GETADDR response."""
+MAX_ADDR_RATE_PER_SECOND = 0.1
+"""Addresses per second processed from a peer's unsolicited ADDR messages."""
+MAX_ADDR_PROCESSING_TOKEN_BUCKET = MAX_ADDR_TO_SEND
+"""Maximum number of addresses a peer can save up for processing."""
 
 
 class Region(Enum):
@@ -50,22 +66,63 @@ def singleton(class_):
     return get_instance
 
 
-def generate_uuid() -> str:
+def code_version() -> str:
+    """
+    Returns the hash of the simulator's source code (`zelig.py`, `sim` and `bitcoin`), used to invalidate
+    cached results when the code changes.
+    """
+    root = Path(__file__).resolve().parent.parent
+    digest = hashlib.sha256()
+    for path in sorted([root / 'zelig.py'] + list((root / 'sim').rglob('*.py')) + list((root / 'bitcoin').rglob('*.py'))):
+        digest.update(str(path.relative_to(root)).encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def generate_uuid(owner=None) -> str:
     """
     Generate UUIDs to use as `sim.base_models.Item` ids.
+    * owner (`SimpleAddress`): Id of the node creating the item. Ids are drawn from the node's own `ids` stream
+    of `sim.rng`, so they do not depend on the order nodes step in. Defaults to the shared `ids` stream.
     """
-    return str(uuid.uuid4())
+    rand = rng.streams.ids if owner is None else rng.streams.stream('ids', int(owner))
+    return str(uuid.UUID(int=rand.getrandbits(128), version=4))
 
 
 class SimpleAddress:
     """
     Generate IP Address to use for `sim.base_models.Node` id.
+
+    Addresses are interned and backed by a packed 32-bit integer (`group << 16 | ip`): building
+    the same group and ip twice returns the same object, so equality is identity and the hash is
+    the precomputed packed value. The intern table only holds weak references, so addresses no
+    longer used anywhere, e.g. by a finished simulation, are freed.
     """
+    __slots__ = ('_packed', '_group', '_ip', '_str', '__weakref__')
+
+    _interned: 'weakref.WeakValueDictionary[int, SimpleAddress]' = weakref.WeakValueDictionary()
+
+    def __new__(cls, group, ip):
+        packed = int(group) << 16 | int(ip)
+        address = cls._interned.get(packed, None)
+        if address is None:
+            address = super().__new__(cls)
+            address._packed = packed
+            address._group = str(group)
+            address._ip = str(ip)
+            address._str = '%s:%s' % (address._group, address._ip)
+            cls._interned[packed] = address
+        return address
 
-    def __init__(self, group, ip):
-        self._group = str(group)
-        self._ip = str(ip)
-        self._str = '%s:%s' % (self.group, self.ip)
+    @staticmethod
+    def from_int(packed: int) -> 'SimpleAddress':
+        """
+        Returns the interned address for a packed integer.
+        """
+        address = SimpleAddress._interned.get(packed, None)
+        if address is None:
+            address = SimpleAddress(packed >> 16, packed & 0xFFFF)
+        return address
 
     @property
     def group(self):
@@ -78,19 +135,39 @@ class SimpleAddress:
     def __str__(self):
         return self._str
 
+    def __int__(self):
+        """Packed 32-bit form of the address: `group << 16 | ip`."""
+        return self._packed
+
     def __dict__(self):
         return {'group': self.group, 'ip': self.ip, 'str': self._str}
 
     def __eq__(self, other):
-        return self.ip == other.ip and \
-               self.group == other.group
+        return self is other
 
     def __hash__(self):
-        return hash(repr(self))
+        return self._packed
+
+    def __reduce__(self):
+        # re-intern on unpickling
+        return SimpleAddress.from_int, (self._packed,)
 
     @staticmethod
-    def randomaddress(rand=np.random, groups=None):
-        group = rand.choice(groups) if groups else \
-            rand.randint(1, 65536)
-        ip = rand.randint(0, 65536)
-        return SimpleAddress(group, ip)
\ No newline at end of file
+    def randomaddress(rand=None, groups=None, fresh=False):
+        """
+        Returns a random address.
+        * rand (`random.Random`): Source of randomness. Defaults to the `addresses` stream of `sim.rng`.
+        * groups (list): Groups to choose from. Defaults to any group.
+        * fresh (bool): Redraw until the address was not handed out as fresh before in this run, e.g. for node ids.
+        """
+        rand = rand or rng.streams.stream('addresses')
+        while True:
+            group = rand.choice(groups) if groups else \
+                rand.randint(1, 65535)
+            ip = rand.randint(0, 65535)
+            if not fresh:
+                return SimpleAddress(group, ip)
+            packed = int(group) << 16 | int(ip)
+            if packed not in rng.streams.fresh_addresses:
+                rng.streams.fresh_addresses.add(packed)
+                return SimpleAddress(group, ip)
@@ -0,0 +1,86 @@
+"""
+Snapshots of bootstrapped networks.
+
+The first few hundred steps of every run are spent on handshakes, GETADDR/ADDR exchanges and peer
+discovery. That phase only depends on the topology settings, so it is run once with blocks and
+transactions disabled (see `Node.network_step`), and the resulting connections, address tables,
+timestamps and random stream states are saved. Later runs with the same topology settings, seed and
+code fork every repetition from its snapshot instead of bootstrapping again, and continue exactly like
+the run that created it.
+"""
+
+import hashlib
+import json
+import pickle
+from pathlib import Path
+from typing import List
+
+from sim import rng, util
+
+TOPOLOGY_KEYS = ('iter_seconds', 'nodes', 'nodes_in_each_region', 'connections_per_node', 'topology',
+                 'topology_rewire_prob', 'topology_file', 'add_malicious_nodes', 'malicious_nodes_ratio')
+"""Configuration keys that shape the bootstrapped network."""
+
+
+def key(config: dict, iters: int, seed: int, rep: int) -> str:
+    """
+    Returns the cache key of the snapshot of a configuration.
+    * config (dict): Simulation configuration.
+    * iters (int): Number of bootstrap steps.
+    * seed (int): Master seed of the run.
+    * rep (int): Repetition.
+    """
+    fields = {name: config.get(name, None) for name in TOPOLOGY_KEYS}
+    if fields['topology_file']:
+        fields['topology_file'] = hashlib.sha256(Path(fields['topology_file']).read_bytes()).hexdigest()
+    payload = json.dumps({'config': fields, 'iters': iters, 'seed': seed, 'rep': rep, 'code': util.code_version()},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def capture(nodes: List) -> dict:
+    """
+    Returns the snapshot of the network and of the current random streams.
+    * nodes (List[`sim.base_models.Node`]): All nodes of the simulation.
+    """
+    return {
+        'nodes': [node.network_state() for node in nodes],
+        'streams': rng.streams.getstate(),
+    }
+
+
+def restore(snapshot: dict, nodes: List) -> bool:
+    """
+    Restore a snapshot onto freshly created nodes. Returns False, leaving the nodes untouched, if the
+    nodes do not match the snapshot.
+    * snapshot (dict): Snapshot returned by `capture` or `load`.
+    * nodes (List[`sim.base_models.Node`]): All nodes of the simulation, created from the same configuration and seed.
+    """
+    states = snapshot['nodes']
+    if len(states) != len(nodes) or any(int(node.id) != state['id'] for node, state in zip(nodes, states)):
+        return False
+    for node, state in zip(nodes, states):
+        node.restore_network_state(state)
+    rng.streams.setstate(snapshot['streams'])
+    return True
+
+
+def save(path: str, snapshot: dict):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix('.tmp')
+    with open(tmp, 'wb+') as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp.replace(path)
+
+
+def load(path: str) -> dict:
+    """
+    Returns the snapshot saved at the given path, or None if there is none.
+    * path (str): Snapshot path.
+    """
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
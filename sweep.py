@@ -0,0 +1,204 @@
+"""
+Parameter sweeps over the simulator configuration with cached results.
+
+A sweep file names a base configuration, the seeds to run and a grid of parameter values:
+
+    base: config.yaml
+    seeds: [1, 2, 3]
+    grid:
+      block_int_iters: [500, 1000, 2000]
+      malicious_nodes_ratio: {start: 0, stop: 0.3, num: 4}   # evenly spaced, stop included
+      max_block_size: {start: 100000, stop: 400000, step: 100000}
+      nodes.CH.region_mine_power: [30, 50, 70]              # entry of `nodes` by region (or index)
+
+Every combination of grid values and seeds is one headless run. Its summary is stored in the cache
+directory under the hash of the normalized configuration, the seed and the simulator's source code,
+so re-running a sweep only computes points that were never run with the current code.
+
+    python sweep.py sweep.yaml -j 8 -o sweep_results.json
+"""
+
+import argparse
+import copy
+import hashlib
+import itertools
+import json
+import multiprocessing
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import yaml
+from loguru import logger
+
+from sim.util import code_version
+
+IGNORED_KEYS = ('sim_name', 'results_directory', 'log_level', 'seed', 'sim_reps', 'warm_start_dir')
+"""Configuration keys that do not change the results of a run."""
+
+
+def expand(values) -> list:
+    """
+    Returns the list of values of one grid parameter.
+    * values: A list of values, a single value, or a range `{start, stop, num}` / `{start, stop, step}`
+      with `stop` included.
+    """
+    if isinstance(values, dict):
+        if 'num' in values:
+            points = np.linspace(values['start'], values['stop'], values['num'])
+        else:
+            step = values['step']
+            points = np.arange(values['start'], values['stop'] + step / 2, step)
+        return points.tolist()
+    return values if isinstance(values, list) else [values]
+
+
+def set_param(config: dict, path: str, value):
+    """
+    Set a possibly nested configuration value given its dotted path. Entries of `nodes` are
+    selected by region name or by index, e.g. `nodes.CH.region_mine_power` or `nodes.0.count`.
+    * config (dict): Configuration to modify.
+    * path (str): Dotted path of the parameter.
+    * value: New value.
+    """
+    parts = path.split('.')
+    target = config
+    for depth, part in enumerate(parts):
+        last = depth == len(parts) - 1
+        if isinstance(target, list):
+            matches = [i for i, entry in enumerate(target) if str(entry.get('region', None)) == part]
+            if matches:
+                part = matches[0]
+            elif part.isdigit() and int(part) < len(target):
+                part = int(part)
+            else:
+                raise ValueError(f'No entry {part} in {path}')
+        elif part not in target:
+            raise ValueError(f'Unknown configuration key {path}')
+        if last:
+            target[part] = value
+        else:
+            target = target[part]
+
+
+def points(sweep: dict, base: dict):
+    """
+    Yield `(params, config, seed)` for every combination of the sweep's grid values and seeds.
+    * sweep (dict): Parsed sweep file.
+    * base (dict): Base configuration.
+    """
+    grid = {name: expand(values) for name, values in (sweep.get('grid', None) or dict()).items()}
+    seeds = expand(sweep.get('seeds', [base.get('seed', 0)]))
+    for combination in itertools.product(*grid.values()):
+        params = dict(zip(grid, combination))
+        config = copy.deepcopy(base)
+        for path, value in params.items():
+            set_param(config, path, value)
+        for seed in seeds:
+            yield params, config, seed
+
+
+def cache_key(config: dict, seed: int, code: str) -> str:
+    """
+    Returns the content hash identifying a run.
+    * config (dict): Configuration of the run.
+    * seed (int): Master seed of the run.
+    * code (str): Code version, see `sim.util.code_version`.
+    """
+    normalized = {key: value for key, value in config.items() if key not in IGNORED_KEYS}
+    payload = json.dumps({'config': normalized, 'seed': seed, 'code': code}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def run_point(task) -> dict:
+    """
+    Run one sweep point headless and return its summary; executed in a worker process.
+    """
+    config, seed = task
+    from zelig import Simulation
+
+    config = copy.deepcopy(config)
+    config.update(sim_reps=1, seed=seed, log_level='CRITICAL')
+    with tempfile.TemporaryDirectory() as results_dir:
+        config['results_directory'] = results_dir
+        return Simulation(config=config).run(headless=True)[0]
+
+
+class Cache:
+    """Directory of run summaries named after their cache key."""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+
+    def path(self, key: str) -> Path:
+        return self.directory / key[:2] / f'{key}.json'
+
+    def get(self, key: str) -> dict:
+        try:
+            with open(self.path(key), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, entry: dict):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w+') as f:
+            json.dump(entry, f)
+        tmp.replace(path)
+
+
+def run_sweep(sweep: dict, base: dict, cache: Cache, workers: int = None) -> list:
+    """
+    Run all points of a sweep that are not cached yet and return one row per point.
+    * sweep (dict): Parsed sweep file.
+    * base (dict): Base configuration.
+    * cache (`Cache`): Cache of run summaries.
+    * workers (int): Number of worker processes. Defaults to the number of CPUs.
+    """
+    code = code_version()
+    rows, todo, queued = [], [], set()
+    for params, config, seed in points(sweep, base):
+        key = cache_key(config, seed, code)
+        entry = cache.get(key)
+        rows.append({'key': key, 'params': params, 'seed': seed, 'cached': entry is not None,
+                     'summary': entry['summary'] if entry else None})
+        if entry is None and key not in queued:
+            queued.add(key)
+            todo.append((key, config, seed, params))
+    logger.warning(f'{len(rows)} runs, {len(rows) - len(todo)} cached, running {len(todo)}.')
+
+    if todo:
+        # a fresh process per run: node storage and interned addresses are process-wide
+        with multiprocessing.Pool(workers, maxtasksperchild=1) as pool:
+            results = pool.imap(run_point, [(config, seed) for _, config, seed, _ in todo])
+            for done, ((key, config, seed, params), summary) in enumerate(zip(todo, results), 1):
+                cache.put(key, {'config': config, 'seed': seed, 'code': code, 'params': params, 'summary': summary})
+                logger.warning(f'[{done}/{len(todo)}] {params} seed {seed}: {summary["wall_seconds"]:.1f}s')
+        for row in rows:
+            if row['summary'] is None:
+                row['summary'] = cache.get(row['key'])['summary']
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Parameter sweeps with cached results.')
+    parser.add_argument('sweep', help='YAML sweep file')
+    parser.add_argument('-c', metavar='filename', help='Base configuration, overriding the sweep file\'s `base`')
+    parser.add_argument('-j', metavar='workers', type=int, help='Worker processes (default: number of CPUs)')
+    parser.add_argument('-o', metavar='filename', default='sweep_results.json',
+                        help='Output JSON file with one row per run (default: sweep_results.json)')
+    parser.add_argument('--cache', metavar='directory', help='Cache directory, overriding the sweep file\'s `cache`')
+    args = parser.parse_args()
+
+    with open(args.sweep, 'r') as f:
+        sweep = yaml.safe_load(f)
+    with open(args.c or sweep.get('base', 'config.yaml'), 'r') as f:
+        base = yaml.safe_load(f)
+    cache = Cache(args.cache or sweep.get('cache', 'tmp/zelig/sweep_cache'))
+
+    rows = run_sweep(sweep, base, cache, args.j)
+    with open(args.o, 'w+') as f:
+        json.dump(rows, f, indent=2)
+    logger.warning(f'Saved {len(rows)} results to {args.o}')
@@ -0,0 +1,21 @@
+from bitcoin.models import Miner
+from sim.util import Region
+from zelig import Simulation
+
+
+def network(n=2, tx_model=None, iter_seconds=0.1):
+    """
+    Create a simulation with `n` unconnected miners and return them.
+    * n (int): Number of miners.
+    * tx_model (`bitcoin.tx_modelings.TxModel`): Transaction model of the simulation, if any.
+    * iter_seconds (float): How many real-world seconds one simulation step corresponds to.
+    """
+    sim = Simulation()
+    sim.tx_modeling = tx_model
+    sim.iter_seconds = iter_seconds
+    for i in range(n):
+        miner = Miner(f'TEST_{i}', 1, list(Region)[0], sim.iter_seconds)
+        miner.node_storage = sim.node_storage
+        sim.add_node(miner)
+        sim.node_storage.add(miner)
+    return sim.nodes
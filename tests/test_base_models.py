@@ -0,0 +1,68 @@
+import unittest
+
+from sim import util
+from tests.helpers import network
+
+
+class AddrRateLimitTest(unittest.TestCase):
+    """Unsolicited ADDR messages are processed at `MAX_ADDR_RATE_PER_SECOND` addresses per peer."""
+
+    def setUp(self):
+        self.node, peer = network(iter_seconds=0.1)
+        self.peer = peer.id
+        self.addresses = list(range(util.MAX_ADDR_TO_SEND))
+
+    def accepted(self, timestamp, count):
+        self.node.timestamp = timestamp
+        return len(self.node.rate_limit_addrs(self.peer, self.addresses[:count]))
+
+    def seconds(self, seconds):
+        return round(seconds / self.node.iter_seconds)
+
+    def test_first_address_is_free(self):
+        self.assertEqual(self.accepted(0, 10), 1)
+        self.assertEqual(self.accepted(0, 10), 0)
+
+    def test_refill(self):
+        self.accepted(0, 10)
+        per_address = self.seconds(1 / util.MAX_ADDR_RATE_PER_SECOND)
+        self.assertEqual(self.accepted(per_address - 1, 10), 0)
+        self.assertEqual(self.accepted(per_address, 10), 1)
+        self.assertEqual(self.accepted(per_address + 5 * per_address, 10), 5)
+
+    def test_prefix_is_kept(self):
+        self.accepted(0, 1)
+        self.node.timestamp = self.seconds(3 / util.MAX_ADDR_RATE_PER_SECOND)
+        self.assertEqual(self.node.rate_limit_addrs(self.peer, self.addresses[:10]), self.addresses[:3])
+
+    def test_bucket_is_capped(self):
+        self.accepted(0, 1)
+        long_silence = self.seconds(10 * util.MAX_ADDR_PROCESSING_TOKEN_BUCKET / util.MAX_ADDR_RATE_PER_SECOND)
+        self.assertEqual(self.accepted(long_silence, util.MAX_ADDR_TO_SEND), util.MAX_ADDR_PROCESSING_TOKEN_BUCKET)
+        self.assertEqual(self.accepted(long_silence, 1), 0)
+
+    def test_oversized_message_is_ignored(self):
+        self.node.timestamp = 0
+        self.assertEqual(self.node.rate_limit_addrs(self.peer, list(range(util.MAX_ADDR_TO_SEND + 1))), [])
+        self.assertEqual(self.accepted(0, 1), 1)  # and costs no tokens
+
+    def test_getaddr_allows_full_response(self):
+        self.node.expect_addrs(self.peer)
+        self.assertEqual(self.accepted(0, util.MAX_ADDR_TO_SEND), util.MAX_ADDR_TO_SEND)
+        self.assertEqual(self.accepted(0, 10), 1)
+
+    def test_getaddr_allowance_exceeds_cap(self):
+        self.accepted(0, 1)
+        full = self.seconds(util.MAX_ADDR_PROCESSING_TOKEN_BUCKET / util.MAX_ADDR_RATE_PER_SECOND)
+        self.accepted(full, 0)  # refills the bucket
+        self.node.expect_addrs(self.peer)
+        self.assertEqual(self.accepted(full, util.MAX_ADDR_TO_SEND), util.MAX_ADDR_TO_SEND)
+        self.assertEqual(self.accepted(full, util.MAX_ADDR_TO_SEND), util.MAX_ADDR_PROCESSING_TOKEN_BUCKET)
+
+    def test_peers_have_own_buckets(self):
+        self.assertEqual(self.accepted(0, 10), 1)
+        self.assertEqual(len(self.node.rate_limit_addrs('other peer', self.addresses[:10])), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+
+from sim.bitmap import _FULL, CHUNK_BITS, ChunkedBitmap
+
+
+class ChunkBoundaryTest(unittest.TestCase):
+    """Ids on both sides of a chunk boundary land in separate chunks."""
+
+    def setUp(self):
+        self.bitmap = ChunkedBitmap()
+        self.ids = [0, CHUNK_BITS - 1, CHUNK_BITS, 2 * CHUNK_BITS + 5]
+        for i in self.ids:
+            self.assertTrue(self.bitmap.add(i))
+
+    def test_contains(self):
+        for i in self.ids:
+            self.assertIn(i, self.bitmap)
+        for i in (1, CHUNK_BITS - 2, CHUNK_BITS + 1, 2 * CHUNK_BITS + 4, 3 * CHUNK_BITS):
+            self.assertNotIn(i, self.bitmap)
+        self.assertEqual(len(self.bitmap), 4)
+        self.assertEqual(sorted(self.bitmap.chunks), [0, 1, 2])
+
+    def test_add_twice(self):
+        self.assertFalse(self.bitmap.add(CHUNK_BITS))
+        self.assertEqual(len(self.bitmap), 4)
+
+    def test_discard(self):
+        self.assertTrue(self.bitmap.discard(CHUNK_BITS))
+        self.assertFalse(self.bitmap.discard(CHUNK_BITS))
+        self.assertFalse(self.bitmap.discard(CHUNK_BITS + 1))
+        self.assertIn(CHUNK_BITS - 1, self.bitmap)
+        self.assertNotIn(CHUNK_BITS, self.bitmap)
+        self.assertNotIn(1, self.bitmap.chunks)  # empty chunks are dropped
+        self.assertEqual(len(self.bitmap), 3)
+
+    def test_indices(self):
+        self.assertEqual(self.bitmap.indices().tolist(), self.ids)
+        self.assertEqual(ChunkedBitmap().indices().tolist(), [])
+
+
+class FullChunkTest(unittest.TestCase):
+    """Full chunks are shared until one of their ids is removed."""
+
+    def setUp(self):
+        self.bitmap = ChunkedBitmap()
+        for i in range(CHUNK_BITS, 2 * CHUNK_BITS):
+            self.bitmap.add(i)
+
+    def test_full_chunk_is_shared(self):
+        self.assertIs(self.bitmap.chunks[1], _FULL)
+        self.assertNotIn(1, self.bitmap.counts)
+        self.assertEqual(len(self.bitmap), CHUNK_BITS)
+        self.assertIn(2 * CHUNK_BITS - 1, self.bitmap)
+        self.assertNotIn(2 * CHUNK_BITS, self.bitmap)
+
+    def test_discard_splits_full_chunk(self):
+        self.assertTrue(self.bitmap.discard(CHUNK_BITS + 7))
+        self.assertIsNot(self.bitmap.chunks[1], _FULL)
+        self.assertEqual(_FULL, bytes([0xFF]) * (CHUNK_BITS // 8))  # shared chunk left untouched
+        self.assertNotIn(CHUNK_BITS + 7, self.bitmap)
+        self.assertIn(CHUNK_BITS + 8, self.bitmap)
+        self.assertEqual(len(self.bitmap), CHUNK_BITS - 1)
+        self.assertTrue(self.bitmap.add(CHUNK_BITS + 7))
+        self.assertIs(self.bitmap.chunks[1], _FULL)
+
+    def test_indices(self):
+        self.assertEqual(self.bitmap.indices().tolist(), list(range(CHUNK_BITS, 2 * CHUNK_BITS)))
+
+
+class FillBelowTest(unittest.TestCase):
+    """Ids below the filled chunks are all set and no longer stored."""
+
+    def setUp(self):
+        self.bitmap = ChunkedBitmap()
+        for i in (3, CHUNK_BITS + 3, 2 * CHUNK_BITS + 3):
+            self.bitmap.add(i)
+        self.bitmap.fill_below(2 * CHUNK_BITS + 100)
+
+    def test_old_chunks_are_set(self):
+        for i in (0, 3, CHUNK_BITS - 1, CHUNK_BITS, 2 * CHUNK_BITS - 1):
+            self.assertIn(i, self.bitmap)
+        self.assertFalse(self.bitmap.add(5))
+        self.assertNotIn(2 * CHUNK_BITS, self.bitmap)
+        self.assertIn(2 * CHUNK_BITS + 3, self.bitmap)
+
+    def test_old_chunks_are_freed(self):
+        self.assertEqual(sorted(self.bitmap.chunks), [2])
+        self.assertEqual(len(self.bitmap), 1)
+        self.assertEqual(self.bitmap.indices().tolist(), [2 * CHUNK_BITS + 3])
+
+    def test_fill_below_never_shrinks(self):
+        self.bitmap.fill_below(0)
+        self.assertIn(CHUNK_BITS, self.bitmap)
+
+
+if __name__ == '__main__':
+    unittest.main()
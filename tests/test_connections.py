@@ -0,0 +1,117 @@
+import unittest
+
+from sim import util
+from sim.connections import ADDRESS_TRIES, CONNECT_RETRY_SECONDS, FEELER, FEELER_INTERVAL_SECONDS, \
+    HANDSHAKE_TIMEOUT_SECONDS, MAX_CONNECT_BACKOFF_SECONDS, OUTBOUND, ConnectionManager
+
+
+class FakeNode:
+    """Node that records the connections its manager opens; `open_connection` succeeds if `reachable`."""
+
+    def __init__(self, iter_seconds, outs=0, reachable=False):
+        self.connections = ConnectionManager(iter_seconds)
+        self.timestamp = 0
+        self.outs = dict.fromkeys(range(outs))
+        self.reachable = reachable
+        self.attempts = []
+        self.feelers = []
+
+    def open_connection(self):
+        self.attempts.append(self.timestamp)
+        return self.reachable
+
+    def open_feeler(self):
+        self.feelers.append(self.timestamp)
+        self.connections.add_pending(('feeler', self.timestamp), self.timestamp, FEELER)
+
+    def run_until(self, timestamp):
+        while self.timestamp < timestamp:
+            self.connections.step(self)
+            self.timestamp += 1
+
+
+class BackoffTest(unittest.TestCase):
+    """Failed attempts are retried after exponentially growing, capped delays."""
+
+    def test_steps(self):
+        manager = ConnectionManager(0.1)
+        self.assertEqual(manager.steps(CONNECT_RETRY_SECONDS), 5)
+        self.assertEqual(manager.steps(0.01), 1)
+        self.assertEqual(ConnectionManager(2).steps(3), 2)
+
+    def test_fail_schedule(self):
+        manager = ConnectionManager(0.1)
+        delays = []
+        for _ in range(10):
+            now = manager.next_attempt
+            manager.fail(now)
+            delays.append(manager.next_attempt - now)
+        self.assertEqual(delays, [5, 10, 20, 40, 80, 160, 320, 600, 600, 600])
+        self.assertEqual(manager.steps(MAX_CONNECT_BACKOFF_SECONDS), 600)
+
+    def test_fail_never_moves_attempt_earlier(self):
+        manager = ConnectionManager(1)
+        manager.next_attempt = 100
+        manager.fail(0)
+        self.assertEqual(manager.next_attempt, 100)
+
+    def test_unreachable_node_backs_off(self):
+        node = FakeNode(0.1)
+        node.run_until(200)
+        attempts = sorted(set(node.attempts))
+        self.assertEqual(attempts, [0, 5, 15, 35, 75, 155])
+        self.assertEqual(len(node.attempts), ADDRESS_TRIES * len(attempts))
+        self.assertEqual(node.connections.failures, 6)
+
+    def test_reachable_node_tries_every_step(self):
+        node = FakeNode(0.1, reachable=True)
+        node.run_until(10)
+        self.assertEqual(node.attempts, list(range(10)))
+        self.assertEqual(node.connections.failures, 0)
+
+    def test_complete_resets_failures(self):
+        manager = ConnectionManager(0.1)
+        manager.fail(0)
+        manager.fail(0)
+        manager.add_pending('peer', 0, OUTBOUND)
+        self.assertEqual(manager.complete('peer'), OUTBOUND)
+        self.assertEqual(manager.failures, 0)
+        self.assertIsNone(manager.complete('peer'))
+
+    def test_expired_handshakes(self):
+        manager = ConnectionManager(1)
+        manager.add_pending('outbound', 0, OUTBOUND)
+        manager.add_pending('feeler', 0, FEELER)
+        manager.expire(HANDSHAKE_TIMEOUT_SECONDS - 1)
+        self.assertEqual(len(manager.pending), 2)
+        manager.expire(HANDSHAKE_TIMEOUT_SECONDS)
+        self.assertEqual(manager.pending, dict())
+        self.assertEqual(manager.failures, 1)  # expired feelers are not failures
+
+
+class FeelerTest(unittest.TestCase):
+    """Feelers are only opened with all outbound slots in use, one every `FEELER_INTERVAL_SECONDS`."""
+
+    def test_feeler_schedule(self):
+        node = FakeNode(1, outs=util.MAX_OUTGOING_CONNECTIONS)
+        node.run_until(3 * FEELER_INTERVAL_SECONDS + 1)
+        self.assertEqual(node.feelers, [FEELER_INTERVAL_SECONDS, 2 * FEELER_INTERVAL_SECONDS,
+                                        3 * FEELER_INTERVAL_SECONDS])
+        self.assertEqual(node.attempts, [])
+
+    def test_no_feeler_with_free_slots(self):
+        node = FakeNode(1, outs=util.MAX_OUTGOING_CONNECTIONS - 1, reachable=True)
+        node.run_until(2 * FEELER_INTERVAL_SECONDS)
+        self.assertEqual(node.feelers, [])
+
+    def test_one_feeler_at_a_time(self):
+        node = FakeNode(1, outs=util.MAX_OUTGOING_CONNECTIONS)
+        node.connections.add_pending('slow feeler', 0, FEELER)
+        node.connections.next_feeler = 0
+        node.run_until(1)
+        self.assertEqual(node.feelers, [])
+        self.assertEqual(node.connections.next_feeler, FEELER_INTERVAL_SECONDS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+from bitcoin.messages import PingMessage
+from sim import topology, util
+from tests.helpers import network
+
+
+class KeepaliveTest(unittest.TestCase):
+    """Silent outgoing connections are pinged and then dropped after `STALE_TIMEOUT` seconds."""
+
+    def connect(self, iter_seconds):
+        self.a, self.b = network(iter_seconds=iter_seconds)
+        topology.connect_edges([self.a, self.b], np.array([[0, 1]]), handshake=False)
+
+    def run_until(self, timestamp):
+        """Fire a's keepalive timers up to the given timestamp; b never answers."""
+        while self.a.timestamp < timestamp:
+            self.a.timestamp += 1
+            for addr in self.a.pop_keepalive_timers():
+                self.a.keepalive(addr)
+
+    def pings(self):
+        return sum(type(packet.payload) == PingMessage for packets in self.b.inbox.values() for packet in packets)
+
+    def test_steps_follow_iter_seconds(self):
+        self.connect(0.1)
+        self.assertEqual(self.a.ping_steps, util.PING_INTERVAL * 10)
+        self.assertEqual(self.a.stale_steps, util.STALE_TIMEOUT * 10)
+        self.connect(2)
+        self.assertEqual(self.a.ping_steps, util.PING_INTERVAL // 2)
+        self.assertEqual(self.a.stale_steps, util.STALE_TIMEOUT // 2)
+
+    def test_dropped_after_stale_timeout(self):
+        for iter_seconds in (0.1, 1, 3):
+            with self.subTest(iter_seconds=iter_seconds):
+                self.connect(iter_seconds)
+                self.run_until(self.a.ping_steps)
+                self.assertEqual(self.pings(), 0)
+                self.run_until(self.a.stale_steps)
+                self.assertIn(self.b.id, self.a.outs)
+                self.assertEqual(self.pings(), 1)
+                self.run_until(self.a.stale_steps + 1)
+                self.assertNotIn(self.b.id, self.a.outs)
+                self.assertNotIn(self.b.id, self.a.keepalive_due)
+
+    def test_activity_postpones_drop(self):
+        self.connect(1)
+        self.run_until(self.a.stale_steps - 1)
+        self.a.tried_table.good(self.b.id, self.a.timestamp)  # b answered the ping
+        self.run_until(2 * self.a.stale_steps - 1)
+        self.assertIn(self.b.id, self.a.outs)
+        self.run_until(2 * self.a.stale_steps)
+        self.assertNotIn(self.b.id, self.a.outs)
+
+
+if __name__ == '__main__':
+    unittest.main()
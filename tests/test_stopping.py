@@ -0,0 +1,94 @@
+import unittest
+from types import SimpleNamespace
+
+from bitcoin.mining_strategies import HonestMining, SelfishMining
+from bitcoin.stopping import StoppingRule, median_interval, wilson_interval
+
+
+class WilsonIntervalTest(unittest.TestCase):
+    """Wilson score intervals of known proportions."""
+
+    def test_known_values(self):
+        for (successes, trials), expected in {(8, 10): (0.4902, 0.9433), (0, 10): (0.0, 0.2775),
+                                              (10, 10): (0.7225, 1.0), (50, 100): (0.4038, 0.5962)}.items():
+            with self.subTest(successes=successes, trials=trials):
+                low, high = wilson_interval(successes, trials, 1.96)
+                self.assertAlmostEqual(low, expected[0], places=4)
+                self.assertAlmostEqual(high, expected[1], places=4)
+
+    def test_no_trials(self):
+        self.assertEqual(wilson_interval(0, 0, 1.96), (0.0, 1.0))
+
+    def test_narrows_with_trials(self):
+        widths = [high - low for low, high in (wilson_interval(n // 10, n, 1.96) for n in (10, 100, 1000))]
+        self.assertEqual(widths, sorted(widths, reverse=True))
+
+
+class MedianIntervalTest(unittest.TestCase):
+    """Distribution-free median intervals pick the order statistics around the middle of the sample."""
+
+    def test_known_ranks(self):
+        values = list(range(1, 101))
+        self.assertEqual(median_interval(values, 1.96), (40, 60))  # ranks 50 -+ 9.8, rounded outwards
+        self.assertEqual(median_interval(values, 1), (45, 55))
+
+    def test_small_sample(self):
+        self.assertIsNone(median_interval([1, 2, 3, 4, 5], 1.96))
+        self.assertIsNone(median_interval([], 1.96))
+        self.assertEqual(median_interval(list(range(1, 11)), 1.96), (1, 9))
+
+
+class StoppingRuleTest(unittest.TestCase):
+    """Estimates from a known block tree."""
+
+    def setUp(self):
+        # main chain of 40 blocks, stale blocks at heights 5, 10, 15 and 20 mined by the selfish miner
+        self.blocks = dict()
+        self.add('main0', None, 0, 'honest')
+        for height in range(1, 40):
+            self.add(f'main{height}', f'main{height - 1}', height, 'selfish' if height % 4 == 0 else 'honest')
+        for height in (5, 10, 15, 20):
+            self.add(f'stale{height}', f'main{height - 1}', height, 'selfish')
+        self.nodes = [SimpleNamespace(name='selfish', mine_strategy=SelfishMining())] + \
+                     [SimpleNamespace(name='honest', mine_strategy=HonestMining()) for _ in range(3)]
+        # half of the nodes receive a block `height % 10` iterations after it was mined
+        rcv_times = {block.id: [block.created_at, block.created_at + block.height % 10, 10 ** 6]
+                     for block in self.blocks.values()}
+        self.bookkeeper = SimpleNamespace(blocks=self.blocks, block_rcv_times=rcv_times)
+
+    def add(self, block_id, prev_id, height, miner):
+        self.blocks[block_id] = SimpleNamespace(id=block_id, prev_id=prev_id, height=height, miner=miner, created_at=10 * height)
+
+    def test_estimates(self):
+        rule = StoppingRule(confirmations=6)
+        estimates = rule.estimate(self.bookkeeper, self.nodes)
+        # heights up to 33 are settled: 34 main chain and 4 stale blocks
+        stale = estimates['stale_rate']
+        self.assertEqual(stale['samples'], 38)
+        self.assertAlmostEqual(stale['value'], 4 / 38)
+        self.assertEqual((stale['low'], stale['high']), wilson_interval(4, 38, rule.z))
+
+        delays = sorted(block.height % 10 for block in self.blocks.values() if block.height <= 33)
+        propagation = estimates['median_propagation']
+        self.assertEqual(propagation['value'], delays[(len(delays) - 1) // 2])
+        self.assertEqual((propagation['low'], propagation['high']), median_interval(delays, rule.z))
+
+        share = estimates['selfish_revenue_share']
+        self.assertEqual(share['samples'], 34)
+        self.assertAlmostEqual(share['value'], 8 / 34)  # heights 4, 8, ..., 32
+        self.assertAlmostEqual(share['width'], share['high'] - share['low'])
+
+    def test_check(self):
+        rule = StoppingRule({'stale_rate': 0.5}, check_every_blocks=10, min_blocks=30)
+        self.assertEqual(rule.check(self.bookkeeper, self.nodes), 'converged')
+        rule = StoppingRule({'stale_rate': 0.01})
+        self.assertIsNone(rule.check(self.bookkeeper, self.nodes))
+        self.assertEqual(rule.next_check, len(self.blocks) + 10)
+
+    def test_unknown_metric(self):
+        with self.assertRaises(ValueError):
+            StoppingRule({'orphan_rate': 0.1})
+
+
+if __name__ == '__main__':
+    unittest.main()
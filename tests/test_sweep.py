@@ -0,0 +1,93 @@
+import unittest
+
+import numpy as np
+
+from sweep import cache_key, expand, points, set_param
+
+
+class ExpandTest(unittest.TestCase):
+    """Grid values are given as lists, single values or ranges with `stop` included."""
+
+    def test_list_and_single_value(self):
+        self.assertEqual(expand([1, 2, 3]), [1, 2, 3])
+        self.assertEqual(expand(5), [5])
+        self.assertEqual(expand('CH'), ['CH'])
+
+    def test_num(self):
+        values = expand({'start': 0, 'stop': 0.3, 'num': 4})
+        self.assertIsInstance(values, list)
+        np.testing.assert_allclose(values, [0, 0.1, 0.2, 0.3])
+
+    def test_step(self):
+        self.assertEqual(expand({'start': 100, 'stop': 400, 'step': 100}), [100, 200, 300, 400])
+        values = expand({'start': 0, 'stop': 0.3, 'step': 0.1})
+        self.assertEqual(len(values), 4)  # no rounding error drops the stop value
+        self.assertAlmostEqual(values[-1], 0.3)
+
+
+class SetParamTest(unittest.TestCase):
+    """Dotted paths select nested keys and entries of `nodes` by region or index."""
+
+    def setUp(self):
+        self.config = {
+            'block_int_iters': 1000,
+            'stopping': {'max_widths': {'stale_rate': 0.02}},
+            'nodes': [{'region': 'CH', 'count': 3, 'region_mine_power': 50},
+                      {'region': 'US', 'count': 5, 'region_mine_power': 50}],
+        }
+
+    def test_top_level(self):
+        set_param(self.config, 'block_int_iters', 500)
+        self.assertEqual(self.config['block_int_iters'], 500)
+
+    def test_nested(self):
+        set_param(self.config, 'stopping.max_widths.stale_rate', 0.01)
+        self.assertEqual(self.config['stopping'], {'max_widths': {'stale_rate': 0.01}})
+
+    def test_nodes_by_region_and_index(self):
+        set_param(self.config, 'nodes.US.region_mine_power', 70)
+        set_param(self.config, 'nodes.0.count', 4)
+        self.assertEqual(self.config['nodes'][1]['region_mine_power'], 70)
+        self.assertEqual(self.config['nodes'][0]['count'], 4)
+        self.assertEqual(self.config['nodes'][0]['region_mine_power'], 50)
+
+    def test_unknown_paths(self):
+        for path in ('block_interval', 'stopping.max_width.stale_rate', 'nodes.RU.count', 'nodes.2.count'):
+            with self.subTest(path), self.assertRaises(ValueError):
+                set_param(self.config, path, 1)
+
+    def test_points(self):
+        grid = {'block_int_iters': [500, 1000], 'nodes.CH.count': {'start': 1, 'stop': 3, 'step': 2}}
+        runs = list(points({'seeds': [1, 2], 'grid': grid}, self.config))
+        self.assertEqual(len(runs), 8)
+        self.assertEqual([(params, seed) for params, _, seed in runs[:2]],
+                         [({'block_int_iters': 500, 'nodes.CH.count': 1}, 1),
+                          ({'block_int_iters': 500, 'nodes.CH.count': 1}, 2)])
+        params, config, _ = runs[-1]
+        self.assertEqual((config['block_int_iters'], config['nodes'][0]['count']), (1000, 3))
+        self.assertEqual(self.config['nodes'][0]['count'], 3)  # the base is not modified
+
+
+class CacheKeyTest(unittest.TestCase):
+    """Cache keys only depend on the settings that change the results."""
+
+    config = {'block_int_iters': 1000, 'nodes': [{'region': 'CH', 'count': 3}], 'stopping': {'a': 1, 'b': 2}}
+
+    def test_key_order(self):
+        reordered = {'stopping': {'b': 2, 'a': 1}, 'nodes': [{'count': 3, 'region': 'CH'}], 'block_int_iters': 1000}
+        self.assertEqual(cache_key(self.config, 1, 'code'), cache_key(reordered, 1, 'code'))
+
+    def test_ignored_keys(self):
+        renamed = dict(self.config, sim_name='other', results_directory='/tmp/other', log_level='DEBUG', sim_reps=5)
+        self.assertEqual(cache_key(self.config, 1, 'code'), cache_key(renamed, 1, 'code'))
+
+    def test_changes(self):
+        key = cache_key(self.config, 1, 'code')
+        self.assertNotEqual(key, cache_key(self.config, 2, 'code'))
+        self.assertNotEqual(key, cache_key(self.config, 1, 'other code'))
+        self.assertNotEqual(key, cache_key(dict(self.config, block_int_iters=500), 1, 'code'))
+        self.assertNotEqual(key, cache_key(dict(self.config, nodes=[{'region': 'CH', 'count': 4}]), 1, 'code'))
+
+
+if __name__ == '__main__':
+    unittest.main()
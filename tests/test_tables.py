@@ -0,0 +1,224 @@
+import random
+import unittest
+
+from bitcoin.tables import ATTEMPTS, LAST_SUCCESS, NEVER, TIMESTAMP, BaseTable, Bucket, NewTable, TriedTable
+from sim.util import SimpleAddress
+
+
+class TriedTableCollisionTest(unittest.TestCase):
+    """Test-before-evict of full tried table buckets."""
+
+    def setUp(self):
+        # a single bucket, so that every address collides once it is full
+        self.table = TriedTable(buckets=1, slots=4)
+        self.addrs = [SimpleAddress(10, i) for i in range(4)]
+        for t, addr in enumerate(self.addrs):
+            self.assertTrue(self.table.add(addr, t))
+        self.new = SimpleAddress(20, 1)
+        self.assertFalse(self.table.add(self.new, 100))
+        self.assertIn(int(self.new), self.table.collisions)
+
+    def test_candidate_is_oldest_entry(self):
+        self.assertEqual(self.table.untested_collisions(), [self.addrs[0]])
+        self.assertEqual(self.table.untested_collisions(), [])
+
+    def test_answering_candidate_is_kept(self):
+        candidate, = self.table.untested_collisions()
+        self.table.update(candidate, 101)  # the candidate answered the ping
+        self.table.resolve_collisions(100 + TriedTable.TEST_WINDOW + 1)
+        for addr in self.addrs:
+            self.assertIn(addr, self.table)
+        self.assertNotIn(self.new, self.table)
+        self.assertEqual(self.table.collisions, dict())
+
+    def test_silent_candidate_is_evicted(self):
+        candidate, = self.table.untested_collisions()
+        self.table.resolve_collisions(100 + TriedTable.TEST_WINDOW - 1)
+        self.assertIn(int(self.new), self.table.collisions)
+        self.table.resolve_collisions(100 + TriedTable.TEST_WINDOW)
+        self.assertNotIn(candidate, self.table)
+        for addr in self.addrs[1:]:
+            self.assertIn(addr, self.table)
+        self.assertIn(self.new, self.table)
+        self.assertEqual(self.table.collisions, dict())
+
+    def test_replaced_candidate_settles_collision(self):
+        candidate, = self.table.untested_collisions()
+        self.table.delete(candidate)
+        self.table.add(SimpleAddress(30, 1), 200)  # refills the bucket
+        self.table.resolve_collisions(100 + TriedTable.TEST_WINDOW)
+        for addr in self.addrs[1:]:
+            self.assertIn(addr, self.table)
+        self.assertNotIn(self.new, self.table)
+        self.assertEqual(self.table.collisions, dict())
+
+
+
+class IsTerribleTest(unittest.TestCase):
+    """Bitcoin Core's `IsTerrible` thresholds, converted to steps."""
+
+    def setUp(self):
+        self.table = NewTable(buckets=1, slots=4, iter_seconds=60)
+        self.src, self.addr = SimpleAddress(1, 1), SimpleAddress(2, 2)
+        self.table.add(self.src, self.addr, 0)
+
+    def terrible(self, now):
+        bucket, slot = self.table._locate(self.addr)
+        return self.table.is_terrible(bucket, slot, now)
+
+    def steps(self, seconds):
+        return seconds // 60
+
+    def test_recent_entry(self):
+        self.assertFalse(self.terrible(0))
+
+    def test_horizon(self):
+        horizon = self.steps(BaseTable.HORIZON)
+        self.assertFalse(self.terrible(horizon))
+        self.assertTrue(self.terrible(horizon + 1))
+
+    def test_future_timestamp(self):
+        future = self.steps(BaseTable.FUTURE)
+        self.table.update(self.addr, 100 + future)
+        self.assertFalse(self.terrible(100))
+        self.table.update(self.addr, 100 + future + 1)
+        self.assertTrue(self.terrible(100))
+
+    def test_retries_without_success(self):
+        for _ in range(BaseTable.RETRIES - 1):
+            self.table.attempt(self.addr, 0)
+        self.assertFalse(self.terrible(10))
+        self.table.attempt(self.addr, 0)
+        self.assertTrue(self.terrible(10))
+
+    def test_recent_try_is_never_terrible(self):
+        for _ in range(BaseTable.RETRIES):
+            self.table.attempt(self.addr, 10)
+        self.assertFalse(self.terrible(10))
+        self.assertTrue(self.terrible(10 + self.steps(BaseTable.RECENT_TRY)))
+
+    def test_failures_since_last_success(self):
+        min_fail = self.steps(BaseTable.MIN_FAIL)
+        self.table.good(self.addr, 0)
+        for _ in range(BaseTable.MAX_FAILURES):
+            self.table.attempt(self.addr, 0)
+        self.table.update(self.addr, min_fail)  # recently seen, so only the failures count
+        self.assertFalse(self.terrible(min_fail))
+        self.assertTrue(self.terrible(min_fail + 1))
+        self.table.good(self.addr, min_fail)
+        self.assertFalse(self.terrible(min_fail + 1))
+
+
+class BucketTest(unittest.TestCase):
+    """Packed rows and least-recently-seen order of a bucket."""
+
+    def setUp(self):
+        self.bucket = Bucket(slots=8)
+        # slot s holds address id 100 + s; slots are filled out of order, one per step
+        for t, slot in enumerate((3, 0, 5, 7, 1)):
+            self.bucket.put(slot, 100 + slot, t)
+
+    def lru_order(self):
+        order = []
+        while self.bucket.oldest is not None:
+            slot = self.bucket.oldest
+            order.append(slot)
+            del self.bucket[slot]
+        return order
+
+    def test_put_and_get(self):
+        self.assertEqual(len(self.bucket), 5)
+        self.assertEqual(self.bucket[5], 105)
+        self.assertIsNone(self.bucket[2])
+        self.assertEqual(self.bucket.get(7, TIMESTAMP), 3)
+        self.assertEqual(self.bucket.free_slot(), 2)
+        self.assertEqual(sorted(self.bucket.addr_ids()), [100, 101, 103, 105, 107])
+
+    def test_touch_moves_entry_to_tail(self):
+        self.assertEqual(self.bucket.oldest, 3)
+        self.bucket.touch(3, 10)
+        self.bucket.touch(5, 11)
+        self.assertEqual(self.lru_order(), [0, 7, 1, 3, 5])
+
+    def test_delete_swaps_last_row_into_hole(self):
+        self.bucket.set(1, ATTEMPTS, 4)  # slot 1 holds the last row
+        del self.bucket[3]  # first row
+        self.assertEqual(len(self.bucket), 4)
+        self.assertIsNone(self.bucket[3])
+        self.assertEqual(self.bucket[1], 101)
+        self.assertEqual(self.bucket.get(1, ATTEMPTS), 4)
+        self.assertEqual(self.bucket.get(1, TIMESTAMP), 4)
+        self.assertEqual(self.bucket.free_slot(), 2)
+        self.bucket.touch(1, 20)
+        self.assertEqual(self.lru_order(), [0, 5, 7, 1])
+        self.assertEqual(len(self.bucket), 0)
+        self.assertEqual(self.bucket.free_slot(), 0)
+
+    def test_delete_head_tail_and_missing(self):
+        del self.bucket[3]  # head of the LRU list
+        del self.bucket[1]  # tail of the LRU list
+        del self.bucket[2]  # empty slot
+        self.assertEqual(len(self.bucket), 3)
+        self.assertEqual(self.lru_order(), [0, 5, 7])
+
+    def test_put_on_occupied_slot_resets_entry(self):
+        self.bucket.set(0, ATTEMPTS, 2)
+        self.bucket.set(0, LAST_SUCCESS, 3)
+        self.bucket.put(0, 200, 30)
+        self.assertEqual(len(self.bucket), 5)
+        self.assertEqual(self.bucket[0], 200)
+        self.assertEqual(self.bucket.get(0, ATTEMPTS), 0)
+        self.assertEqual(self.bucket.get(0, LAST_SUCCESS), NEVER)
+        self.assertEqual(self.lru_order(), [3, 5, 7, 1, 0])
+
+    def test_full_bucket(self):
+        for t, slot in enumerate((2, 4, 6), 5):
+            self.bucket.put(slot, 100 + slot, t)
+        self.assertIsNone(self.bucket.free_slot())
+        self.assertEqual(self.lru_order(), [3, 0, 5, 7, 1, 2, 4, 6])
+
+    def test_slot_limit(self):
+        with self.assertRaises(ValueError):
+            Bucket(slots=256)
+
+
+class RandomEntryTest(unittest.TestCase):
+    """Uniform-bucket sampling through the filled-bucket index."""
+
+    def setUp(self):
+        self.table = TriedTable(buckets=8, slots=4)
+        self.addrs = [SimpleAddress(g, ip) for g in range(1, 6) for ip in range(1, 4)]
+        for addr in self.addrs:
+            self.table.add(addr, 1)
+        self.stored = [addr for addr in self.addrs if addr in self.table]
+
+    def test_empty_table(self):
+        self.assertIsNone(TriedTable(buckets=8, slots=4).random_entry(random.Random(1)))
+
+    def test_draws_only_stored_entries(self):
+        rand = random.Random(1)
+        drawn = {self.table.random_entry(rand).ip for _ in range(2000)}
+        self.assertEqual(drawn, set(self.stored))
+
+    def test_skips_deleted_entries(self):
+        rand = random.Random(1)
+        deleted = self.stored[::2]
+        for addr in deleted:
+            self.table.delete(addr)
+        drawn = {self.table.random_entry(rand).ip for _ in range(2000)}
+        self.assertEqual(drawn, set(self.stored[1::2]))
+        for addr in self.stored[1::2]:
+            self.table.delete(addr)
+        self.assertIsNone(self.table.random_entry(rand))
+
+    def test_entry_fields(self):
+        self.table.attempt(self.stored[0], 2)
+        self.table.update(self.stored[0], 3)
+        entry = self.table.random_entry(random.Random(1))
+        self.assertEqual(entry, self.table.get(entry.ip))
+        self.assertEqual(self.table.get(self.stored[0]).timestamp, 3)
+        self.assertEqual(self.table.get(self.stored[0]).attempts, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import unittest
+
+import numpy as np
+
+from sim import topology, util
+from sim.connections import MANUAL
+from tests.helpers import network
+
+
+def rng(seed=1):
+    return np.random.default_rng(seed)
+
+
+def out_degrees(edges, n):
+    return np.bincount(edges[:, 0], minlength=n)
+
+
+class EdgeListTest(unittest.TestCase):
+    """Every generator returns a simple graph that only depends on the seed."""
+
+    N = 500
+
+    def generators(self):
+        regions = np.arange(self.N) % 4
+        return {
+            'random_k_out': lambda r: topology.random_k_out(self.N, 8, r),
+            'random_regular': lambda r: topology.random_regular(self.N, 8, r),
+            'small_world': lambda r: topology.small_world(self.N, 8, r, rewire_prob=0.2),
+            'scale_free': lambda r: topology.scale_free(self.N, 4, r),
+            'region_weighted': lambda r: topology.region_weighted(regions, 8, np.array([1, 2, 3, 4]), r),
+        }
+
+    def test_simple_graph(self):
+        for name, generate in self.generators().items():
+            with self.subTest(name):
+                edges = generate(rng())
+                self.assertEqual(edges.shape[1], 2)
+                self.assertTrue(((edges >= 0) & (edges < self.N)).all())
+                self.assertFalse((edges[:, 0] == edges[:, 1]).any())
+                self.assertEqual(len(np.unique(edges, axis=0)), len(edges))
+
+    def test_same_seed_same_edges(self):
+        for name, generate in self.generators().items():
+            with self.subTest(name):
+                np.testing.assert_array_equal(generate(rng(3)), generate(rng(3)))
+                self.assertFalse(np.array_equal(generate(rng(3)), generate(rng(4))))
+
+    def test_generate(self):
+        for name, generate in self.generators().items():
+            if name == 'region_weighted':
+                continue
+            with self.subTest(name):
+                k = 4 if name == 'scale_free' else 8
+                np.testing.assert_array_equal(topology.generate(name, self.N, k, rng(), rewire_prob=0.2),
+                                              generate(rng()))
+        with self.assertRaises(ValueError):
+            topology.generate('complete', self.N, 8, rng())
+
+
+class GeneratorTest(unittest.TestCase):
+    """The generators give the requested degrees and structure."""
+
+    def test_random_k_out(self):
+        edges = topology.random_k_out(1000, 8, rng())
+        degrees = out_degrees(edges, 1000)
+        self.assertLessEqual(degrees.max(), 8)
+        self.assertGreater(degrees.mean(), 7.9)  # only repeated picks are dropped
+        self.assertEqual(len(topology.random_k_out(1, 8, rng())), 0)
+
+    def test_random_regular(self):
+        edges = topology.random_regular(1000, 8, rng())
+        degrees = np.bincount(edges.ravel(), minlength=1000)
+        self.assertLessEqual(degrees.max(), 8)
+        self.assertGreater(degrees.mean(), 7.9)
+        undirected = np.sort(edges, axis=1)
+        self.assertEqual(len(np.unique(undirected, axis=0)), len(edges))  # one direction per edge
+        self.assertTrue(0.4 < (edges[:, 0] < edges[:, 1]).mean() < 0.6)
+
+    def test_small_world_ring(self):
+        edges = topology.small_world(100, 4, rng(), rewire_prob=0)
+        ring = np.array([(v, (v + j) % 100) for v in range(100) for j in range(1, 5)])
+        np.testing.assert_array_equal(edges, ring[np.lexsort((ring[:, 1], ring[:, 0]))])
+
+    def test_small_world_rewiring(self):
+        edges = topology.small_world(1000, 8, rng(), rewire_prob=0.2)
+        self.assertLessEqual(out_degrees(edges, 1000).max(), 8)
+        on_ring = (edges[:, 1] - edges[:, 0]) % 1000 <= 8
+        self.assertTrue(0.75 < on_ring.mean() < 0.85)
+        self.assertEqual(len(topology.small_world(5, 8, rng(), rewire_prob=0)), 5 * 4)  # k capped at n - 1
+
+    def test_scale_free(self):
+        m = 3
+        edges = topology.scale_free(2000, m, rng())
+        self.assertTrue((edges[:, 1] < edges[:, 0]).all())  # joining nodes connect to earlier nodes
+        degrees = out_degrees(edges, 2000)
+        self.assertTrue((degrees[:m] == 0).all())
+        self.assertEqual(degrees[m], m)
+        self.assertLessEqual(degrees.max(), m)
+        in_degrees = np.bincount(edges[:, 1], minlength=2000)
+        self.assertGreater(in_degrees.max(), 20 * m)  # preferential attachment grows hubs
+        self.assertEqual(len(topology.scale_free(1, m, rng())), 0)
+
+    def test_region_weighted(self):
+        regions = np.arange(1000) % 4
+        edges = topology.region_weighted(regions, 8, np.array([0, 1, 1, 2]), rng())
+        self.assertLessEqual(out_degrees(edges, 1000).max(), 8)
+        shares = np.bincount(regions[edges[:, 1]], minlength=4) / len(edges)
+        self.assertEqual(shares[0], 0)
+        np.testing.assert_allclose(shares[1:], [0.25, 0.25, 0.5], atol=0.03)
+
+
+class ConnectEdgesTest(unittest.TestCase):
+    """Edge lists are applied to nodes with or without handshakes."""
+
+    def setUp(self):
+        self.nodes = network(12)
+
+    def test_without_handshake(self):
+        edges = np.array([[0, 1], [0, 2], [3, 0]])
+        topology.connect_edges(self.nodes, edges, handshake=False)
+        a, b, c, d = self.nodes[:4]
+        self.assertEqual(set(a.outs), {b.id, c.id})
+        self.assertEqual(set(a.ins), {d.id})
+        self.assertEqual(set(b.ins), {a.id})
+        self.assertEqual(len(b.outs), 0)
+        self.assertIn(b.id, a.tried_table)
+        self.assertIn(a.id, b.tried_table)
+        self.assertEqual(a.keepalive_due[b.id], a.ping_steps + 1)
+        self.assertEqual(a.connected_at[b.id], 0)
+
+    def test_outgoing_limit(self):
+        edges = np.array([[0, i] for i in range(1, 12)])
+        topology.connect_edges(self.nodes, edges, handshake=False)
+        self.assertEqual(len(self.nodes[0].outs), util.MAX_OUTGOING_CONNECTIONS)
+        self.assertEqual(sum(len(node.ins) for node in self.nodes), util.MAX_OUTGOING_CONNECTIONS)
+
+    def test_with_handshake(self):
+        topology.connect_edges(self.nodes, np.array([[0, 1]]))
+        a, b = self.nodes[:2]
+        self.assertEqual(len(a.outs), 0)  # until the VERACK arrives
+        self.assertEqual(a.connections.pending[b.id][1], MANUAL)
+        self.assertEqual(sum(len(packets) for packets in b.inbox.values()), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import copy
+import unittest
+
+from bitcoin.models import BTCBlock, Transaction
+from bitcoin.tx_modelings import FullTxModel, SimpleTxModel
+from sim import rng
+from tests.helpers import network
+
+
+class FullTxModelReleaseTest(unittest.TestCase):
+    """Transactions are only kept while some mempool holds them."""
+
+    def setUp(self):
+        self.model = FullTxModel()
+        self.a, self.b = network(tx_model=self.model)
+        self.txs = []
+        for i in range(5):
+            tx = Transaction(self.a.id, 0, 0, 0, (i + 1) * 1E-5)
+            self.model.add(tx)
+            self.txs.append(tx)
+
+    def receive_all(self, *nodes):
+        for tx in self.txs:
+            for node in nodes:
+                self.model.receive(node, tx)
+
+    def test_receive_holds(self):
+        self.receive_all(self.a, self.b)
+        self.assertEqual(self.model.holders.tolist(), [2] * 5)
+        self.assertEqual(sorted(self.model.txs), [0, 1, 2, 3, 4])
+        self.model.receive(self.a, self.txs[0])  # already in the mempool
+        self.assertEqual(self.model.holders[0], 2)
+
+    def test_fill_block_releases(self):
+        self.receive_all(self.a, self.b)
+        block = BTCBlock(self.a, None, 1)
+        self.a.max_block_size = block.size + 2 * Transaction.SIZE
+        self.model.fill_block(self.a, block)
+        self.assertEqual(block.tx_ids.tolist(), [4, 3])  # highest feerates first
+        self.assertEqual(self.model.holders.tolist(), [2, 2, 2, 1, 1])
+        self.assertEqual(sorted(self.model.txs), [0, 1, 2, 3, 4])  # still in b's mempool
+        self.assertEqual(self.a.mempool_bytes, 3 * Transaction.SIZE)
+
+        self.model.update_mempool(self.b, block)
+        self.assertEqual(self.model.holders.tolist(), [2, 2, 2, 0, 0])
+        self.assertEqual(sorted(self.model.txs), [0, 1, 2])
+        self.assertIsNone(self.model.get_tx(self.b, 4))
+
+    def test_fill_block_single_holder(self):
+        self.receive_all(self.a)
+        block = BTCBlock(self.a, None, 1)
+        self.a.max_block_size = block.size + 5 * Transaction.SIZE
+        self.model.fill_block(self.a, block)
+        self.assertEqual(block.tx_ids.tolist(), [4, 3, 2, 1, 0])
+        self.assertEqual(self.model.txs, dict())
+        self.assertEqual(len(self.a.tx_pool), 0)
+        self.assertEqual(self.a.mempool_bytes, 0)
+
+    def test_trim_releases(self):
+        self.a.max_mempool_bytes = 3 * Transaction.SIZE
+        self.b.max_mempool_bytes = 5 * Transaction.SIZE
+        self.receive_all(self.a, self.b)
+        self.assertEqual(self.a.tx_pool.indices().tolist(), [2, 3, 4])
+        self.assertEqual(self.a.evictions, 2)
+        self.assertEqual(self.model.holders.tolist(), [1, 1, 2, 2, 2])
+        self.assertEqual(sorted(self.model.txs), [0, 1, 2, 3, 4])  # 0 and 1 are still in b's mempool
+
+        self.b.max_mempool_bytes = Transaction.SIZE
+        self.model.trim(self.b)
+        self.assertEqual(self.b.tx_pool.indices().tolist(), [4])
+        self.assertEqual(self.model.holders.tolist(), [0, 0, 1, 1, 2])
+        self.assertEqual(sorted(self.model.txs), [2, 3, 4])
+
+    def test_trim_skips_mined(self):
+        self.a.max_mempool_bytes = 5 * Transaction.SIZE
+        self.receive_all(self.a)
+        block = BTCBlock(self.a, None, 1)
+        self.a.max_block_size = block.size + Transaction.SIZE
+        self.model.fill_block(self.a, block)  # mines 4, which stays in the eviction heap
+        self.a.max_mempool_bytes = 2 * Transaction.SIZE
+        self.model.trim(self.a)
+        self.assertEqual(self.a.tx_pool.indices().tolist(), [2, 3])
+        self.assertEqual(self.model.holders.tolist(), [0, 0, 1, 1, 0])
+        self.assertEqual(sorted(self.model.txs), [2, 3])
+
+
+class SimpleTxModelTest(unittest.TestCase):
+    """The shared mempool fills blocks by feerate and evicts the lowest feerates once full."""
+
+    def mempool(self, count, max_mempool_bytes=0, seed=7):
+        """
+        Returns a model and its miner with `count` transactions generated at step 1 and drawn.
+        """
+        rng.seed(seed)
+        model = SimpleTxModel()
+        node, = network(1, tx_model=model)
+        node.max_mempool_bytes = max_mempool_bytes
+        node.timestamp = 1
+        model.generate_many(node, count)
+        model.flush()
+        return model, node
+
+    def columns(self, model):
+        return dict(zip(model.ids[:model.count].tolist(), model.feerate[:model.count].tolist()))
+
+    def block(self, model, node, txs):
+        block = BTCBlock(node, None, 1)
+        node.max_block_size = block.size + txs * Transaction.SIZE
+        return model.fill_block(node, block)
+
+    def test_fill_block_by_feerate(self):
+        model, node = self.mempool(50)
+        feerates = self.columns(model)
+        block = self.block(model, node, 20)
+        expected = sorted(feerates, key=lambda i: -feerates[i])[:20]
+        self.assertEqual(block.tx_ids.tolist(), expected)
+        self.assertEqual(block.tx_count, 20)
+        self.assertEqual(model.count, 30)
+        self.assertEqual(model.mempool_bytes, 30 * Transaction.SIZE)
+        self.assertEqual(self.columns(model), {i: feerates[i] for i in sorted(feerates) if i not in expected})
+
+    def test_partial_last_tx(self):
+        model, node = self.mempool(10)
+        block = BTCBlock(node, None, 1)
+        node.max_block_size = block.size + 2.5 * Transaction.SIZE
+        model.fill_block(node, block)
+        self.assertEqual(block.tx_count, 3)  # added while the block is below the maximum size
+
+    def test_fill_block_empties_small_mempool(self):
+        model, node = self.mempool(10)
+        feerates = self.columns(model)
+        block = self.block(model, node, 20)
+        self.assertEqual(block.tx_ids.tolist(), sorted(feerates, key=lambda i: -feerates[i]))
+        self.assertEqual(model.count, 0)
+        self.assertEqual(model.mempool_bytes, 0)
+
+    def test_limit_evicts_lowest_feerates(self):
+        feerates = self.columns(self.mempool(25)[0])
+        model, node = self.mempool(25, max_mempool_bytes=10 * Transaction.SIZE)
+        kept = sorted(feerates, key=lambda i: -feerates[i])[:10]
+        self.assertEqual(sorted(self.columns(model)), sorted(kept))
+        self.assertEqual(model.mempool_bytes, 10 * Transaction.SIZE)
+        self.assertEqual(model.evictions, 15)
+        evicted = max(feerates[i] for i in feerates if i not in kept)
+        self.assertGreater(model.min_feerate.value, evicted)
+
+    def test_limit_rejects_below_min_feerate(self):
+        limit = 10 * Transaction.SIZE
+        model, node = self.mempool(25, max_mempool_bytes=limit)
+        min_feerate = copy.deepcopy(model.min_feerate).get(2 * node.iter_seconds, model.mempool_bytes, limit)
+        kept = self.columns(model)
+        node.timestamp = 2
+        model.generate_many(node, 25)
+        model.flush()
+
+        reference, reference_node = self.mempool(25)  # same draws without a limit
+        reference_node.timestamp = 2
+        reference.generate_many(reference_node, 25)
+        reference.flush()
+        new = {i: f for i, f in self.columns(reference).items() if i >= 25}
+        accepted = {i: f for i, f in new.items() if f >= min_feerate}
+        self.assertEqual(model.rejections, len(new) - len(accepted))
+        self.assertGreater(model.rejections, 0)
+
+        candidates = {**kept, **accepted}
+        expected = sorted(candidates, key=lambda i: -candidates[i])[:10]
+        self.assertEqual(sorted(self.columns(model)), sorted(expected))
+        self.assertEqual(model.evictions, 15 + len(candidates) - 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import gc
+import unittest
+
+from sim import rng
+from sim.util import SimpleAddress, generate_uuid
+
+
+class RandomAddressTest(unittest.TestCase):
+    """Fresh node ids only depend on the seed of the run."""
+
+    def draw(self, seed):
+        rng.seed(seed)
+        return [SimpleAddress.randomaddress(fresh=True) for _ in range(100)]
+
+    def test_same_seed_same_ids(self):
+        self.assertEqual(self.draw(3), self.draw(3))
+
+    def test_fresh_ids_are_distinct(self):
+        self.assertEqual(len(set(self.draw(3))), 100)
+
+
+class InternTest(unittest.TestCase):
+    """Interned addresses are shared while in use and freed afterwards."""
+
+    def test_same_object_while_in_use(self):
+        address = SimpleAddress(7, 7)
+        self.assertIs(SimpleAddress(7, 7), address)
+        self.assertIs(SimpleAddress.from_int(int(address)), address)
+
+    def test_unused_addresses_are_freed(self):
+        packed = int(SimpleAddress(8, 8))
+        gc.collect()
+        self.assertNotIn(packed, SimpleAddress._interned)
+        self.assertEqual(int(SimpleAddress.from_int(packed)), packed)
+
+
+class GenerateUuidTest(unittest.TestCase):
+    """Item ids only depend on the creating node and the seed."""
+
+    def test_ids_do_not_depend_on_node_order(self):
+        a, b = SimpleAddress(1, 1), SimpleAddress(1, 2)
+        rng.seed(3)
+        first = [(generate_uuid(a), generate_uuid(b)) for _ in range(3)]
+        rng.seed(3)
+        ids_b = [generate_uuid(b) for _ in range(3)]
+        ids_a = [generate_uuid(a) for _ in range(3)]
+        self.assertEqual(first, list(zip(ids_a, ids_b)))
+        self.assertEqual(len(set(ids_a + ids_b)), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,23 +1,29 @@
 import importlib
+import json
+import math
 import pickle
 import argparse
+from collections import Counter
 from pathlib import Path
 from typing import Callable
 
-import psutil
+import numpy as np
 import yaml
 import time
 from loguru import logger
 
 from sim.base_models import Node
 from sim.util import Region, SimpleAddress
+from sim import rng, topology, warm_start
+from sim.traffic import TrafficCounter
 from bitcoin.tx_modelings import *
 from bitcoin.models import Miner
 from bitcoin.mining_strategies import *
 from bitcoin.consensus import *
 from bitcoin.bookkeeper import *
-from bitcoin.malicious_nodes import EclipseAttacker
-from plot.network import NetworkPlot
+from bitcoin.analysis import Analysis
+from bitcoin.stopping import StoppingRule
+from bitcoin.malicious_nodes import EclipseAttacker, EclipseController
 
 
 node_mode = {
@@ -27,7 +33,12 @@ node_mode = {
 
 
 class Simulation:
-    def __init__(self, config_file=None):
+    def __init__(self, config_file=None, config: dict = None):
+        """
+        Create a Simulation object, configured either with code, a YAML file or an already parsed configuration.
+        * config_file (str): Path of a YAML configuration file (see `config.yaml`).
+        * config (dict): Configuration with the same keys as the YAML file; takes precedence over `config_file`.
+        """
         self.node_storage = NodeStorage()
         self.message_storage = MessageStorage()
         self.name = ""
@@ -38,50 +49,134 @@ class Simulation:
         self.iter_seconds = 0.1
         self.block_int_iters = 6000
         self.max_block_size = 10 ** 6
+        self.max_mempool_bytes = 0
+        """Maximum mempool size of every node in bytes, beyond which low feerate transactions are evicted (0 for no limit)."""
         self.connections_per_node = 2
         self.tx_per_node_per_iter = 0
         self.nodes_in_each_region = -1
         self.set_log_level(self.log_level)
         self.config_file = config_file
+        self.config = config
         self.dynamic = False
         self.block_reward = 100
 
         self.bookkeeper = Bookkeeper()
         self.nodes = []
         self.connection_predicate: Callable[[Node, Node], bool] = None
+        self.topology: Callable[[int, np.random.Generator], np.ndarray] = None
+        """Optional edge list generator (see `sim.topology`) used instead of `connection_predicate` when configuring with code."""
+        self.topology_name = 'random_k_out'
+        self.rewire_prob = 0.1
+        self.traffic_accounting = False
+        """Count messages and bytes per node and per link, see `sim.traffic.TrafficCounter`."""
+        self.traffic_sample_iters = 0
+        """Record per-node traffic totals every this many iterations (0 to disable sampling)."""
+        self.traffic: TrafficCounter = None
+        self.warm_start_iters = 0
+        """Bootstrap the network for this many iterations and cache a snapshot to fork from (0 to disable), see `sim.warm_start`."""
+        self.warm_start_dir = 'tmp/zelig/warm_start'
+        self.resource_sample_iters = 100
+        """Record every node's storage and compute use every this many iterations (0 to disable), see `Bookkeeper.sample_resources`."""
+        self.prune_depth = 0
+        """Nodes keep full blocks only within this many blocks of their tip and headers beyond it (0 to keep all)."""
+        self.eclipse: EclipseController = None
+        """Controller of the eclipse attackers, stepped in their place; see `bitcoin.malicious_nodes.EclipseController`."""
+        self.stopping: StoppingRule = None
+        """Optional rule to end repetitions before `sim_iters`, see `bitcoin.stopping.StoppingRule`."""
+        self.seed: int = None
+        """
+        Master seed of all random streams (see `sim.rng`); every repetition derives its own streams from it.
+        Defaults to fresh entropy, which is logged. Nodes created with code before `run` draw their ids
+        from the current `sim.rng.streams`; call `sim.rng.seed` before creating them to fix their ids too.
+        """
 
-    def run(self, report_time=False, track_perf=False):
+    def run(self, report_time=False, track_perf=False, headless=False, profile=False):
+        """
+        Run all repetitions of the simulation.
+        * report_time (bool): Log wall-clock time of every repetition.
+        * track_perf (bool): Sample CPU and memory usage (requires psutil).
+        * headless (bool): Batch mode: skip message recording, plotting and the bookkeeper dump, and only write
+          the metrics summary of every repetition.
+        * profile (bool): Record time and call counts of the step phases, message handlers, `send_to` and the
+          tx model, see `sim.profiling.Profiler`. The results are saved as `profile.json` next to the bookkeeper.
+
+        Returns the list of metrics summaries, one per repetition.
+        """
+        summaries = []
         cpu_percents, mem_percents = [], []
-        if self.config_file is not None:
+        if track_perf:
+            import psutil
+        self.message_storage.enabled = not headless
+        configured = self.config_file is not None or self.config is not None
+        if configured:
             self.__load_config_file(detailed=False)
 
         iter_seconds = self.iter_seconds
+        entropy = rng.entropy(self.seed)
         logger.warning(
-            f'Simulation {self.name} ({self.sim_iters} iterations).')
+            f'Simulation {self.name} ({self.sim_iters} iterations, seed {entropy}).')
         for rep in range(self.sim_reps):
-            if self.config_file is not None:
-                self.__load_config_file(detailed=True)
+            rng.seed(entropy, rep)
+            self.bookkeeper.reset()
+            if configured:
+                self.__load_config_file(detailed=True, rep=rep, entropy=entropy)
             else:
-                [node.reset() for node in self.nodes]
-                for idx, n1 in enumerate(self.nodes):
-                    for n2 in self.nodes[:idx] + self.nodes[idx + 1:]:
-                        if self.connection_predicate(n1, n2):
-                            n1.connect(n2)
-                            # n2.connect(n1)
+                for node in self.nodes:
+                    node.reset()
+                    node.rng = rng.streams.stream('node', node.index)
+                if self.topology is not None:
+                    edges = self.topology(len(self.nodes), self.__topology_rng())
+                    topology.connect_edges(self.nodes, edges)
+                else:
+                    for idx, n1 in enumerate(self.nodes):
+                        for n2 in self.nodes[:idx] + self.nodes[idx + 1:]:
+                            if self.connection_predicate(n1, n2):
+                                n1.connect(n2)
+                                # n2.connect(n1)
                 self.__setup_mining()
 
+            self.traffic = TrafficCounter() if self.traffic_accounting else None
+            for node in self.nodes:
+                node.traffic = self.traffic
+            sample_iters = self.traffic_sample_iters if self.traffic is not None else 0
+            resource_iters = self.resource_sample_iters
+            profiler = None
+            if profile:
+                from sim.profiling import Profiler
+                profiler = Profiler()
+                profiler.install(self.tx_modeling)
+            if self.stopping is not None:
+                self.stopping.start()
             start_time = time.time()
+            start_messages = self.message_storage.count
             sim_name = f'{self.name}_{rep}'
+            iters, stop_reason = self.sim_iters, None
             logger.warning('Started simulation.')
+            stepped = self.__stepped_nodes()
             for i in range(1, self.sim_iters):
-                [node.step(iter_seconds) for node in self.nodes]
+                [node.step(iter_seconds) for node in stepped]
+                if sample_iters and i % sample_iters == 0:
+                    self.traffic.sample(i)
+                if resource_iters and i % resource_iters == 0:
+                    self.bookkeeper.sample_resources(self.nodes, i)
                 if track_perf and i % 1000 == 0:
                     cpu_percents.append(psutil.cpu_percent())
                     mem_percents.append(psutil.virtual_memory().percent)
+                if self.stopping is not None:
+                    stop_reason = self.stopping.check(self.bookkeeper, self.nodes)
+                    if stop_reason is not None:
+                        iters = i + 1
+                        logger.warning(f'Stopping early after {i} iterations ({stop_reason}).')
+                        break
             end_time = time.time()
-            plot = NetworkPlot()
-            plot.plot(self.nodes)
-            self.message_storage.node_result_to_file()
+            if self.eclipse is not None:
+                self.eclipse.sync()
+            if profiler is not None:
+                profiler.uninstall()
+            if not headless:
+                from plot.network import NetworkPlot
+                NetworkPlot().plot(self.nodes)
+                self.message_storage.node_result_to_file()
             try:
                 if report_time:
                     logger.warning(
@@ -97,8 +192,27 @@ class Simulation:
                     logger.warning(f'Maximum MEM:\t{round(max(mem_percents), 1)}%')
             except:
                 pass
-            logger.warning('Finished simulation. Saving nodes...')
             Path(f'{self.results_dir}/{sim_name}').mkdir(parents=True, exist_ok=True)
+            summary = Analysis(self.bookkeeper, self.nodes).summary(iters * iter_seconds)
+            summary.update(name=sim_name, iters=iters, wall_seconds=end_time - start_time,
+                           messages=self.message_storage.count - start_messages)
+            if self.stopping is not None:
+                summary.update(stopped_early=stop_reason is not None, stop_reason=stop_reason,
+                               estimates=self.stopping.estimate(self.bookkeeper, self.nodes))
+            if self.traffic is not None:
+                totals = self.traffic.totals()
+                summary.update(traffic_msgs=int(totals['sent_msgs'].sum()), traffic_bytes=float(totals['sent_bytes'].sum()))
+                self.traffic.to_file(f'{self.results_dir}/{sim_name}/traffic.npz')
+            summaries.append(summary)
+            with open(f'{self.results_dir}/{sim_name}/summary.json', 'w+') as f:
+                json.dump(summary, f)
+            if profiler is not None:
+                profiler.report()
+                profiler.to_file(f'{self.results_dir}/{sim_name}/profile.json')
+            if headless:
+                logger.warning(f'Simulation {sim_name} done. Saved summary to {self.results_dir}/{sim_name}')
+                continue
+            logger.warning('Finished simulation. Saving nodes...')
             for node in self.nodes:
                 pass
                 # with open(f'{self.results_dir}/{sim_name}/{node.name}', 'wb+') as f:
@@ -107,13 +221,18 @@ class Simulation:
                 pickle.dump(self.bookkeeper, f)
             logger.warning(
                 f'Simulation {sim_name} done. Saved nodes to {self.results_dir}/{sim_name}')
+        return summaries
 
     def add_node(self, node: Node):
+        node.index = len(self.nodes)
+        node.rng = rng.streams.stream('node', node.index)
         self.bookkeeper.register_node(node)
         node.message_storage = self.message_storage
         node.tx_model = self.tx_modeling
         node.tx_per_iter = self.tx_per_node_per_iter
         node.max_block_size = self.max_block_size
+        node.max_mempool_bytes = self.max_mempool_bytes
+        node.prune_depth = self.prune_depth
         self.nodes.append(node)
 
     def __setup_mining(self):
@@ -126,32 +245,64 @@ class Simulation:
             node.mine_strategy.receive_block(node, genesis_block, shallow=True)
             node.mine_strategy.setup(node)
 
-    def __load_config_file(self, detailed=False):
-        with open(self.config_file, 'r') as f:
-            config = yaml.safe_load(f)
-            self.name = config['sim_name']
-            self.results_dir = config['results_directory']
-            self.sim_reps = config['sim_reps']
-            self.sim_iters = config['sim_iters']
-            self.iter_seconds = config['iter_seconds']
-            self.tx_per_node_per_iter = config['tx_per_node_per_iter']
-            self.block_int_iters = config['block_int_iters']
-            self.max_block_size = config['max_block_size']
-            self.tx_modeling = config['tx_modeling'] + 'TxModel'
-            self.nodes_in_each_region = config['nodes_in_each_region']
-            self.connections_per_node = config['connections_per_node']
-            self.dynamic = config['dynamic_difficulty']
-            self.block_reward = config['block_reward']
-            self.malicious_nodes_ratio = config['malicious_nodes_ratio']
-            self.set_log_level(config['log_level'])
-
-            if detailed:
-                TxClass = getattr(importlib.import_module(
-                    'bitcoin.tx_modelings'), self.tx_modeling)
-                self.tx_modeling = TxClass()
-                mine_strategy = HonestMining()
-                logger.warning('Creating nodes...')
-                self.nodes = []
+    @staticmethod
+    def __topology_rng() -> np.random.Generator:
+        return rng.streams.numpy_stream('topology')
+
+    def __load_config_file(self, detailed=False, rep=0, entropy=None):
+        if self.config is not None:
+            config = self.config
+        else:
+            with open(self.config_file, 'r') as f:
+                config = yaml.safe_load(f)
+        self.name = config['sim_name']
+        self.results_dir = config['results_directory']
+        self.sim_reps = config['sim_reps']
+        self.sim_iters = config['sim_iters']
+        self.iter_seconds = config['iter_seconds']
+        self.tx_per_node_per_iter = config['tx_per_node_per_iter']
+        self.block_int_iters = config['block_int_iters']
+        self.max_block_size = config['max_block_size']
+        self.max_mempool_bytes = config.get('max_mempool_bytes', self.max_mempool_bytes)
+        self.tx_modeling = config['tx_modeling'] + 'TxModel'
+        self.nodes_in_each_region = config['nodes_in_each_region']
+        self.connections_per_node = config['connections_per_node']
+        self.dynamic = config['dynamic_difficulty']
+        self.block_reward = config['block_reward']
+        self.malicious_nodes_ratio = config['malicious_nodes_ratio']
+        self.topology_name = config.get('topology', self.topology_name)
+        self.rewire_prob = config.get('topology_rewire_prob', self.rewire_prob)
+        self.traffic_accounting = config.get('traffic_accounting', self.traffic_accounting)
+        self.traffic_sample_iters = config.get('traffic_sample_iters', self.traffic_sample_iters)
+        self.warm_start_iters = config.get('warm_start_iters', self.warm_start_iters)
+        self.warm_start_dir = config.get('warm_start_dir', self.warm_start_dir)
+        self.prune_depth = config.get('prune_depth', self.prune_depth)
+        self.resource_sample_iters = config.get('resource_sample_iters', self.resource_sample_iters)
+        if config.get('stopping', None):
+            self.stopping = StoppingRule(**config['stopping'])
+        if self.seed is None:
+            self.seed = config.get('seed', None)
+        self.set_log_level(config['log_level'])
+
+        if detailed:
+            TxClass = getattr(importlib.import_module(
+                'bitcoin.tx_modelings'), self.tx_modeling)
+            self.tx_modeling = TxClass()
+            mine_strategy = HonestMining()
+            topology_file = config.get('topology_file', None)
+            snapshot, snapshot_path = None, None
+            if self.warm_start_iters:
+                snapshot_key = warm_start.key(config, self.warm_start_iters, entropy, rep)
+                snapshot_path = f'{self.warm_start_dir}/{snapshot_key}.pickle'
+                snapshot = warm_start.load(snapshot_path)
+            logger.warning('Creating nodes...')
+            self.nodes = []
+            self.node_storage.clear()  # nodes of earlier repetitions and simulations
+            self.eclipse = None
+            if topology_file:
+                edges = self.__create_nodes_from_file(config, topology_file, mine_strategy)
+                mine_power, region = 0, config['nodes'][-1]['region']
+            else:
                 for node in config['nodes']:
                     num_nodes = node['count'] if self.nodes_in_each_region == - \
                         1 else self.nodes_in_each_region
@@ -161,35 +312,97 @@ class Simulation:
                     for idx in range(num_nodes):
                         node = node_mode_class(
                             f'MINER_{region}_{idx}', mine_power, Region(region), self.iter_seconds)
-                        self.add_node(node)
-                        node.message_storage = self.message_storage
-                        node.mine_strategy = mine_strategy
-                        self.node_storage.add(node)
-                        node.node_storage = self.node_storage
+                        self.__add_config_node(node, mine_strategy)
 
-                self.__setup_mining()
+            self.__setup_mining()
 
-                logger.warning('Setting up random P2P network...')
-                for node in self.nodes:
-                    node_index = self.nodes.index(node)
-                    first_part = self.nodes[:node_index]
-                    second_part = self.nodes[node_index + 1:]
-                    for i in range(self.connections_per_node):
-                        n2 = random.choice(first_part + second_part)
-                        node.connect(n2)
-
-                logger.warning('Setting up malicious nodes...')
-                if config['add_malicious_nodes']:
-                    victim_node = random.randint(0, len(self.nodes)-1)
-                    self.nodes[victim_node].name = "VICTIM_" + self.nodes[victim_node].name
-                    for idx in range(int(len(self.nodes) * self.malicious_nodes_ratio / (1 - self.malicious_nodes_ratio))):
-                        enode = EclipseAttacker(
-                            f'ECLIPSEATTACKER_{idx}', mine_power, Region(region), self.iter_seconds)
-                        enode.victim_node = self.nodes[victim_node]
-                        self.add_node(enode)
-                        enode.mine_strategy = NullMining()
-                        self.node_storage.add(enode)
-                        enode.node_storage = self.node_storage
+            if snapshot is not None:
+                logger.warning('Skipping P2P network setup, connections come from the warm start snapshot')
+            elif topology_file:
+                logger.warning(f'Connecting nodes from {topology_file}...')
+                topology.connect_edges(self.nodes, edges, handshake=False)
+            else:
+                logger.warning(f'Setting up {self.topology_name} P2P network...')
+                region_weights = np.zeros(len(Region))
+                for entry in config['nodes']:
+                    region_weights[list(Region).index(Region(entry['region']))] = entry['region_mine_power']
+                edges = topology.generate(
+                    self.topology_name, len(self.nodes), self.connections_per_node, self.__topology_rng(),
+                    regions=np.array([list(Region).index(node.region) for node in self.nodes]),
+                    weights=region_weights, rewire_prob=self.rewire_prob)
+                topology.connect_edges(self.nodes, edges)
+
+            logger.warning('Setting up malicious nodes...')
+            if config['add_malicious_nodes']:
+                victim_node = rng.streams.stream('attack').randrange(len(self.nodes))
+                self.nodes[victim_node].name = "VICTIM_" + self.nodes[victim_node].name
+                self.eclipse = EclipseController(self.nodes[victim_node])
+                for idx in range(int(len(self.nodes) * self.malicious_nodes_ratio / (1 - self.malicious_nodes_ratio))):
+                    enode = EclipseAttacker(
+                        f'ECLIPSEATTACKER_{idx}', mine_power, Region(region), self.iter_seconds)
+                    self.add_node(enode)
+                    self.eclipse.add(enode)
+                    enode.mine_strategy = NullMining()
+                    self.node_storage.add(enode)
+                    enode.node_storage = self.node_storage
+
+            if self.warm_start_iters:
+                self.__warm_start(snapshot, snapshot_path)
+
+    def __warm_start(self, snapshot, path: str):
+        """
+        Fork the network from a cached bootstrap snapshot, or bootstrap it and cache the snapshot.
+        """
+        if snapshot is not None and warm_start.restore(snapshot, self.nodes):
+            logger.warning(f'Forked bootstrapped network from {path}')
+            return
+        if snapshot is not None:
+            raise ValueError(f'Snapshot {path} does not match the configured nodes')
+        logger.warning(f'Bootstrapping network for {self.warm_start_iters} iterations...')
+        stepped = self.__stepped_nodes()
+        for _ in range(self.warm_start_iters):
+            for node in stepped:
+                node.network_step(self.iter_seconds)
+        snapshot = warm_start.capture(self.nodes)
+        warm_start.save(path, snapshot)
+        # continue exactly like a fork of the snapshot
+        warm_start.restore(snapshot, self.nodes)
+        logger.warning(f'Saved bootstrapped network to {path}')
+
+    def __stepped_nodes(self) -> list:
+        """
+        Returns the nodes to step in every iteration: all nodes, with the eclipse controller in place of its attackers.
+        """
+        if self.eclipse is None:
+            return list(self.nodes)
+        return [node for node in self.nodes if node not in self.eclipse] + [self.eclipse]
+
+    def __add_config_node(self, node: Node, mine_strategy):
+        self.add_node(node)
+        node.message_storage = self.message_storage
+        node.mine_strategy = mine_strategy
+        self.node_storage.add(node)
+        node.node_storage = self.node_storage
+
+    def __create_nodes_from_file(self, config, path: str, mine_strategy) -> np.ndarray:
+        """
+        Create one node per entry of a topology snapshot (see `sim.topology.load_edge_list`) and return its edge list.
+        Nodes without a region are placed in the first configured region; nodes without a mining power share
+        their region's `region_mine_power` equally.
+        """
+        names, regions, powers, edges = topology.load_edge_list(path)
+        entries = {entry['region']: entry for entry in config['nodes']}
+        regions = [region or config['nodes'][0]['region'] for region in regions]
+        region_counts = Counter(regions)
+        for name, region, mine_power in zip(names, regions, powers.tolist()):
+            entry = entries.get(region, None)
+            if math.isnan(mine_power):
+                mine_power = entry['region_mine_power'] / region_counts[region] if entry else 0
+            node_mode_class = node_mode[entry['node_mode']] if entry else Miner
+            node = node_mode_class(f'MINER_{region}_{name}', mine_power, Region(region), self.iter_seconds)
+            self.__add_config_node(node, mine_strategy)
+        logger.warning(f'Loaded {len(names)} nodes and {len(edges)} connections from {path}')
+        return edges
 
     @staticmethod
     def set_log_level(level: str):
@@ -203,6 +416,10 @@ if __name__ == "__main__":
                         help='Name of the YAML configuration file (default: config.yaml)')
     parser.add_argument('-s', metavar='seed', type=int,
                         help='Seed for random number generation')
+    parser.add_argument('--headless', action='store_true',
+                        help='Batch mode: no plots, message logs or perf tracking; only write metrics summaries')
+    parser.add_argument('--profile', action='store_true',
+                        help='Record time spent per step phase, message type and tx model method')
     args = parser.parse_args()
     config_name = args.c
     seed = args.s
@@ -210,13 +427,13 @@ if __name__ == "__main__":
     if config_name[-5:] != '.yaml':
         print('Please provide a YAML file for configuration.')
         exit()
-    if seed is not None:
-        random.seed(seed)
     sim = Simulation(config_name)
+    sim.seed = seed  # overrides the seed of the config file
 
-    sim.run(report_time=True, track_perf=True)
+    sim.run(report_time=True, track_perf=not args.headless, headless=args.headless, profile=args.profile)
+    if args.headless:
+        exit()
 
-    import json
     required_nodes = {}
     for address, node in sim.node_storage.nodes.items():
         if "MALICIOUSNODE" in node.name or "VICTIM_" in node.name: